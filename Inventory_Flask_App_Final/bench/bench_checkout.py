@@ -0,0 +1,88 @@
+"""Concurrent checkout benchmark.
+
+Starts WORKERS processes that each fill and check out CHECKOUTS carts
+against one shared data directory, then reports throughput, latency and
+whether any stock was lost or oversold. Run from this directory:
+
+    python bench/bench_checkout.py [--backend sqlite] [--workers 4] [--checkouts 200]
+"""
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "flask_app.py")
+ITEMS = 50
+
+
+def load_app(data_dir, backend):
+    os.environ["INVENTORY_DATA_DIR"] = data_dir
+    os.environ["INVENTORY_BACKEND"] = backend
+    spec = importlib.util.spec_from_file_location(f"inventory_app_{os.getpid()}", APP)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def worker(data_dir, backend, checkouts, seed):
+    app = load_app(data_dir, backend)
+    rng = random.Random(seed)
+    iids = [f"B{i:03d}" for i in range(ITEMS)]
+    sold, latencies, short = Counter(), [], 0
+    for _ in range(checkouts):
+        cart_id = app.CARTS.new_id()
+        picked = rng.sample(iids, rng.randint(1, 3))
+        app.add_cart_lines(cart_id, [(n, iid, rng.randint(1, 3)) for n, iid in enumerate(picked, 1)])
+        started = time.perf_counter()
+        sale, missing = app.checkout_cart(cart_id)
+        latencies.append(time.perf_counter() - started)
+        if sale is None:
+            short += 1
+            app.CARTS.clear(cart_id)
+            continue
+        for line in sale["lines"]:
+            sold[line["id"]] += line["qty"]
+    return sold, latencies, short
+
+
+def run(backend, workers, checkouts, quantity):
+    with tempfile.TemporaryDirectory() as data_dir:
+        app = load_app(data_dir, backend)
+        initial = {f"B{i:03d}": {"name": f"Bench {i}", "quantity": quantity, "price": 1.0} for i in range(ITEMS)}
+        app.STORE.put_many(initial)
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(workers) as pool:
+            started = time.perf_counter()
+            results = pool.starmap(worker, [(data_dir, backend, checkouts, seed) for seed in range(workers)])
+            elapsed = time.perf_counter() - started
+        sold = sum((s for s, _, _ in results), Counter())
+        latencies = sorted(l for _, ls, _ in results for l in ls)
+        short = sum(s for _, _, s in results)
+        final = {iid: d["quantity"] for iid, d in load_app(data_dir, backend).STORE.get_many(initial).items()}
+        consistent = all(final[iid] >= 0 and quantity - final[iid] == sold[iid] for iid in initial)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(f"{backend:8} {workers} workers  {len(latencies) / elapsed:7.1f} checkouts/s  "
+              f"median {statistics.median(latencies) * 1000:6.1f} ms  p95 {p95 * 1000:6.1f} ms  "
+              f"short {short:4}  {'ok' if consistent else 'STOCK MISMATCH'}")
+        return consistent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=["json", "journal", "sqlite"], action="append")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--checkouts", type=int, default=200, help="checkouts per worker")
+    parser.add_argument("--quantity", type=int, default=100, help="starting stock per item; "
+                        "keep it low to make workers compete for the last units")
+    args = parser.parse_args()
+    ok = [run(b, args.workers, args.checkouts, args.quantity) for b in args.backend or ["json", "journal", "sqlite"]]
+    raise SystemExit(0 if all(ok) else 1)
+
+
+if __name__ == "__main__":
+    main()
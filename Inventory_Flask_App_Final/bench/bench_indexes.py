@@ -0,0 +1,132 @@
+"""Index build, reload and substring search benchmark.
+
+For each catalogue size, writes an inventory.json, then times (in a fresh
+process, JSON backend):
+
+  build   the first load_all(): parse the file and build every index
+  reload  load_all() after another worker changed one item in the file
+  touch   the same, for 1% of the items
+
+and reports the process's peak memory. It then times substring search
+(an id match or part of a name, as /search does) through the n-gram
+index against the linear scan over every item that it replaced, for
+short and long terms, checking that both find the same items. Run from
+this directory:
+
+    python bench/bench_indexes.py [--sizes 10000 100000 1000000]
+
+A million items needs several GB of memory.
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "flask_app.py")
+# (label, term): common short grams, a word, longer phrases, an exact id, a miss
+TERMS = (("2 chars", "ge"), ("3 chars", "alv"), ("word", "washer"), ("phrase", "bolt washer"),
+         ("long", "gasket spring nozzle 4"), ("id", "P0000042"), ("miss", "zzqx"))
+WORDS = ("steel", "bolt", "washer", "hinge", "bracket", "cable", "clamp", "valve", "gasket", "spring",
+         "sensor", "relay", "switch", "panel", "filter", "pump", "nozzle", "socket", "lever", "gear")
+
+
+def catalogue(n, seed=1):
+    rng = random.Random(seed)
+    return {f"P{i:07d}": {"name": " ".join(rng.sample(WORDS, 3)) + f" {i}", "quantity": rng.randint(0, 500),
+                          "price": round(rng.uniform(1, 500), 2), "version": 1, "ref": i + 1}
+            for i in range(n)}
+
+
+def write(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)  # new inode, so the store notices even within one mtime tick
+
+
+def peak_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def best(fn, repeat):
+    # fastest of `repeat` runs, in milliseconds, and the last result
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return min(times) * 1000, result
+
+
+def linear_search(items, term):
+    # what /search did before the n-gram index: test every item
+    k = term.lower()
+    return {iid for iid, d in items.items() if k == iid.lower() or k in d["name"].lower()}
+
+
+def measure(data_dir, n):
+    os.environ["INVENTORY_DATA_DIR"] = data_dir
+    os.environ["INVENTORY_BACKEND"] = "json"
+    spec = importlib.util.spec_from_file_location("inventory_app_bench", APP)
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    path = app.STORE.path
+    data = catalogue(n)
+    write(path, data)
+    base = peak_mb()
+    build = timed(app.STORE.load_all)
+    built = peak_mb()
+
+    def change(count):
+        for iid in random.Random(count).sample(sorted(data), count):
+            rec = data[iid]
+            data[iid] = dict(rec, quantity=rec["quantity"] + 1, version=rec["version"] + 1)
+        write(path, data)
+        return timed(app.STORE.load_all)
+    reload_one = change(1)
+    reload_many = change(max(1, n // 100))
+    iid = sorted(data)[-1]
+    assert app.INDEXES.record(iid) == data[iid] and app.NGRAMS.search(iid, exact_id=True) == {iid}
+    items = app.STORE.load_all()
+    searches = []
+    for label, term in TERMS:
+        indexed, found = best(lambda: app.NGRAMS.search(term, exact_id=True), 20)
+        scanned, expected = best(lambda: linear_search(items, term), 3)
+        assert found == expected, term
+        searches.append((label, term, len(found), indexed, scanned))
+    return build, reload_one, reload_many, built - base, peak_mb(), searches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    print(f"{'items':>9}  {'build':>8}  {'reload':>8}  {'touch 1%':>8}  {'indexes':>9}  {'peak':>9}")
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as data_dir, ctx.Pool(1) as pool:
+            build, one, many, grew, peak, results[n] = pool.apply(measure, (data_dir, n))
+        print(f"{n:>9}  {build:7.2f}s  {one:7.3f}s  {many:7.3f}s  {grew:6.0f} MB  {peak:6.0f} MB")
+    print(f"\n{'items':>9}  {'term':<32}  {'hits':>7}  {'index':>10}  {'scan':>10}  {'speedup':>8}")
+    for n, searches in results.items():
+        for label, term, hits, indexed, scanned in searches:
+            print(f"{n:>9}  {label + ' ' + repr(term):<32}  {hits:>7}  {indexed:7.3f} ms  {scanned:7.1f} ms  "
+                  f"{scanned / max(indexed, 1e-6):7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,144 +1,2992 @@
 import os
+import base64
+import bisect
+import csv
+import heapq
+import io
+import itertools
 import json
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from datetime import datetime
+import math
+import re
+import secrets
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+import click
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from flask import Flask, Response, abort, render_template, request, redirect, url_for, flash, session, jsonify
+from datetime import datetime, timedelta
 
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_FILE = os.path.join(APP_DIR, "inventory.json")
+DATA_DIR = os.environ.get("INVENTORY_DATA_DIR", APP_DIR)  # where the data files below live
+DATA_FILE = os.path.join(DATA_DIR, "inventory.json")
+DB_FILE = os.path.join(DATA_DIR, "inventory.db")
+CARTS_FILE = os.path.join(DATA_DIR, "carts.db")  # server-side carts, whatever the backend
+CART_TTL_SECONDS = int(os.environ.get("INVENTORY_CART_TTL", str(2 * 3600)))  # idle carts expire after this
+HOLD_TTL_SECONDS = int(os.environ.get("INVENTORY_HOLD_TTL", str(15 * 60)))  # cart lines hold stock this long
+CART_CACHE_SIZE = 1000  # carts each worker keeps in memory
+CART_SWEEP_SECONDS = 60.0  # how often expired carts are deleted
+CHECKOUT_CLAIM_SECONDS = 60.0  # a checkout that hasn't finished by then is presumed dead
+JOURNAL_FILE = os.path.join(DATA_DIR, "inventory.json.log")
+JOURNAL_COMPACT_BYTES = 1024 * 1024  # fold the journal into a new snapshot past this size
+LEDGER_DIR = os.path.join(DATA_DIR, "sales")  # append-only sales ledger segments
+LEDGER_SEGMENT_BYTES = 16 * 1024 * 1024  # start a new ledger segment past this size
+ROLLUPS_FILE = os.path.join(LEDGER_DIR, "rollups.db")  # hourly/daily sales totals
+GROUP_COMMIT_WINDOW = 0.002  # seconds a commit leader waits for other writers to join
+# "json" (inventory.json), "journal" (inventory.json + append-only
+# inventory.json.log) or "sqlite" (inventory.db, see `flask import-json`)
+STORAGE_BACKEND = os.environ.get("INVENTORY_BACKEND", "json").lower()
 
 app = Flask(__name__)
 app.secret_key = "replace_with_secure_secret"  # keep as-is for local dev
 app.config["SESSION_PERMANENT"] = False
 app.config["SESSION_TYPE"] = "filesystem"
+app.json.compact = True  # no pretty-printed JSON, even under debug
 
-LOW_STOCK_THRESHOLD = 5
+LOW_STOCK_THRESHOLD = 5  # default reorder level; items and categories can override it
+CATEGORIES_FILE = os.path.join(DATA_DIR, "categories.json")  # per-category reorder levels
+# rows per page on the listing views; ?per_page= overrides up to MAX_PAGE_SIZE
+PAGE_SIZE = int(os.environ.get("INVENTORY_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = 500
+SSE_POLL_SECONDS = 1.0       # how often an idle /events stream checks for other workers' writes
+SSE_KEEPALIVE_SECONDS = 15.0  # comment line that keeps idle proxies from closing the stream
+EVENT_BACKLOG = 1000          # recent events kept for clients resuming with Last-Event-ID
+AUTOCOMPLETE_LIMIT = 10  # suggestions per /autocomplete request (max 50)
+API_BATCH_LIMIT = 1000  # entries per /api/v1 batch request
+IMPORT_BATCH_SIZE = 1000  # rows a bulk import upserts per write
+IMPORT_MAX_ERRORS = 1000  # row errors a bulk import lists (all are counted)
+EXPORT_CHUNK = 500  # items read and sent per chunk of an /export stream
 
 # ----------------- persistence helpers -----------------
-def load_inventory():
-    if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump({}, f)
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError:
-            data = {}
+class InventoryCorruptError(RuntimeError):
+    """inventory.json exists but can't be parsed; refuse to treat it as empty."""
+
+class StockUnavailable(Exception):
+    """Not enough of an item is free of other carts' holds."""
+
+    def __init__(self, iid, available):
+        super().__init__(f"only {available} of {iid} available")
+        self.iid, self.available = iid, available
+
+class CheckoutInProgress(Exception):
+    """The cart is already being checked out (e.g. a double-submitted form)."""
+
+class UnreadableUpload(ValueError):
+    """An import upload can't be decoded or parsed from `line` on."""
+
+    def __init__(self, line, error):
+        super().__init__(str(error))
+        self.line = line
+
+class VersionConflict(Exception):
+    """A compare-and-swap write found the item at a different version."""
+
+    def __init__(self, iid, expected, current):
+        super().__init__(f"item {iid} is at version {current.get('version', 0)}, expected {expected}")
+        self.iid, self.expected, self.current = iid, expected, current
+
+def _normalize_record(v):
     # normalize older schemas if any
-    for k, v in list(data.items()):
-        if "quantity" not in v and "qty" in v:
-            v["quantity"] = v.pop("qty")
-    return data
+    if "quantity" not in v and "qty" in v:
+        v["quantity"] = v.pop("qty")
+    # records written before versioning count as version 0
+    v.setdefault("version", 0)
+    return v
+
+# record fields that may be absent: "category" groups items for default
+# reorder levels, "threshold" is the item's own reorder level, "ref" is the
+# item's purchase ref number (assigned by the store, never reused)
+OPTIONAL_FIELDS = ("category", "threshold", "ref")
+
+def reorder_threshold(rec, categories):
+    """Stock level below which an item is low: its own threshold, else its
+    category's (from `categories`), else LOW_STOCK_THRESHOLD."""
+    t = rec.get("threshold")
+    if t is None:
+        t = categories.get(rec.get("category"), LOW_STOCK_THRESHOLD)
+    return t
+
+def _check_version(iid, current, expect_version):
+    if expect_version is not None and current.get("version", 0) != expect_version:
+        raise VersionConflict(iid, expect_version, current)
+
+def _fsync_dir(path):
+    # make a rename durable; directories can't be opened for fsync on Windows
+    if os.name == "posix":
+        fd = os.open(os.path.dirname(path), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def _write_temp(path, data):
+    """Write `data` (bytes, or a dict dumped as JSON) to a fsynced temp file
+    next to `path`; returns the temp path."""
+    if not isinstance(data, bytes):
+        data = json.dumps(data, indent=4).encode("utf-8")
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return tmp
+
+def _install(tmp, path):
+    # atomic on POSIX and Windows: readers see the old file or the new one
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+class GroupCommit:
+    """Shares one durable flush between writers that arrive together.
+
+    Writers apply their change in memory, then call wait(). One of them
+    becomes the leader, lingers for `window` seconds so concurrent writers
+    can join, and runs `flush` once for the whole batch; the others just
+    wait for a flush that started after their change was applied.
+
+    A writer can number its change with ticket() as it applies it (under
+    the lock that orders the changes) and wait(ticket) later. If a flush
+    fails, `flush` calls fail(): every change numbered so far is lost, so
+    each of those writers gets the error instead of a later flush
+    vouching for a change it never wrote.
+    """
+
+    def __init__(self, flush, window=GROUP_COMMIT_WINDOW):
+        self._flush = flush
+        self._window = window
+        self._cond = threading.Condition()
+        self._requested = 0  # last ticket handed out
+        self._durable = 0    # last ticket covered by a finished flush
+        self._leader = False
+        self._failed, self._error = 0, None  # last ticket lost to a failed flush, and why
+        self.stats = {"commits": 0, "flushes": 0}
+
+    def ticket(self):
+        with self._cond:
+            self._requested += 1
+            self.stats["commits"] += 1
+            return self._requested
+
+    def fail(self, error):
+        with self._cond:
+            self._failed, self._error = self._requested, error
+
+    def wait(self, ticket=None):
+        with self._cond:
+            if ticket is None:
+                ticket = self.ticket()
+            while self._durable < ticket:
+                if self._failed >= ticket:
+                    raise self._error
+                if self._leader:
+                    self._cond.wait()
+                    continue
+                self._leader = True
+                self._cond.release()
+                error = None
+                try:
+                    time.sleep(self._window)
+                    with self._cond:
+                        target = self._requested
+                    self._flush()
+                except BaseException as e:
+                    error = e
+                finally:
+                    self._cond.acquire()
+                self._leader = False
+                if error is None:
+                    self._durable = max(self._durable, target)
+                    self.stats["flushes"] += 1
+                self._cond.notify_all()
+                if error is not None:
+                    raise error
+
+class FileLock:
+    """Advisory cross-process lock on a side file (flock / msvcrt).
+
+    Every thread of this process shares the one OS lock: it is taken when
+    the first thread enters and dropped when the last one leaves, so
+    writers in one worker still share a group commit while other workers
+    wait for their turn.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mutex = threading.Lock()
+        self._holders = 0
+        self._fd = None
+
+    def __enter__(self):
+        with self._mutex:
+            if self._holders == 0:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_EX)
+                    else:
+                        while True:
+                            try:
+                                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                                break
+                            except OSError:
+                                pass  # LK_LOCK gives up after ~10s; keep waiting
+                except BaseException:
+                    os.close(fd)
+                    raise
+                self._fd = fd
+            self._holders += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._mutex:
+            self._holders -= 1
+            if self._holders == 0:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+                os.close(self._fd)
+                self._fd = None
+
+class JsonStore:
+    """Whole-document store: every write rewrites inventory.json.
+
+    The parsed inventory is cached in-process and reused until the file
+    changes on disk (mtime/size/inode) or is rewritten through this store.
+    The returned dict is shared, so callers must treat it as read-only.
+
+    Writes go to a fsynced temp file that is renamed over inventory.json,
+    so a crash leaves either the old or the new inventory. Mutations are
+    applied in memory first and group-committed: concurrent writers share
+    one rewrite + fsync. If that fails, the changes it carried are dropped
+    from memory and their writers get the error, so a later write can't
+    save them after all.
+
+    Read-modify-write cycles hold an advisory lock on inventory.json.lock
+    from the fresh read until the change is on disk, so several worker
+    processes can write without losing each other's updates. Plain reads
+    never take the lock.
+
+    Every record carries a `version` that each write bumps. update() and
+    delete() are compare-and-swap on it: the new record is computed from an
+    unlocked read and only installed if the version is still the same.
+
+    New items also get a `ref` number. The last one handed out is kept in
+    `<path>.refs`, written before the inventory itself, so a ref is never
+    reused even after its item is deleted.
+
+    `indexes` (an IndexSet) is brought in line whenever the file is
+    re-read, re-indexing only the items that differ, and updated on every
+    write made through this store.
+    """
+
+    def __init__(self, path, indexes=None):
+        self.path = path
+        self.indexes = indexes if indexes is not None else IndexSet()
+        self._lock = threading.RLock()
+        self._sig = None
+        self._data = None
+        self._committer = GroupCommit(self._flush)
+        self._file_lock = FileLock(path + ".lock")
+        self.refs_path = path + ".refs"
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _signature(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError as e:
+                raise InventoryCorruptError(f"{self.path} is not valid JSON: {e}") from e
+        for v in data.values():
+            _normalize_record(v)
+        return data
+
+    def load_all(self):
+        with self._lock:
+            if not os.path.exists(self.path):
+                _install(_write_temp(self.path, {}), self.path)
+            sig = self._signature()
+            if self._data is not None and self._sig == sig:
+                self.stats["hits"] += 1
+                return self._data
+            self.stats["misses"] += 1
+            self._data, self._sig = self._read(), sig
+            self.indexes.rebuild(self._data)
+            return self._data
+
+    def sync_indexes(self):
+        """Bring the indexes up to date with the file; returns them."""
+        self.load_all()
+        return self.indexes
+
+    def save_all(self, inv):
+        with self._file_lock:
+            with self._lock:
+                self._allocate_refs(inv, 0, max((d.get("ref") or 0 for d in inv.values()), default=0))
+                self._apply(inv, None)
+                ticket = self._committer.ticket()
+            self._committer.wait(ticket)
+
+    def _mutate(self, fn):
+        """Run fn(inv) as one locked read-modify-write and return its result.
+
+        `fn` gets a private copy of the inventory to edit in place and
+        returns (changes, result), where `changes` maps each touched item id
+        to its new record (None if deleted); no changes means no write.
+        """
+        with self._file_lock:
+            with self._lock:
+                base = self.load_all()
+                inv = dict(base)
+                changes, result = fn(inv)
+                if not changes:
+                    return result
+                unnumbered, given = [], []
+                for iid, rec in changes.items():
+                    if rec is not None:
+                        old = base.get(iid, {})
+                        rec["version"] = old.get("version", 0) + 1 if iid in base else 1
+                        if rec.get("ref") is None and old.get("ref") is not None:
+                            rec["ref"] = old["ref"]  # a ref stays with its item
+                        if rec.get("ref") is None:
+                            unnumbered.append(rec)
+                        elif rec["ref"] != old.get("ref"):
+                            given.append(rec["ref"])  # e.g. imported with the item
+                if unnumbered or given:
+                    first = self._allocate_refs(base, len(unnumbered), max(given, default=0))
+                    for i, rec in enumerate(unnumbered):
+                        rec["ref"] = first + i
+                self._apply(inv, changes)
+                ticket = self._committer.ticket()
+            self._committer.wait(ticket)
+        return result
+
+    def _allocate_refs(self, inv, n, floor=0):
+        # reserve n ref numbers above `floor`; the caller holds the file lock
+        try:
+            with open(self.refs_path, "r", encoding="utf-8") as f:
+                last = json.load(f)["last_ref"]
+        except FileNotFoundError:
+            last = max((d.get("ref") or 0 for d in inv.values()), default=0)
+        last = max(last, floor)
+        _install(_write_temp(self.refs_path, {"last_ref": last + n}), self.refs_path)
+        return last + 1
+
+    def assign_refs(self, iids):
+        """Give ref numbers, in the order given, to items that have none."""
+        def fn(inv):
+            changes = {iid: dict(inv[iid]) for iid in iids if iid in inv and inv[iid].get("ref") is None}
+            inv.update(changes)
+            return changes, None
+        self._mutate(fn)
+
+    def get(self, iid):
+        return self.load_all().get(iid)
+
+    def get_many(self, iids):
+        """{item_id: record} for the ids that exist, in the order given."""
+        inv = self.load_all()
+        return {iid: inv[iid] for iid in iids if iid in inv}
+
+    def put(self, iid, rec):
+        self.put_many({iid: rec})
+
+    def put_many(self, items):
+        def fn(inv):
+            changes = {iid: dict(rec) for iid, rec in items.items()}
+            inv.update(changes)
+            return changes, None
+        self._mutate(fn)
+
+    def insert(self, iid, rec):
+        """Add a new item; returns False if the item id is already taken."""
+        def fn(inv):
+            if iid in inv:
+                return None, False
+            inv[iid] = dict(rec)
+            return {iid: inv[iid]}, True
+        return self._mutate(fn)
+
+    def insert_many(self, items):
+        """Add {item_id: record} in one write; returns the ids that were
+        already taken (those items are left out)."""
+        def fn(inv):
+            taken = [iid for iid in items if iid in inv]
+            changes = {iid: dict(rec) for iid, rec in items.items() if iid not in inv}
+            inv.update(changes)
+            return changes, taken
+        return self._mutate(fn)
+
+    def update(self, iid, change, expect_version=None):
+        """Replace an item with change(copy_of_item), compare-and-swap style.
+
+        `change` returns the new record, or None to delete the item. It runs
+        outside the lock and is retried if another writer got to the item
+        first, unless `expect_version` pins the version the caller saw, in
+        which case VersionConflict is raised instead. Returns (before,
+        after); before is None when the item doesn't exist.
+        """
+        while True:
+            before = self.get(iid)
+            if before is None:
+                return None, None
+            _check_version(iid, before, expect_version)
+            after = change(dict(before))
+
+            def fn(inv):
+                current = inv.get(iid)
+                if current is None or current.get("version", 0) != before.get("version", 0):
+                    return None, False
+                if after is None:
+                    del inv[iid]
+                else:
+                    inv[iid] = after
+                return {iid: after}, True
+            if self._mutate(fn):
+                return before, after
+
+    def update_many(self, changes, expect_versions=None):
+        """Apply {item_id: change} as one write; `change` is as for update()
+        but runs under the lock, against the current record.
+
+        Returns {item_id: (before, after)}, before being None for a missing
+        item, or a VersionConflict for an item not at its version in
+        `expect_versions`; those items are left as they are.
+        """
+        expect_versions = expect_versions or {}
+
+        def fn(inv):
+            written, results = {}, {}
+            for iid, change in changes.items():
+                before = inv.get(iid)
+                if before is None:
+                    results[iid] = (None, None)
+                    continue
+                try:
+                    _check_version(iid, before, expect_versions.get(iid))
+                except VersionConflict as e:
+                    results[iid] = e
+                    continue
+                after = change(dict(before))
+                if after is None:
+                    del inv[iid]
+                else:
+                    inv[iid] = after
+                written[iid] = after
+                results[iid] = (before, after)
+            return written, results
+        return self._mutate(fn)
+
+    def delete(self, iid, expect_version=None):
+        """Delete an item; returns the deleted record, or None if absent."""
+        def fn(inv):
+            current = inv.get(iid)
+            if current is None:
+                return None, None
+            _check_version(iid, current, expect_version)
+            del inv[iid]
+            return {iid: None}, current
+        return self._mutate(fn)
+
+    def _apply(self, inv, changes):
+        # install `inv` in memory; `changes` maps each touched item id to its
+        # new record (None if deleted), or is None for a full replacement.
+        # The next flush makes it durable.
+        self._data = inv
+        self._reindex(inv, changes)
+
+    def _reindex(self, inv, changes):
+        if changes is None:
+            self.indexes.rebuild(inv)
+        else:
+            self.indexes.apply(changes)
+
+    def _flush(self):
+        with self._lock:
+            data = self._data
+        try:
+            tmp = _write_temp(self.path, data)
+            with self._lock:
+                _install(tmp, self.path)
+                self._sig = self._signature()
+        except BaseException as e:
+            self._discard(e)
+            raise
+
+    def _discard(self, error):
+        # a flush failed: drop the unsaved changes it carried (and any applied
+        # since) so the next read comes from disk, and fail their writers
+        with self._lock:
+            self._data = self._sig = None
+            self._committer.fail(error)
+
+    def sorted_by_name(self):
+        return sorted(self.load_all().items(), key=lambda x: x[1]["name"].lower())
+
+    def below_quantity(self, threshold):
+        return {iid: d for iid, d in self.load_all().items() if d.get("quantity", 0) < threshold}
+
+    def deduct(self, wanted, token=None):
+        """Deduct {item_id: qty} all-or-nothing; returns the item ids that are short.
+
+        `token` (a sale id) isn't recorded here: the file can't commit it
+        together with the stock, so a checkout relies on its own record
+        of having deducted (see checkout_cart).
+        """
+        def fn(inv):
+            short = [iid for iid, q in wanted.items()
+                     if iid not in inv or inv[iid].get("quantity", 0) < q]
+            if short:
+                return None, short
+            changes = {iid: dict(inv[iid], quantity=inv[iid]["quantity"] - q)
+                       for iid, q in wanted.items()}
+            inv.update(changes)
+            return changes, []
+        return self._mutate(fn)
+
+class JournaledJsonStore(JsonStore):
+    """inventory.json snapshot plus an append-only journal of mutations.
+
+    Each change appends one compact JSON line per touched item to the
+    journal instead of rewriting the snapshot, and loading replays the
+    journal onto the snapshot. Records hold the full item, so replaying an
+    already-applied prefix is harmless. Group commit here means one fsync
+    of the journal per batch. Once the journal grows past `compact_bytes`
+    a background thread folds it into a new snapshot.
+    """
+
+    def __init__(self, path, log_path, compact_bytes=JOURNAL_COMPACT_BYTES, indexes=None):
+        super().__init__(path, indexes)
+        self.log_path = log_path
+        self.compact_bytes = compact_bytes
+        self._log_pos = 0  # journal bytes already applied to self._data
+        self._unsynced = None  # journal offset of our first append not yet fsynced
+        self._compacting = False
+
+    def _log_inode(self):
+        try:
+            st = os.stat(self.log_path)
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def _replay(self, data, pos):
+        """Apply journal records from byte offset `pos` to `data`.
+
+        Returns the new offset and the set of item ids that were touched.
+        """
+        touched = set()
+        try:
+            f = open(self.log_path, "rb")
+        except FileNotFoundError:
+            return 0, touched
+        with f:
+            f.seek(pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn append at the tail, never acknowledged
+                pos += len(line)
+                entry = json.loads(line)
+                touched.add(entry["id"])
+                if entry["op"] == "put":
+                    data[entry["id"]] = _normalize_record(entry["rec"])
+                else:
+                    data.pop(entry["id"], None)
+        return pos, touched
+
+    def load_all(self):
+        with self._lock:
+            if not os.path.exists(self.path):
+                _install(_write_temp(self.path, {}), self.path)
+            snap_sig = self._signature()
+            log_ino, log_size = self._log_inode()
+            if self._data is not None and self._sig == (snap_sig, log_ino):
+                if log_size == self._log_pos:
+                    self.stats["hits"] += 1
+                    return self._data
+                if log_size > self._log_pos:
+                    # someone else appended: replay just the new tail
+                    self.stats["misses"] += 1
+                    data = dict(self._data)
+                    self._log_pos, touched = self._replay(data, self._log_pos)
+                    self._data = data
+                    self.indexes.apply({iid: data.get(iid) for iid in touched})
+                    return data
+            self.stats["misses"] += 1
+            data = self._read()
+            self._log_pos = self._replay(data, 0)[0]
+            self._data, self._sig = data, (snap_sig, log_ino)
+            self.indexes.rebuild(data)
+            return data
+
+    def save_all(self, inv):
+        # a full rewrite is a new snapshot; the journal restarts empty
+        with self._file_lock, self._lock:
+            self._allocate_refs(inv, 0, max((d.get("ref") or 0 for d in inv.values()), default=0))
+            _install(_write_temp(self.path, inv), self.path)
+            if os.path.exists(self.log_path):
+                os.remove(self.log_path)
+            self._data, self._log_pos, self._unsynced = inv, 0, None
+            self._sig = (self._signature(), None)
+            self.indexes.rebuild(inv)
+
+    def _apply(self, inv, changes):
+        lines = []
+        for iid, rec in changes.items():
+            entry = {"op": "del", "id": iid} if rec is None else {"op": "put", "id": iid, "rec": rec}
+            lines.append(json.dumps(entry, separators=(",", ":")).encode("utf-8") + b"\n")
+        with open(self.log_path, "ab") as f:
+            start = f.seek(0, os.SEEK_END)
+            f.write(b"".join(lines))
+            end = f.tell()
+        if self._unsynced is None:
+            self._unsynced = start
+        self._data, self._log_pos = inv, end
+        self._sig = (self._sig[0], self._log_inode()[0])
+        self._reindex(inv, changes)
+        if end >= self.compact_bytes and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._compact, daemon=True).start()
+
+    def _flush(self):
+        # appends are already in the OS; one fsync makes the whole batch durable
+        with self._lock:
+            start, end = self._unsynced, self._log_pos
+        try:
+            with open(self.log_path, "ab") as f:
+                os.fsync(f.fileno())
+        except BaseException as e:
+            self._discard(e)
+            raise
+        with self._lock:
+            if self._unsynced == start:  # else compaction already made it all durable
+                self._unsynced = None if self._log_pos == end else end
+
+    def _discard(self, error):
+        # other workers replay whatever is in the journal, so the unsynced
+        # appends must go from the file too, not just from memory. Writers
+        # wait for the flush holding the file lock: the appends past
+        # `_unsynced` are all ours.
+        with self._lock:
+            try:
+                if self._unsynced is not None:
+                    with open(self.log_path, "rb+") as f:
+                        f.truncate(self._unsynced)
+            finally:
+                self._unsynced = None
+                super()._discard(error)
+
+    def _compact(self):
+        try:
+            with self._lock:
+                data, upto, sig = self._data, self._log_pos, self._sig
+            # the snapshot is written outside the locks; writers keep appending
+            tmp = _write_temp(self.path, data)
+            with self._file_lock, self._lock:
+                self.load_all()  # pick up other workers' appends first
+                if self._sig != sig:
+                    os.remove(tmp)  # another worker compacted meanwhile
+                    return
+                with open(self.log_path, "rb") as f:
+                    f.seek(upto)
+                    tail = f.read()
+                _install(tmp, self.path)
+                # crashing here is safe: the old journal replays idempotently
+                _install(_write_temp(self.log_path, tail), self.log_path)
+                self._log_pos, self._unsynced = len(tail), None  # the new journal is fsynced whole
+                self._sig = (self._signature(), self._log_inode()[0])
+        finally:
+            self._compacting = False
+
+class SqliteDatabase:
+    """Per-thread connections to one SQLite file in WAL mode."""
+
+    SCHEMA = ""
+    # columns added after a table's first release, as {(table, column):
+    # declaration}; new databases get them from SCHEMA, older ones on open
+    EXTRA_COLUMNS = {}
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _create(self):
+        """Create SCHEMA and add the EXTRA_COLUMNS an older database lacks.
+
+        Runs as one IMMEDIATE transaction, so workers opening the same
+        file at once take turns instead of racing to add a column; a
+        "duplicate column" still means another worker got there first.
+        """
+        with self._tx() as conn:
+            for statement in self.SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            for (table, col), decl in self.EXTRA_COLUMNS.items():
+                if col in {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}:
+                    continue
+                try:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+                except sqlite3.OperationalError as e:
+                    if "duplicate column" not in str(e):
+                        raise
+
+    def _conn(self):
+        # one connection per thread; transactions are opened explicitly
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self, mode="IMMEDIATE"):
+        conn = self._conn()
+        conn.execute(f"BEGIN {mode}")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+class SqliteStore(SqliteDatabase):
+    """SQLite store: point reads and single-row writes keyed by item_id.
+
+    Runs in WAL mode so page reads don't block writers; name and quantity
+    are indexed for the catalogue and low-stock queries. Writes are
+    compare-and-swap on the per-row version, so they only ever lock the
+    database for one short transaction.
+
+    Every write also logs the touched item ids in `item_changes`, whose
+    row id doubles as a generation number. Each process keeps its
+    in-memory `indexes` current by replaying that log instead of
+    re-reading the whole table.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS items (
+            item_id   TEXT PRIMARY KEY,
+            name      TEXT NOT NULL,
+            quantity  INTEGER NOT NULL,
+            price     REAL NOT NULL,
+            version   INTEGER NOT NULL DEFAULT 0,
+            category  TEXT,
+            threshold INTEGER,
+            ref       INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_items_name ON items (name COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_items_quantity ON items (quantity);
+        CREATE TABLE IF NOT EXISTS item_changes (
+            gen     INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS counters (
+            name  TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS deductions (
+            token   TEXT PRIMARY KEY,  -- sale id of a checkout whose stock was deducted
+            applied REAL NOT NULL
+        );
+    """
+    EXTRA_COLUMNS = {("items", "version"): "INTEGER NOT NULL DEFAULT 0", ("items", "category"): "TEXT",
+                     ("items", "threshold"): "INTEGER", ("items", "ref"): "INTEGER"}
+    CHANGE_LOG_KEEP = 10000  # older change rows are pruned; lagging readers rebuild
+
+    def __init__(self, path, indexes=None):
+        super().__init__(path)
+        self.indexes = indexes if indexes is not None else IndexSet()
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0}
+        self._create()
+        self._conn().execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_items_ref ON items (ref)")
+
+    @staticmethod
+    def _generation(conn):
+        return conn.execute("SELECT COALESCE(MAX(gen), 0) FROM item_changes").fetchone()[0]
+
+    def _write(self, fn):
+        """Run fn(conn) -> (changes, result) as one write transaction.
+
+        `changes` maps each touched item id to its new record (None if
+        deleted). They are logged in item_changes and applied to this
+        process's indexes after the commit.
+        """
+        with self._lock:  # keeps index updates in commit order within this process
+            with self._tx() as conn:
+                changes, result = fn(conn)
+                if changes:
+                    prev = self._generation(conn)
+                    conn.executemany("INSERT INTO item_changes (item_id) VALUES (?)",
+                                     [(iid,) for iid in changes])
+                    gen = self._generation(conn)
+                    if prev // 1000 != gen // 1000:  # crossed a multiple of 1000; a batch can jump past it
+                        conn.execute("DELETE FROM item_changes WHERE gen <= ?",
+                                     (gen - self.CHANGE_LOG_KEEP,))
+            if changes and self.indexes.gen == prev:
+                self.indexes.apply(changes, gen)
+            # otherwise another process wrote in between; sync_indexes catches up
+            return result
+
+    def sync_indexes(self):
+        """Bring the indexes up to date with the database; returns them."""
+        ix = self.indexes
+        if ix.gen is not None and ix.gen == self._generation(self._conn()):
+            return ix
+        with self._lock, self._tx("DEFERRED") as conn:  # one consistent snapshot
+            gen = self._generation(conn)
+            oldest = conn.execute("SELECT MIN(gen) FROM item_changes").fetchone()[0]
+            if ix.gen is None or (oldest is not None and ix.gen < oldest - 1):
+                self.stats["misses"] += 1
+                rows = conn.execute("SELECT * FROM items ORDER BY rowid")
+                ix.rebuild({r["item_id"]: self._record(r) for r in rows}, gen)
+            elif ix.gen != gen:
+                ids = [r[0] for r in conn.execute(
+                    "SELECT DISTINCT item_id FROM item_changes WHERE gen > ?", (ix.gen,))]
+                found = self._fetch(conn, ids)
+                ix.apply({iid: found.get(iid) for iid in ids}, gen)
+        return ix
+
+    @staticmethod
+    def _record(row):
+        rec = {"name": row["name"], "quantity": row["quantity"], "price": row["price"],
+               "version": row["version"]}
+        # optional fields are left out when unset, as in inventory.json
+        for col in OPTIONAL_FIELDS:
+            if row[col] is not None:
+                rec[col] = row[col]
+        return rec
+
+    def _fetch(self, conn, iids):
+        found = {}
+        for i in range(0, len(iids), 500):
+            chunk = iids[i:i + 500]
+            rows = conn.execute("SELECT * FROM items WHERE item_id IN (%s)" % ",".join("?" * len(chunk)), chunk)
+            found.update((r["item_id"], self._record(r)) for r in rows)
+        return found
+
+    def load_all(self):
+        # no in-process cache: every full read goes to the database
+        self.stats["misses"] += 1
+        rows = self._conn().execute("SELECT * FROM items ORDER BY rowid")
+        return {r["item_id"]: self._record(r) for r in rows}
+
+    def save_all(self, inv):
+        def fn(conn):
+            old = [r[0] for r in conn.execute("SELECT item_id FROM items")]
+            conn.execute("DELETE FROM items")
+            self._upsert(conn, inv)
+            changes = dict.fromkeys(old)
+            changes.update(self._fetch(conn, list(inv)))
+            return changes, None
+        self._write(fn)
+
+    def get(self, iid):
+        row = self._conn().execute("SELECT * FROM items WHERE item_id = ?", (iid,)).fetchone()
+        return self._record(row) if row else None
+
+    def get_many(self, iids):
+        """{item_id: record} for the ids that exist, in the order given."""
+        iids = list(iids)
+        found = self._fetch(self._conn(), iids)
+        return {iid: found[iid] for iid in iids if iid in found}
+
+    def put(self, iid, rec):
+        self.put_many({iid: rec})
+
+    def put_many(self, items):
+        def fn(conn):
+            self._upsert(conn, items)
+            return self._fetch(conn, list(items)), None
+        self._write(fn)
+
+    @staticmethod
+    def _allocate_refs(conn, n, floor=0):
+        # reserve n ref numbers above every ref in use (or `floor`) inside
+        # the caller's transaction; the counter never goes back, so deleted
+        # items' refs aren't handed out again
+        conn.execute("INSERT INTO counters (name, value) VALUES ('ref', 0) ON CONFLICT (name) DO NOTHING")
+        last = conn.execute("SELECT MAX(value, (SELECT COALESCE(MAX(ref), 0) FROM items), ?) "
+                            "FROM counters WHERE name = 'ref'", (floor,)).fetchone()[0]
+        conn.execute("UPDATE counters SET value = ? WHERE name = 'ref'", (last + n,))
+        return last + 1
+
+    def _upsert(self, conn, items):
+        # ON CONFLICT keeps the rowid, so listing order stays insertion order,
+        # and keeps an existing item's ref
+        given = [d["ref"] for d in items.values() if d.get("ref") is not None]
+        numbered = {iid for iid, d in self._fetch(conn, list(items)).items() if d.get("ref") is not None}
+        need = [iid for iid, d in items.items() if d.get("ref") is None and iid not in numbered]
+        first = self._allocate_refs(conn, len(need), max(given, default=0))
+        refs = {iid: first + i for i, iid in enumerate(need)}
+        conn.executemany(
+            "INSERT INTO items (item_id, name, quantity, price, category, threshold, ref, version) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, 1) "
+            "ON CONFLICT (item_id) DO UPDATE SET name = excluded.name, quantity = excluded.quantity, "
+            "price = excluded.price, category = excluded.category, threshold = excluded.threshold, "
+            "ref = COALESCE(items.ref, excluded.ref), version = items.version + 1",
+            [(iid, d["name"], d["quantity"], d["price"], d.get("category"), d.get("threshold"),
+              d["ref"] if d.get("ref") is not None else refs.get(iid))
+             for iid, d in items.items()])
+
+    def insert(self, iid, rec):
+        """Add a new item; returns False if the item id is already taken."""
+        def fn(conn):
+            if conn.execute("SELECT 1 FROM items WHERE item_id = ?", (iid,)).fetchone():
+                return None, False
+            ref = self._allocate_refs(conn, 1)
+            conn.execute("INSERT INTO items (item_id, name, quantity, price, category, threshold, ref, version) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
+                         (iid, rec["name"], rec["quantity"], rec["price"],
+                          rec.get("category"), rec.get("threshold"), ref))
+            return {iid: dict(rec, ref=ref, version=1)}, True
+        return self._write(fn)
+
+    def insert_many(self, items):
+        """Add {item_id: record} in one write; returns the ids that were
+        already taken (those items are left out)."""
+        def fn(conn):
+            taken = list(self._fetch(conn, list(items)))
+            new = [iid for iid in items if iid not in taken]
+            first = self._allocate_refs(conn, len(new))
+            added = {iid: dict(items[iid], ref=first + i, version=1) for i, iid in enumerate(new)}
+            conn.executemany("INSERT INTO items (item_id, name, quantity, price, category, threshold, ref, version) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
+                             [(iid, d["name"], d["quantity"], d["price"], d.get("category"), d.get("threshold"),
+                               d["ref"]) for iid, d in added.items()])
+            return added, taken
+        return self._write(fn)
+
+    def assign_refs(self, iids):
+        """Give ref numbers, in the order given, to items that have none."""
+        def fn(conn):
+            found = self._fetch(conn, list(iids))
+            todo = [iid for iid in iids if iid in found and found[iid].get("ref") is None]
+            if not todo:
+                return None, None
+            first = self._allocate_refs(conn, len(todo))
+            conn.executemany("UPDATE items SET ref = ?, version = version + 1 WHERE item_id = ? AND ref IS NULL",
+                             [(first + i, iid) for i, iid in enumerate(todo)])
+            return self._fetch(conn, todo), None
+        self._write(fn)
+
+    def update(self, iid, change, expect_version=None):
+        """Compare-and-swap replace of one item; see JsonStore.update."""
+        while True:
+            before = self.get(iid)
+            if before is None:
+                return None, None
+            _check_version(iid, before, expect_version)
+            after = change(dict(before))
+
+            def fn(conn):
+                if after is None:
+                    cur = conn.execute("DELETE FROM items WHERE item_id = ? AND version = ?",
+                                       (iid, before["version"]))
+                else:
+                    after["version"] = before["version"] + 1
+                    if before.get("ref") is not None:
+                        after["ref"] = before["ref"]  # a ref stays with its item
+                    cur = conn.execute("UPDATE items SET name = ?, quantity = ?, price = ?, category = ?, "
+                                       "threshold = ?, version = ? WHERE item_id = ? AND version = ?",
+                                       (after["name"], after["quantity"], after["price"], after.get("category"),
+                                        after.get("threshold"), after["version"], iid, before["version"]))
+                if cur.rowcount != 1:
+                    return None, False
+                return {iid: after}, True
+            if self._write(fn):
+                return before, after
+            # another writer changed this item first: retry against its version
+
+    def update_many(self, changes, expect_versions=None):
+        """Apply {item_id: change} as one write transaction; see
+        JsonStore.update_many."""
+        expect_versions = expect_versions or {}
+
+        def fn(conn):
+            current = self._fetch(conn, list(changes))
+            written, results, gone, rows = {}, {}, [], []
+            for iid, change in changes.items():
+                before = current.get(iid)
+                if before is None:
+                    results[iid] = (None, None)
+                    continue
+                try:
+                    _check_version(iid, before, expect_versions.get(iid))
+                except VersionConflict as e:
+                    results[iid] = e
+                    continue
+                after = change(dict(before))
+                if after is None:
+                    gone.append((iid,))
+                else:
+                    after["version"] = before["version"] + 1
+                    if before.get("ref") is not None:
+                        after["ref"] = before["ref"]
+                    rows.append((after["name"], after["quantity"], after["price"], after.get("category"),
+                                 after.get("threshold"), after["version"], iid))
+                written[iid] = after
+                results[iid] = (before, after)
+            conn.executemany("DELETE FROM items WHERE item_id = ?", gone)
+            conn.executemany("UPDATE items SET name = ?, quantity = ?, price = ?, category = ?, "
+                             "threshold = ?, version = ? WHERE item_id = ?", rows)
+            return written, results
+        return self._write(fn)
+
+    def delete(self, iid, expect_version=None):
+        """Delete an item; returns the deleted record, or None if absent."""
+        while True:
+            current = self.get(iid)
+            if current is None:
+                return None
+
+            def fn(conn):
+                cur = conn.execute("DELETE FROM items WHERE item_id = ? AND version = ?",
+                                   (iid, current["version"]))
+                return ({iid: None}, True) if cur.rowcount == 1 else (None, False)
+            _check_version(iid, current, expect_version)
+            if self._write(fn):
+                return current
+
+    def sorted_by_name(self):
+        rows = self._conn().execute("SELECT * FROM items ORDER BY name COLLATE NOCASE")
+        return [(r["item_id"], self._record(r)) for r in rows]
+
+    def below_quantity(self, threshold):
+        rows = self._conn().execute("SELECT * FROM items WHERE quantity < ?", (threshold,))
+        return {r["item_id"]: self._record(r) for r in rows}
+
+    def deduct(self, wanted, token=None):
+        """Deduct {item_id: qty} all-or-nothing; returns the item ids that are short.
+
+        A `token` (a sale id) is recorded in the same transaction, and a
+        deduction under a token already recorded does nothing and reports
+        success, so a checkout retried after a crash can't deduct twice.
+        """
+        class _Short(Exception):
+            pass
+
+        def fn(conn):
+            if token is not None:
+                if conn.execute("SELECT 1 FROM deductions WHERE token = ?", (token,)).fetchone():
+                    return None, []
+                conn.execute("INSERT INTO deductions (token, applied) VALUES (?, ?)", (token, time.time()))
+            short = []
+            for iid, q in wanted.items():
+                cur = conn.execute("UPDATE items SET quantity = quantity - ?, version = version + 1 "
+                                   "WHERE item_id = ? AND quantity >= ?", (q, iid, q))
+                if cur.rowcount == 0:
+                    short.append(iid)
+            if short:
+                raise _Short(short)  # rolls the whole transaction back
+            return self._fetch(conn, list(wanted)), []
+        try:
+            return self._write(fn)
+        except _Short as e:
+            return e.args[0]
+
+class CategoryThresholds:
+    """Default reorder thresholds per category, kept in a small JSON file.
+
+    Loaded lazily and cached until the file changes; load() returns the
+    same dict object while nothing changed, so callers can cheaply tell
+    whether thresholds derived from it are stale.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(path + ".lock")
+        self._sig = None
+        self._data = {}
+
+    def load(self):
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+                sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+            except FileNotFoundError:
+                sig = None
+            if sig != self._sig:
+                data = {}
+                if sig is not None:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        try:
+                            data = json.load(f)
+                        except json.JSONDecodeError as e:
+                            raise InventoryCorruptError(f"{self.path} is not valid JSON: {e}") from e
+                self._data, self._sig = data, sig
+            return self._data
+
+    def set(self, category, threshold):
+        """Set a category's threshold, or drop it when `threshold` is None."""
+        with self._file_lock:
+            data = dict(self.load())
+            if threshold is None:
+                data.pop(category, None)
+            else:
+                data[category] = threshold
+            _install(_write_temp(self.path, data), self.path)
+        return self.load()
+
+class EventBroker:
+    """In-process fan-out of change events to /events subscribers.
+
+    Events get increasing sequence numbers, which double as SSE event ids;
+    the last `backlog` are kept so a reconnecting client can resume from
+    its Last-Event-ID.
+    """
+
+    def __init__(self, backlog=EVENT_BACKLOG):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=backlog)  # (seq, kind, data)
+        self._seq = 0
+
+    def last_id(self):
+        with self._cond:
+            return self._seq
+
+    def publish(self, kind, data):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, kind, data))
+            self._cond.notify_all()
+
+    def wait(self, after, timeout):
+        """Events newer than `after`, waiting up to `timeout` seconds for one.
+
+        Returns (events, last_id, missed); `missed` means some events after
+        `after` already fell out of the backlog.
+        """
+        with self._cond:
+            after = min(after, self._seq)  # an id from before a restart
+            if self._seq == after:
+                self._cond.wait(timeout)
+            first = self._events[0][0] if self._events else self._seq + 1
+            missed = first > after + 1
+            events = list(itertools.islice(self._events, max(0, after + 1 - first), None))
+            return events, (events[-1][0] if events else after), missed
+
+# ----------------- carts -----------------
+class CartStore(SqliteDatabase):
+    """Shopping carts kept server-side, keyed by a random cart id that is
+    all the session cookie carries.
+
+    Every cart line is also a hold on stock, shared by all sessions and
+    workers: add() only succeeds while the item's stock covers every
+    active hold, and a hold lapses `hold_ttl` seconds after its line was
+    last added to (its line drops out of the cart then). Holds are looked
+    up and expired through indexes on (item_id, expires) and on expires,
+    so both cost O(log N) in the number of holds.
+
+    Lines live in SQLite so every worker sees the same carts and holds.
+    Each worker also keeps its most recently used carts in an LRU cache,
+    checked against the cart's version with a single-row read. Adding to a
+    cart writes just that line, whatever the cart's size.
+
+    A cart nobody has added to for `ttl` seconds is abandoned: it reads as
+    empty, and a sweep run every CART_SWEEP_SECONDS deletes it along with
+    lapsed holds.
+
+    Checkout is begin_checkout() (claim the cart so it can't be checked
+    out twice or changed meanwhile, keeping its holds, and record the sale
+    it is turning into), the inventory deduction and the ledger entry,
+    then finish_checkout() (release the holds) or abort_checkout(). The
+    recorded sale outlives a failed attempt: until the checkout finishes
+    or is aborted the cart can't be changed or cleared, and the next
+    begin_checkout() resumes that sale rather than starting a new one.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS carts (
+            cart_id  TEXT PRIMARY KEY,
+            version  INTEGER NOT NULL,
+            touched  REAL NOT NULL,
+            checkout REAL,
+            pending  TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_carts_touched ON carts (touched);
+        CREATE TABLE IF NOT EXISTS cart_lines (
+            cart_id  TEXT NOT NULL,
+            item_id  TEXT NOT NULL,
+            name     TEXT NOT NULL,
+            price    REAL NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires  REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (cart_id, item_id)
+        );
+    """
+    EXTRA_COLUMNS = {("cart_lines", "expires"): "REAL NOT NULL DEFAULT 0", ("carts", "checkout"): "REAL",
+                     ("carts", "pending"): "TEXT"}
+
+    def __init__(self, path, ttl=CART_TTL_SECONDS, hold_ttl=HOLD_TTL_SECONDS, cache_size=CART_CACHE_SIZE):
+        super().__init__(path)
+        self.ttl = ttl
+        self.hold_ttl = hold_ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # cart_id -> (version, lines, first hold to lapse)
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+        self.stats = {"hits": 0, "misses": 0}
+        self._create()
+        conn = self._conn()
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cart_lines_item ON cart_lines (item_id, expires)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cart_lines_expires ON cart_lines (expires)")
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(16)
+
+    def _cached(self, cart_id, version, lines=None):
+        # look up (or, given `lines`, store) a cart's lines at `version`
+        now = time.time()
+        with self._lock:
+            if lines is not None:
+                lapses = min((d["expires"] for d in lines.values()), default=float("inf"))
+                self._cache[cart_id] = (version, lines, lapses)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            hit = self._cache.get(cart_id)
+            if hit is None or hit[0] != version or hit[2] <= now:
+                return None
+            self._cache.move_to_end(cart_id)
+            return hit[1]
+
+    def get(self, cart_id):
+        """The cart's held lines as {item_id: {"name", "price", "quantity",
+        "expires"}}, in the order they were added; empty for an unknown or
+        expired cart. The dict is shared with the cache, so treat it as
+        read-only."""
+        if not cart_id:
+            return {}
+        conn = self._conn()
+        row = conn.execute("SELECT version, touched FROM carts WHERE cart_id = ?", (cart_id,)).fetchone()
+        if row is None or row["touched"] < time.time() - self.ttl:
+            with self._lock:
+                self._cache.pop(cart_id, None)
+            return {}
+        lines = self._cached(cart_id, row["version"])
+        if lines is not None:
+            self.stats["hits"] += 1
+            return lines
+        self.stats["misses"] += 1
+        with self._tx("DEFERRED") as conn:
+            version = conn.execute("SELECT version FROM carts WHERE cart_id = ?", (cart_id,)).fetchone()
+            rows = conn.execute("SELECT * FROM cart_lines WHERE cart_id = ? AND expires > ? ORDER BY rowid",
+                                (cart_id, time.time()))
+            lines = {r["item_id"]: {"name": r["name"], "price": r["price"], "quantity": r["quantity"],
+                                    "expires": r["expires"]} for r in rows}
+        if version is None:
+            return {}
+        self._cached(cart_id, version[0], lines)
+        return lines
+
+    def line(self, cart_id, iid):
+        """One held line of the cart, or None; doesn't read the rest of the cart."""
+        if not cart_id:
+            return None
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT l.name, l.price, l.quantity, l.expires FROM cart_lines l JOIN carts c ON c.cart_id = l.cart_id "
+            "WHERE l.cart_id = ? AND l.item_id = ? AND l.expires > ? AND c.touched >= ?",
+            (cart_id, iid, now, now - self.ttl)).fetchone()
+        return dict(row) if row else None
+
+    @staticmethod
+    def _held(conn, iids, now):
+        found = {}
+        for i in range(0, len(iids), 500):
+            chunk = iids[i:i + 500]
+            found.update(conn.execute(
+                "SELECT item_id, SUM(quantity) FROM cart_lines WHERE item_id IN (%s) AND expires > ? "
+                "GROUP BY item_id" % ",".join("?" * len(chunk)), chunk + [now]).fetchall())
+        return found
+
+    def held(self, iids):
+        """{item_id: units on hold across all carts} for the given items;
+        items without active holds are left out."""
+        return self._held(self._conn(), list(iids), time.time())
+
+    def add(self, cart_id, iid, qty, name, price, stock_of):
+        """Hold `qty` more of an item in the cart, creating the cart as
+        needed, and return the line's new quantity.
+
+        `stock_of(item_ids)` returns {item_id: quantity in stock}. The hold
+        is only taken if it and every other active hold on the item fit in
+        the stock; otherwise StockUnavailable is raised and nothing
+        changes. Checking and claiming happen in one transaction, so
+        concurrent adds can't both take the last units, and the stock is
+        read inside it: a checkout deducts its stock before it releases
+        its holds, so the check sees either the holds or the lower stock,
+        never a stale stock with the holds gone. Adding to a line renews
+        its hold.
+        """
+        result, = self.add_many(cart_id, [(iid, qty, name, price)], stock_of)
+        if isinstance(result, StockUnavailable):
+            raise result
+        return result
+
+    def add_many(self, cart_id, lines, stock_of):
+        """add() for a list of (item_id, qty, name, price) lines, in one
+        transaction and one cart version.
+
+        Each line is checked on its own (later lines see earlier lines'
+        holds). Returns, per line, its new quantity or the StockUnavailable
+        that refused it; refused lines change nothing. Raises
+        CheckoutInProgress while the cart is being checked out.
+        """
+        now = time.time()
+        results, added = [], {}
+        with self._tx() as conn:
+            row = conn.execute("SELECT version, touched, checkout, pending FROM carts WHERE cart_id = ?",
+                               (cart_id,)).fetchone()
+            if row is not None and row["pending"] is not None:
+                raise CheckoutInProgress(cart_id)  # claimed, or an attempt failed and awaits a retry
+            if row is not None and row["touched"] < now - self.ttl:
+                conn.execute("DELETE FROM cart_lines WHERE cart_id = ?", (cart_id,))  # expired, not swept yet
+                row = None
+            stock = stock_of([iid for iid, *_ in lines])
+            for iid, qty, name, price in lines:
+                free = stock.get(iid, 0) - self._held(conn, [iid], now).get(iid, 0)
+                if qty > free:
+                    results.append(StockUnavailable(iid, max(free, 0)))
+                    continue
+                # a lapsed line starts over rather than reviving its old quantity
+                conn.execute("INSERT INTO cart_lines (cart_id, item_id, name, price, quantity, expires) "
+                             "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (cart_id, item_id) DO UPDATE SET "
+                             "quantity = CASE WHEN expires > ? THEN quantity ELSE 0 END + excluded.quantity, "
+                             "expires = excluded.expires",
+                             (cart_id, iid, name, price, qty, now + self.hold_ttl, now))
+                line = conn.execute("SELECT name, price, quantity, expires FROM cart_lines "
+                                    "WHERE cart_id = ? AND item_id = ?", (cart_id, iid)).fetchone()
+                added[iid] = dict(line)
+                results.append(line["quantity"])
+            if not added:
+                return results
+            version = row["version"] + 1 if row is not None else 1
+            conn.execute("INSERT INTO carts (cart_id, version, touched) VALUES (?, ?, ?) "
+                         "ON CONFLICT (cart_id) DO UPDATE SET version = excluded.version, touched = excluded.touched",
+                         (cart_id, version, now))
+        lapses = min(d["expires"] for d in added.values())
+        with self._lock:
+            hit = self._cache.get(cart_id)
+            if hit is not None and hit[0] == version - 1 and hit[2] > now:
+                # bring the cached copy forward instead of re-reading the cart,
+                # into a new dict: get() handed out the old one, and readers
+                # may still be iterating it
+                self._cache[cart_id] = (version, {**hit[1], **added}, min(hit[2], lapses))
+            elif version == 1:
+                self._cache[cart_id] = (version, added, lapses)
+            else:
+                self._cache.pop(cart_id, None)
+        if now >= self._next_sweep:
+            self._next_sweep = now + CART_SWEEP_SECONDS
+            self.sweep(now)
+        return results
+
+    def begin_checkout(self, cart_id):
+        """Claim the cart for checkout and return its checkout record,
+        {"sale": ..., "deducted": bool, "ledger_from": invoice}, or None if
+        the cart is empty.
+
+        A fresh claim records the sale the cart turns into ({"id",
+        "created", "lines": [{"id", "name", "qty", "price", "subtotal"}],
+        "total"}) with "deducted" false; if an earlier attempt failed, its
+        record is returned as it was left (see update_checkout()). The holds
+        are stretched to outlast the claim so no other cart can take the
+        units meanwhile. Raises CheckoutInProgress if another checkout of
+        the cart is under way.
+        """
+        if not cart_id:
+            return None
+        now = time.time()
+        with self._tx() as conn:
+            row = conn.execute("SELECT touched, checkout, pending FROM carts WHERE cart_id = ?",
+                               (cart_id,)).fetchone()
+            if row is None:
+                return None
+            if (row["checkout"] or 0) >= now - CHECKOUT_CLAIM_SECONDS:
+                raise CheckoutInProgress(cart_id)
+            if row["pending"] is not None:
+                pending = json.loads(row["pending"])
+            else:
+                if row["touched"] < now - self.ttl:
+                    return None
+                rows = conn.execute("SELECT * FROM cart_lines WHERE cart_id = ? AND expires > ? ORDER BY rowid",
+                                    (cart_id, now)).fetchall()
+                if not rows:
+                    return None
+                sold = [{"id": r["item_id"], "name": r["name"], "qty": r["quantity"], "price": r["price"],
+                         "subtotal": r["quantity"] * r["price"]} for r in rows]
+                sale = {"id": secrets.token_urlsafe(12), "created": now, "lines": sold,
+                        "total": sum(line["subtotal"] for line in sold)}
+                pending = {"sale": sale, "deducted": False, "ledger_from": None}
+            conn.execute("UPDATE carts SET checkout = ?, pending = ?, version = version + 1 WHERE cart_id = ?",
+                         (now, json.dumps(pending), cart_id))
+            conn.execute("UPDATE cart_lines SET expires = MAX(expires, ?) WHERE cart_id = ? AND expires > ?",
+                         (now + CHECKOUT_CLAIM_SECONDS, cart_id, now))
+        with self._lock:
+            self._cache.pop(cart_id, None)
+        return pending
+
+    def update_checkout(self, cart_id, pending):
+        """Save how far the claimed checkout got, e.g. that its stock is
+        deducted, so a retry after a failure doesn't repeat that step."""
+        with self._tx() as conn:
+            conn.execute("UPDATE carts SET pending = ? WHERE cart_id = ?", (json.dumps(pending), cart_id))
+
+    def release_checkout(self, cart_id):
+        """Lift a claim after a failed attempt, keeping its checkout record
+        for the retry; the cart stays locked against changes."""
+        with self._tx() as conn:
+            conn.execute("UPDATE carts SET checkout = NULL, version = version + 1 WHERE cart_id = ?", (cart_id,))
+
+    def abort_checkout(self, cart_id):
+        """Give up a checkout that changed nothing (e.g. stock ran short);
+        the cart and its holds stay and can be changed again."""
+        with self._tx() as conn:
+            conn.execute("UPDATE carts SET checkout = NULL, pending = NULL, version = version + 1 "
+                         "WHERE cart_id = ?", (cart_id,))
+
+    def finish_checkout(self, cart_id):
+        """Delete a checked-out cart, releasing its holds."""
+        with self._tx() as conn:
+            conn.execute("DELETE FROM cart_lines WHERE cart_id = ?", (cart_id,))
+            conn.execute("DELETE FROM carts WHERE cart_id = ?", (cart_id,))
+        with self._lock:
+            self._cache.pop(cart_id, None)
+
+    def stalled(self):
+        """Ids of carts whose checkout failed or was cut off and hasn't been
+        retried (its claim has lapsed)."""
+        rows = self._conn().execute("SELECT cart_id FROM carts WHERE pending IS NOT NULL "
+                                    "AND COALESCE(checkout, 0) < ?", (time.time() - CHECKOUT_CLAIM_SECONDS,))
+        return [r[0] for r in rows]
+
+    def clear(self, cart_id):
+        """Empty the cart, releasing its holds. Raises CheckoutInProgress
+        while a checkout of the cart is unfinished."""
+        if not cart_id:
+            return
+        with self._tx() as conn:
+            row = conn.execute("SELECT pending FROM carts WHERE cart_id = ?", (cart_id,)).fetchone()
+            if row is not None and row["pending"] is not None:
+                raise CheckoutInProgress(cart_id)
+            conn.execute("DELETE FROM cart_lines WHERE cart_id = ?", (cart_id,))
+            conn.execute("DELETE FROM carts WHERE cart_id = ?", (cart_id,))
+        with self._lock:
+            self._cache.pop(cart_id, None)
+
+    def sweep(self, now=None):
+        """Delete lapsed holds and expired carts; returns how many carts.
+        Carts with an unfinished checkout are kept (see stalled())."""
+        now = now or time.time()
+        cutoff = now - self.ttl
+        with self._tx() as conn:
+            conn.execute("DELETE FROM cart_lines WHERE expires <= ?", (now,))
+            conn.execute("DELETE FROM cart_lines WHERE cart_id IN "
+                         "(SELECT cart_id FROM carts WHERE touched < ? AND pending IS NULL)", (cutoff,))
+            return conn.execute("DELETE FROM carts WHERE touched < ? AND pending IS NULL", (cutoff,)).rowcount
+
+# ----------------- sales ledger -----------------
+class SalesLedger:
+    """Append-only ledger of completed sales, as NDJSON segments.
+
+    Each sale is one line of `<dir>/sales-<first invoice>.ndjson`; once a
+    segment passes `segment_bytes` the next sale starts a new one. Invoice
+    numbers are consecutive, so each segment's `.idx` file (the 8-byte
+    start offset of every sale) finds an invoice with one seek: bisect for
+    the segment, then read entry (invoice - first).
+
+    Appends hold a lock file, since every worker writes to the same
+    ledger, and are group-committed: checkouts that arrive together share
+    one fsync. A crash mid-append leaves a torn or unindexed tail, never
+    acknowledged, which the next append cuts off before reusing its
+    invoice number.
+    """
+
+    ENTRY = struct.Struct("<Q")
+
+    def __init__(self, path, segment_bytes=LEDGER_SEGMENT_BYTES):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(os.path.join(path, "ledger.lock"))
+        self._committer = GroupCommit(self._flush)
+        self._segments = []  # first invoice of each segment, ascending
+        self._tail = None    # (first invoice, index size, data size) of the tail segment after our last append
+        self._dirty = set()  # segments written since the last flush
+
+    def _file(self, first, ext):
+        return os.path.join(self.path, f"sales-{first:010d}.{ext}")
+
+    def _scan(self):
+        self._segments = sorted(int(n[6:-7]) for n in os.listdir(self.path)
+                                if n.startswith("sales-") and n.endswith(".ndjson"))
+        return self._segments
+
+    def _recover(self, first):
+        """(sales in segment `first`, end of its last complete sale), cutting
+        off anything after that sale. The caller holds the locks."""
+        data_path, idx_path = self._file(first, "ndjson"), self._file(first, "idx")
+        idx_size = os.path.getsize(idx_path) if os.path.exists(idx_path) else 0
+        data_size = os.path.getsize(data_path)
+        if self._tail == (first, idx_size, data_size) and idx_size % self.ENTRY.size == 0:
+            return idx_size // self.ENTRY.size, data_size  # nothing appended since, by anyone
+        n, end = idx_size // self.ENTRY.size, 0
+        with open(data_path, "rb") as data, open(idx_path, "ab+") as idx:
+            while n:
+                idx.seek((n - 1) * self.ENTRY.size)
+                start, = self.ENTRY.unpack(idx.read(self.ENTRY.size))
+                data.seek(start)
+                line = data.readline()
+                if line.endswith(b"\n"):
+                    end = start + len(line)
+                    break
+                n -= 1  # indexed, but the sale itself never made it to disk
+            if idx_size != n * self.ENTRY.size:
+                idx.truncate(n * self.ENTRY.size)
+        if data_size != end:
+            with open(data_path, "rb+") as data:
+                data.truncate(end)
+        return n, end
+
+    def append(self, sale):
+        """Store `sale` (a JSON-able dict) under the next invoice number,
+        which is set on it and returned once the sale is durable."""
+        with self._file_lock, self._lock:
+            segments = self._scan()
+            first = segments[-1] if segments else 1
+            n, end = self._recover(first) if segments else (0, 0)
+            invoice = first + n
+            if end >= self.segment_bytes:
+                self._sync(first)  # sealed; later sales go to a new segment
+                first, end = invoice, 0
+            sale["invoice"] = invoice
+            line = json.dumps(sale, separators=(",", ":")).encode("utf-8") + b"\n"
+            new = not os.path.exists(self._file(first, "ndjson"))
+            with open(self._file(first, "ndjson"), "ab") as f:
+                f.write(line)
+            with open(self._file(first, "idx"), "ab") as f:
+                f.write(self.ENTRY.pack(end))
+            if new:
+                _fsync_dir(self._file(first, "ndjson"))
+                self._segments.append(first)
+            self._tail = (first, (invoice - first + 1) * self.ENTRY.size, end + len(line))
+            self._dirty.add(first)
+        self._committer.wait()
+        return invoice
+
+    def next_invoice(self):
+        """The invoice number the next append() will use."""
+        with self._file_lock, self._lock:
+            segments = self._scan()
+            if not segments:
+                return 1
+            return segments[-1] + self._recover(segments[-1])[0]
+
+    def find(self, sale_id, start=1):
+        """The sale appended with this "id" at invoice `start` or later, or None."""
+        return next((sale for sale in self.replay(start) if sale.get("id") == sale_id), None)
+
+    def _sync(self, first):
+        for ext in ("ndjson", "idx"):  # data before index
+            with open(self._file(first, ext), "ab") as f:
+                os.fsync(f.fileno())
+
+    def _flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        for first in sorted(dirty):
+            self._sync(first)
+
+    def get(self, invoice):
+        """The sale with this invoice number, or None."""
+        segments = self._segments
+        i = bisect.bisect_right(segments, invoice) - 1
+        if i < 0 or i == len(segments) - 1:
+            segments = self._scan()  # the invoice may be in a newer segment
+            i = bisect.bisect_right(segments, invoice) - 1
+            if i < 0:
+                return None
+        first = segments[i]
+        with open(self._file(first, "idx"), "rb") as idx:
+            idx.seek((invoice - first) * self.ENTRY.size)
+            entry = idx.read(self.ENTRY.size)
+        if len(entry) < self.ENTRY.size:
+            return None
+        with open(self._file(first, "ndjson"), "rb") as data:
+            data.seek(self.ENTRY.unpack(entry)[0])
+            line = data.readline()
+        if not line.endswith(b"\n"):
+            return None
+        sale = json.loads(line)
+        return sale if sale.get("invoice") == invoice else None
+
+    def replay(self, start=1):
+        """Every sale from invoice `start` on, in invoice order; starts with
+        a seek through the index rather than a scan."""
+        segments = self._scan()
+        i = max(bisect.bisect_right(segments, start) - 1, 0)
+        for first in segments[i:]:
+            with open(self._file(first, "ndjson"), "rb") as data:
+                if start > first:
+                    with open(self._file(first, "idx"), "rb") as idx:
+                        idx.seek((start - first) * self.ENTRY.size)
+                        entry = idx.read(self.ENTRY.size)
+                    if len(entry) < self.ENTRY.size:
+                        return
+                    data.seek(self.ENTRY.unpack(entry)[0])
+                for line in data:
+                    if not line.endswith(b"\n"):
+                        return  # torn tail of an append in progress
+                    yield json.loads(line)
+
+class SalesRollups(SqliteDatabase):
+    """Hourly and daily sales totals per item and store-wide (item "*"),
+    kept up to date as sales are recorded.
+
+    record() folds one sale into its buckets in one transaction, so
+    reports read a few rows per item and day rather than the raw sales.
+    Buckets are local-time "YYYY-MM-DD HH" hours and "YYYY-MM-DD" days.
+
+    Sales are applied strictly in invoice order: `applied` is the last
+    invoice folded in. A sale that arrives ahead of its turn (another
+    worker's checkout hasn't reached this step yet, or one crashed after
+    writing the ledger) brings the rollups up to date from the ledger
+    first, so nothing is counted twice or lost.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rollups (
+            period   TEXT NOT NULL,  -- 'hour' or 'day'
+            bucket   TEXT NOT NULL,
+            item_id  TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            revenue  REAL NOT NULL,
+            sales    INTEGER NOT NULL,
+            PRIMARY KEY (period, bucket, item_id)
+        );
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            id      INTEGER PRIMARY KEY CHECK (id = 1),
+            applied INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO rollup_state (id, applied) VALUES (1, 0);
+    """
+    STORE_WIDE = "*"
+
+    def __init__(self, path, ledger):
+        super().__init__(path)
+        self.ledger = ledger
+        self._conn().executescript(self.SCHEMA)
+
+    @staticmethod
+    def buckets(created):
+        t = datetime.fromtimestamp(created)
+        return (("hour", t.strftime("%Y-%m-%d %H")), ("day", t.strftime("%Y-%m-%d")))
+
+    def _apply(self, conn, sale):
+        rows = defaultdict(lambda: [0, 0.0])
+        for line in sale["lines"]:
+            for iid in (line["id"], self.STORE_WIDE):
+                rows[iid][0] += line["qty"]
+                rows[iid][1] += line["subtotal"]
+        conn.executemany(
+            "INSERT INTO rollups (period, bucket, item_id, quantity, revenue, sales) VALUES (?, ?, ?, ?, ?, 1) "
+            "ON CONFLICT (period, bucket, item_id) DO UPDATE SET quantity = quantity + excluded.quantity, "
+            "revenue = revenue + excluded.revenue, sales = sales + 1",
+            [(period, bucket, iid, qty, revenue) for period, bucket in self.buckets(sale["created"])
+             for iid, (qty, revenue) in rows.items()])
+
+    def record(self, sale):
+        """Fold a sale from the ledger (it must carry its invoice number)
+        into the rollups, catching up on any earlier sales not yet in."""
+        with self._tx() as conn:
+            applied = conn.execute("SELECT applied FROM rollup_state").fetchone()[0]
+            if sale["invoice"] <= applied:
+                return
+            if sale["invoice"] == applied + 1:
+                pending = [sale]
+            else:
+                pending = itertools.takewhile(lambda s: s["invoice"] <= sale["invoice"],
+                                              self.ledger.replay(applied + 1))
+            for s in pending:
+                self._apply(conn, s)
+                applied = s["invoice"]
+            conn.execute("UPDATE rollup_state SET applied = ?", (applied,))
+
+    def catch_up(self):
+        """Fold in every ledger sale not yet in the rollups; returns how many."""
+        with self._tx() as conn:
+            applied = start = conn.execute("SELECT applied FROM rollup_state").fetchone()[0]
+            for s in self.ledger.replay(applied + 1):
+                self._apply(conn, s)
+                applied = s["invoice"]
+            conn.execute("UPDATE rollup_state SET applied = ?", (applied,))
+        return applied - start
+
+    def rebuild(self):
+        """Recompute every bucket from the ledger; returns the sales folded in."""
+        with self._tx() as conn:
+            conn.execute("DELETE FROM rollups")
+            conn.execute("UPDATE rollup_state SET applied = 0")
+        return self.catch_up()
+
+    def report(self, days=30, period="day"):
+        """Totals over the last `days` days (today included): per item,
+        store-wide, and per bucket of `period` store-wide."""
+        since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        conn = self._conn()
+        items = conn.execute(
+            "SELECT item_id, SUM(quantity) AS quantity, SUM(revenue) AS revenue, SUM(sales) AS sales "
+            "FROM rollups WHERE period = 'day' AND bucket >= ? AND item_id != ? "
+            "GROUP BY item_id ORDER BY revenue DESC, item_id", (since, self.STORE_WIDE)).fetchall()
+        series = conn.execute(
+            "SELECT bucket, quantity, revenue, sales FROM rollups "
+            "WHERE period = ? AND bucket >= ? AND item_id = ? ORDER BY bucket",
+            (period, since, self.STORE_WIDE)).fetchall()
+        total = {"quantity": sum(r["quantity"] for r in series), "revenue": sum(r["revenue"] for r in series),
+                 "sales": sum(r["sales"] for r in series)}
+        return {"since": since, "items": [dict(r) for r in items], "total": total,
+                "series": [dict(r) for r in series]}
+
+# ----------------- in-memory indexes -----------------
+class InventoryIndex:
+    """Base class for secondary indexes kept in step with the store.
+
+    Subclasses implement add/remove/clear; updates arrive one item at a
+    time as (item_id, record) pairs, and queries should hold `self.lock`.
+    """
+
+    lock = None  # set by IndexSet.register
+
+    def add(self, iid, rec):
+        raise NotImplementedError
+
+    def remove(self, iid, rec):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+class IndexSet:
+    """The indexes of one store, plus the records they currently reflect.
+
+    `listeners` are called (under the lock) with a list of (item_id, old,
+    new) for every item whose version changed, old/new being None for an
+    added/deleted item. Changes read back from other processes are
+    reported too, so listeners see every write to the store.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.gen = None  # store generation the indexes reflect (sqlite only)
+        self.listeners = []
+        self._built = False
+        self._items = {}
+        self._indexes = []
+
+    @staticmethod
+    def _changed(old, new):
+        return old is None or new is None or old.get("version") != new.get("version")
+
+    def _notify(self, changes):
+        if changes:
+            for listener in self.listeners:
+                listener(changes)
+
+    def register(self, index):
+        with self.lock:
+            index.lock = self.lock
+            index.clear()
+            for iid, rec in self._items.items():
+                index.add(iid, rec)
+            self._indexes.append(index)
+        return index
+
+    def rebuild(self, items, gen=None):
+        """Make the indexes reflect exactly `items` ({item_id: record}).
+
+        Once built, only the items that differ from what the indexes hold
+        are re-indexed, so re-reading a large file another worker changed
+        costs a comparison per item rather than a full rebuild. Records
+        are compared whole, not by version, as a full rewrite (save_all)
+        can change an item without bumping it.
+        """
+        with self.lock:
+            if self._built:
+                changes = {iid: rec for iid, rec in items.items() if self._items.get(iid) != rec}
+                changes.update((iid, None) for iid in self._items if iid not in items)
+                if len(changes) <= len(self._items) // 2:
+                    self.apply(changes, gen)
+                    return
+            old, self._items = self._items, dict(items)
+            for index in self._indexes:
+                index.clear()
+                for iid, rec in self._items.items():
+                    index.add(iid, rec)
+            self.gen = gen
+            if self.listeners and self._built:
+                # a full reload (e.g. another worker rewrote the file): report the difference
+                changes = [(iid, old.get(iid), rec) for iid, rec in self._items.items()
+                           if self._changed(old.get(iid), rec)]
+                changes += [(iid, rec, None) for iid, rec in old.items() if iid not in self._items]
+                self._notify(changes)
+            self._built = True
+
+    def record(self, iid):
+        """The record the indexes currently reflect for an item, or None."""
+        with self.lock:
+            return self._items.get(iid)
+
+    def refresh(self, index):
+        """Re-add every item to one index, e.g. after its settings changed."""
+        with self.lock:
+            index.clear()
+            for iid, rec in self._items.items():
+                index.add(iid, rec)
+
+    def apply(self, changes, gen=None):
+        """`changes` maps item ids to their new record (None if deleted)."""
+        with self.lock:
+            changed = []
+            for iid, rec in changes.items():
+                old = self._items.pop(iid, None)
+                if old is not None:
+                    for index in self._indexes:
+                        index.remove(iid, old)
+                if rec is not None:
+                    self._items[iid] = rec
+                    for index in self._indexes:
+                        index.add(iid, rec)
+                if self._changed(old, rec) and (old, rec) != (None, None):
+                    changed.append((iid, old, rec))
+            self.gen = gen
+            self._notify(changed)
+
+class NgramIndex(InventoryIndex):
+    """Inverted index of 1- to 3-character grams for substring search.
+
+    Ids and names are lower-cased once, when an item is written, and
+    indexed separately. A query of up to three characters is a single
+    posting lookup; longer ones intersect the posting sets of their
+    trigrams (smallest first) and verify the survivors, so the cost tracks
+    the number of candidates rather than the size of the catalogue.
+    """
+
+    N = 3
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._postings = {"id": defaultdict(set), "name": defaultdict(set)}
+        self._text = {}      # item_id -> (id lower-cased, name lower-cased)
+        self._by_id = defaultdict(set)  # lower-cased id -> item ids
+
+    @classmethod
+    def _grams(cls, text):
+        return {text[i:i + n] for n in range(1, cls.N + 1) for i in range(len(text) - n + 1)}
+
+    def add(self, iid, rec):
+        text = (iid.lower(), rec.get("name", "").lower())
+        self._text[iid] = text
+        self._by_id[text[0]].add(iid)
+        for field, value in zip(("id", "name"), text):
+            postings = self._postings[field]
+            for g in self._grams(value):
+                postings[g].add(iid)
+
+    def remove(self, iid, rec):
+        text = self._text.pop(iid)
+        self._by_id[text[0]].discard(iid)
+        if not self._by_id[text[0]]:
+            del self._by_id[text[0]]
+        for field, value in zip(("id", "name"), text):
+            postings = self._postings[field]
+            for g in self._grams(value):
+                ids = postings[g]
+                ids.discard(iid)
+                if not ids:
+                    del postings[g]
+
+    def _contains(self, field, k):
+        postings = self._postings[field]
+        if len(k) <= self.N:
+            return set(postings.get(k, ()))
+        grams = sorted((postings.get(k[i:i + self.N], ()) for i in range(len(k) - self.N + 1)), key=len)
+        found = set(grams[0])
+        for ids in grams[1:]:
+            if not found:
+                break
+            found &= ids
+        # trigram hits can come from different places in the text; check them
+        pos = 0 if field == "id" else 1
+        return {iid for iid in found if k in self._text[iid][pos]}
+
+    def search(self, term, exact_id=False):
+        """Ids of items whose name contains `term` (case-insensitive), plus
+        those whose id contains it, or equals it when `exact_id` is set."""
+        k = term.lower()
+        if not k:
+            return set()
+        with self.lock:
+            ids = self._contains("name", k)
+            ids |= set(self._by_id.get(k, ())) if exact_id else self._contains("id", k)
+            return ids
+
+class SortedKeyList:
+    """Sorted list of keys (tuples) kept in bounded chunks.
+
+    An insert or removal shifts one chunk rather than the whole list, and
+    irange() walks forward from a bisected position, so ordered scans cost
+    O(log n + k) for k keys read.
+    """
+
+    CHUNK = 512
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._chunks = []
+        self._maxes = []  # last key of each chunk
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+        else:
+            i = min(bisect.bisect_left(self._maxes, key), len(self._maxes) - 1)
+            chunk = self._chunks[i]
+            bisect.insort(chunk, key)
+            self._maxes[i] = chunk[-1]
+            if len(chunk) > 2 * self.CHUNK:
+                self._chunks[i:i + 1] = [chunk[:self.CHUNK], chunk[self.CHUNK:]]
+                self._maxes[i:i + 1] = [chunk[self.CHUNK - 1], chunk[-1]]
+        self._len += 1
+
+    def remove(self, key):
+        i = bisect.bisect_left(self._maxes, key)
+        chunk = self._chunks[i] if i < len(self._chunks) else []
+        j = bisect.bisect_left(chunk, key)
+        if j == len(chunk) or chunk[j] != key:
+            raise ValueError(f"{key!r} not in list")
+        del chunk[j]
+        if chunk:
+            self._maxes[i] = chunk[-1]
+        else:
+            del self._chunks[i], self._maxes[i]
+        self._len -= 1
+
+    def irange(self, start=None, reverse=False):
+        """Iterate keys >= `start` in ascending order, or with `reverse`,
+        keys < `start` in descending order; None means from the end."""
+        if reverse:
+            yield from self._irange_reverse(start)
+            return
+        if start is None:
+            i = j = 0
+        else:
+            i = bisect.bisect_left(self._maxes, start)
+            j = bisect.bisect_left(self._chunks[i], start) if i < len(self._chunks) else 0
+        for chunk in self._chunks[i:]:
+            yield from chunk[j:]
+            j = 0
+
+    def _irange_reverse(self, start):
+        i = len(self._chunks) if start is None else bisect.bisect_left(self._maxes, start)
+        if i < len(self._chunks):
+            chunk = self._chunks[i]
+            yield from reversed(chunk[:bisect.bisect_left(chunk, start)])
+        for chunk in reversed(self._chunks[:i]):
+            yield from reversed(chunk)
+
+def keyset_page(irange, after=None, before=None, limit=PAGE_SIZE):
+    """One page of keys from an ordered source, for keyset pagination.
+
+    `irange(start, reverse)` behaves like SortedKeyList.irange. The page
+    starts just past `after`, or ends just before `before`. Returns (keys,
+    prev_key, next_key); the last two are the cursors to pass back as
+    `before`/`after` for the neighbouring pages, or None when there is
+    nothing on that side (or the page is empty).
+    """
+    if before is not None:
+        keys = list(itertools.islice(irange(before, reverse=True), limit))[::-1]
+    else:
+        keys = list(itertools.islice((k for k in irange(after) if k != after), limit))
+    if not keys:
+        return keys, None, None
+    first, last = keys[0], keys[-1]
+    has_prev = next(irange(first, reverse=True), None) is not None
+    has_next = next((k for k in irange(last) if k != last), None) is not None
+    return keys, first if has_prev else None, last if has_next else None
+
+def list_irange(keys):
+    """SortedKeyList-style irange over a plain sorted list of keys."""
+    def irange(start=None, reverse=False):
+        pos = len(keys) if start is None and reverse else 0 if start is None else bisect.bisect_left(keys, start)
+        if reverse:
+            return (keys[i] for i in range(pos - 1, -1, -1))
+        return (keys[i] for i in range(pos, len(keys)))
+    return irange
+
+class OrderedIndex(InventoryIndex):
+    """Items kept in the order of `key(item_id, record)` for paged listings.
+
+    Keys must be unique, so they should end with the item id.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.clear()
+
+    def clear(self):
+        self._keys = SortedKeyList()
+
+    def add(self, iid, rec):
+        self._keys.add(self.key(iid, rec))
+
+    def remove(self, iid, rec):
+        self._keys.remove(self.key(iid, rec))
+
+    def page(self, after=None, before=None, limit=PAGE_SIZE):
+        """keyset_page() over this index."""
+        with self.lock:
+            return keyset_page(self._keys.irange, after, before, limit)
+
+class RefIndex(InventoryIndex):
+    """Ref number -> item id, for the purchase screen.
+
+    Refs are stored on the records, so this is just a dict kept in step
+    with the store plus the refs in order for paging. Items written before
+    refs existed are collected in `missing`, in store order, until
+    ensure_refs() numbers them.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._by_ref = {}
+        self._order = SortedKeyList()
+        self.missing = {}  # item ids without a ref, in insertion order
+
+    def add(self, iid, rec):
+        ref = rec.get("ref")
+        if ref is None:
+            self.missing[iid] = None
+        else:
+            self._by_ref[ref] = iid
+            self._order.add((ref, iid))
+
+    def remove(self, iid, rec):
+        ref = rec.get("ref")
+        if ref is None:
+            self.missing.pop(iid, None)
+        else:
+            if self._by_ref.get(ref) == iid:
+                del self._by_ref[ref]
+            self._order.remove((ref, iid))
+
+    def lookup(self, ref):
+        """Item id for a ref number, or None."""
+        with self.lock:
+            return self._by_ref.get(ref)
+
+    def page(self, after=None, before=None, limit=PAGE_SIZE):
+        """keyset_page() over (ref, item_id), in ref order."""
+        with self.lock:
+            return keyset_page(self._order.irange, after, before, limit)
+
+class PrefixIndex(InventoryIndex):
+    """Prefix lookup over upper-cased item ids and lower-cased names.
+
+    Names are indexed from the start of every word, so "app" finds
+    "Green Apple" as well as "Apple Juice". Keys live in SortedKeyLists,
+    so completing a prefix is a bisect plus a scan of the matches read.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._ids = SortedKeyList()    # (ITEM_ID, item_id)
+        self._names = SortedKeyList()  # (name from a word start, item_id)
+
+    @staticmethod
+    def _name_keys(iid, rec):
+        name = rec.get("name", "").lower()
+        return {(name[i:], iid) for i in range(len(name))
+                if not name[i].isspace() and (i == 0 or name[i - 1].isspace())}
+
+    def add(self, iid, rec):
+        self._ids.add((iid.upper(), iid))
+        for key in self._name_keys(iid, rec):
+            self._names.add(key)
+
+    def remove(self, iid, rec):
+        self._ids.remove((iid.upper(), iid))
+        for key in self._name_keys(iid, rec):
+            self._names.remove(key)
+
+    def complete(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """Up to `limit` item ids: id-prefix matches first, then items with
+        a name word starting with `prefix`, each group in key order."""
+        prefix = prefix.strip()
+        found = []
+        if not prefix or limit <= 0:
+            return found
+        with self.lock:
+            for keys, p in ((self._ids, prefix.upper()), (self._names, prefix.lower())):
+                for key, iid in keys.irange((p,)):
+                    if not key.startswith(p):
+                        break
+                    if iid not in found:
+                        found.append(iid)
+                        if len(found) == limit:
+                            return found
+        return found
+
+class ThresholdIndex(InventoryIndex):
+    """Low-stock index honouring per-item and per-category thresholds.
+
+    Items are bucketed by their effective reorder threshold, and each
+    bucket keeps (quantity, item_id) in a SortedKeyList, so the low items
+    of a bucket are a prefix of it. There are only a handful of distinct
+    thresholds, so listing what is low merges those prefixes in O(k log B)
+    and never looks at stock above its threshold. `low` holds the ids
+    currently under their threshold; a write flips an item in or out the
+    moment it crosses.
+    """
+
+    def __init__(self, categories=None):
+        self.categories = categories if categories is not None else {}
+        self.clear()
+
+    def clear(self):
+        self._buckets = {}    # threshold -> SortedKeyList of (quantity, item_id)
+        self._threshold = {}  # item_id -> effective threshold
+        self.low = set()
+
+    def add(self, iid, rec):
+        t = reorder_threshold(rec, self.categories)
+        q = rec.get("quantity", 0)
+        self._threshold[iid] = t
+        self._buckets.setdefault(t, SortedKeyList()).add((q, iid))
+        if q < t:
+            self.low.add(iid)
+
+    def remove(self, iid, rec):
+        t = self._threshold.pop(iid)
+        bucket = self._buckets[t]
+        bucket.remove((rec.get("quantity", 0), iid))
+        if not len(bucket):
+            del self._buckets[t]
+        self.low.discard(iid)
+
+    def threshold(self, iid):
+        """Effective threshold of an indexed item."""
+        with self.lock:
+            return self._threshold.get(iid, LOW_STOCK_THRESHOLD)
+
+    def irange(self, start=None, reverse=False):
+        """Low items as (quantity, item_id) keys; see SortedKeyList.irange."""
+        parts = []
+        for t, bucket in self._buckets.items():
+            bound = (t,)
+            if reverse:
+                parts.append(bucket.irange(bound if start is None else min(start, bound), reverse=True))
+            else:
+                parts.append(itertools.takewhile(lambda k, bound=bound: k < bound, bucket.irange(start)))
+        return heapq.merge(*parts, reverse=reverse)
+
+    def page(self, after=None, before=None, limit=PAGE_SIZE):
+        """keyset_page() over the low items, lowest quantity first."""
+        with self.lock:
+            return keyset_page(self.irange, after, before, limit)
+
+def _edit_distance(a, b, limit):
+    """Optimal string alignment distance (a swap of neighbours counts as one
+    edit), or limit + 1 as soon as the distance is known to exceed `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+class FuzzyIndex(InventoryIndex):
+    """Typo-tolerant lookup of name words (SymSpell-style deletion dictionary).
+
+    Every word of every name is filed under each variant of itself with up
+    to MAX_EDITS characters deleted. A query word is expanded the same way,
+    only words sharing a variant with it are candidates, and those are
+    checked with a real edit distance, so a lookup never walks all names.
+    """
+
+    MAX_EDITS = 2
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._deletes = defaultdict(set)  # deletion variant -> words
+        self._words = defaultdict(set)    # word -> item ids
+
+    @staticmethod
+    def _split(text):
+        return text.lower().split()
+
+    @classmethod
+    def budget(cls, word):
+        # edits tolerated for a query word: none for 1-3 letters, one up to 6
+        return min(cls.MAX_EDITS, (len(word) - 1) // 3)
+
+    @staticmethod
+    def _variants(word, edits):
+        found = frontier = {word}
+        for _ in range(edits):
+            frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+            found = found | frontier
+        return found
+
+    def add(self, iid, rec):
+        for word in self._split(rec.get("name", "")):
+            if not self._words[word]:
+                for v in self._variants(word, self.MAX_EDITS):
+                    self._deletes[v].add(word)
+            self._words[word].add(iid)
+
+    def remove(self, iid, rec):
+        for word in self._split(rec.get("name", "")):
+            ids = self._words.get(word)
+            if ids is None:
+                continue
+            ids.discard(iid)
+            if not ids:
+                del self._words[word]
+                for v in self._variants(word, self.MAX_EDITS):
+                    self._deletes[v].discard(word)
+                    if not self._deletes[v]:
+                        del self._deletes[v]
+
+    def _close_words(self, word):
+        # {indexed word: distance} within the query word's edit budget
+        k = self.budget(word)
+        candidates = set()
+        for v in self._variants(word, k):
+            candidates |= self._deletes.get(v, set())
+        found = {}
+        for w in candidates:
+            d = _edit_distance(word, w, k)
+            if d <= k:
+                found[w] = d
+        return found
+
+    def search(self, term):
+        """Ids of items with a name word within edit distance of every word
+        of `term`, closest first (then by id)."""
+        words = self._split(term)
+        if not words:
+            return []
+        with self.lock:
+            scores = None
+            for word in words:
+                hits = {}
+                for w, d in self._close_words(word).items():
+                    for iid in self._words[w]:
+                        hits[iid] = min(d, hits.get(iid, d))
+                if scores is None:
+                    scores = hits
+                else:
+                    scores = {iid: scores[iid] + d for iid, d in hits.items() if iid in scores}
+                if not scores:
+                    return []
+        return sorted(scores, key=lambda iid: (scores[iid], iid))
+
+def make_store(backend=STORAGE_BACKEND, indexes=None):
+    if backend == "sqlite":
+        return SqliteStore(DB_FILE, indexes=indexes)
+    if backend == "journal":
+        return JournaledJsonStore(DATA_FILE, JOURNAL_FILE, indexes=indexes)
+    return JsonStore(DATA_FILE, indexes=indexes)
+
+INDEXES = IndexSet()
+STORE = make_store(indexes=INDEXES)
+NGRAMS = INDEXES.register(NgramIndex())
+PREFIXES = INDEXES.register(PrefixIndex())
+FUZZY = INDEXES.register(FuzzyIndex())
+BY_ID = INDEXES.register(OrderedIndex(lambda iid, rec: (iid,)))
+BY_NAME = INDEXES.register(OrderedIndex(lambda iid, rec: (rec.get("name", "").lower(), iid)))
+REFS = INDEXES.register(RefIndex())
+CATEGORIES = CategoryThresholds(CATEGORIES_FILE)
+THRESHOLDS = INDEXES.register(ThresholdIndex(CATEGORIES.load()))
+EVENTS = EventBroker()
+CARTS = CartStore(CARTS_FILE)
+SALES = SalesLedger(LEDGER_DIR)
+ROLLUPS = SalesRollups(ROLLUPS_FILE, SALES)
+
+def load_inventory():
+    return STORE.load_all()
 
 def save_inventory(inv):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(inv, f, indent=4)
+    STORE.save_all(inv)
+
+def cache_stats():
+    return dict(STORE.stats, backend=STORAGE_BACKEND, carts=dict(CARTS.stats))
+
+def search_ids(term, exact_id=False):
+    """Ids of the items matching `term` via the n-gram index, sorted."""
+    STORE.sync_indexes()
+    return sorted(NGRAMS.search(term, exact_id=exact_id))
+
+def search_inventory(term, exact_id=False):
+    """Items matching `term`, ordered by item id."""
+    return STORE.get_many(search_ids(term, exact_id=exact_id))
+
+def fuzzy_search_inventory(term):
+    """Items whose name words are within a couple of typos of `term`,
+    closest matches first."""
+    STORE.sync_indexes()
+    return STORE.get_many(FUZZY.search(term))
+
+def sync_thresholds():
+    """Bring the indexes up to date, re-bucketing the low-stock index if the
+    category thresholds changed (here or in another worker)."""
+    STORE.sync_indexes()
+    categories = CATEGORIES.load()
+    with INDEXES.lock:
+        if categories is not THRESHOLDS.categories:
+            was_low = set(THRESHOLDS.low)
+            THRESHOLDS.categories = categories
+            INDEXES.refresh(THRESHOLDS)
+            for iid in was_low ^ THRESHOLDS.low:
+                publish_low_stock(iid, INDEXES.record(iid), iid in THRESHOLDS.low)
+    return THRESHOLDS
+
+def publish_low_stock(iid, rec, low):
+    EVENTS.publish("low_stock", {"id": iid, "low": low, "name": rec["name"],
+                                 "quantity": rec.get("quantity", 0), "category": rec.get("category"),
+                                 "threshold": reorder_threshold(rec, THRESHOLDS.categories)})
+
+def publish_changes(changes):
+    """IndexSet listener: an "item" event per change, plus a "low_stock"
+    event whenever an item crosses its reorder threshold."""
+    categories = THRESHOLDS.categories
+    for iid, old, new in changes:
+        op = "deleted" if new is None else "added" if old is None else "updated"
+        EVENTS.publish("item", {"id": iid, "op": op, "item": new})
+        was_low = old is not None and old.get("quantity", 0) < reorder_threshold(old, categories)
+        is_low = new is not None and new.get("quantity", 0) < reorder_threshold(new, categories)
+        if was_low != is_low:
+            publish_low_stock(iid, new or old, is_low)
+
+INDEXES.listeners.append(publish_changes)
+
+def ensure_refs():
+    """Sync the indexes, numbering any items that don't have a ref yet.
+
+    Those are items from before refs were stored; they're numbered in store
+    order, so an old inventory keeps the refs it was shown with."""
+    STORE.sync_indexes()
+    with INDEXES.lock:
+        missing = list(REFS.missing)
+    if missing:
+        STORE.assign_refs(missing)
+        STORE.sync_indexes()
+    return REFS
+
+def autocomplete_items(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """Items whose id or a name word starts with `prefix`, best matches first."""
+    STORE.sync_indexes()
+    return STORE.get_many(PREFIXES.complete(prefix, limit))
 
 # ----------------- utility -----------------
-def build_ref_map(inv):
-    # returns dict mapping ref_str -> item_id (enumeration)
-    return {str(i): item_id for i, item_id in enumerate(inv.keys(), start=1)}
+class ReservedRow(Mapping):
+    """Read-only view of one record whose "quantity" is stock minus what's
+    reserved; worked out on access, nothing is copied."""
+
+    __slots__ = ("rec", "reserved")
+
+    def __init__(self, rec, reserved):
+        self.rec, self.reserved = rec, reserved
+
+    def __getitem__(self, key):
+        if key == "quantity":
+            return self.rec.get("quantity", 0) - self.reserved
+        return self.rec[key]
+
+    def __iter__(self):
+        return iter(self.rec)
+
+    def __len__(self):
+        return len(self.rec)
+
+class ReservedView(Mapping):
+    """Read-only overlay of `records` ({item_id: record}) with `reserved`
+    ({item_id: qty}, e.g. units on hold) taken off each item's stock.
+
+    The records stay untouched (they are the store's shared cache); rows are
+    wrapped lazily as they are read.
+    """
+
+    def __init__(self, items, reserved):
+        self.records, self.reserved = items, reserved
+
+    def __getitem__(self, iid):
+        return ReservedRow(self.records[iid], self.reserved.get(iid, 0))
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def available(self, iid):
+        return self.records[iid].get("quantity", 0) - self.reserved.get(iid, 0)
+
+def resolve_ref(text):
+    """Item id for what was typed on the purchase screen: a ref number or an
+    item id. The id isn't checked to exist."""
+    text = str(text).strip()
+    iid = ensure_refs().lookup(int(text)) if text.isascii() and text.isdigit() else None
+    return iid or text.upper()
+
+def cart_lines(requested):
+    """Validate (line_no, ref or item id, qty) requests against one read of
+    the inventory.
+
+    Returns the lines to hold, as (line_no, item_id, qty, name, price),
+    and {line_no: error message} for the rest.
+    """
+    wanted, errors = [], {}
+    for n, ref, qty in requested:
+        try:
+            qty = int(qty)
+        except (TypeError, ValueError):
+            errors[n] = "Invalid quantity."
+            continue
+        if qty <= 0:
+            errors[n] = "Qty must be at least 1."
+            continue
+        wanted.append((n, resolve_ref(ref), qty))
+    items = STORE.get_many(iid for _, iid, _ in wanted)
+    lines = []
+    for n, iid, qty in wanted:
+        d = items.get(iid)
+        if d is None:
+            errors[n] = "Invalid ref number."
+        else:
+            lines.append((n, iid, qty, d["name"], d["price"]))
+    return lines, errors
+
+def stock_of(iids):
+    """{item_id: quantity in stock} for the items that exist; CARTS reads
+    it while it checks a new hold."""
+    return {iid: d.get("quantity", 0) for iid, d in STORE.get_many(iids).items()}
+
+def json_cart_lines(raw):
+    """(line_no, ref, qty) requests from a JSON "lines" list of {"ref" (or
+    "item_id"/"id"), "qty"} objects or [ref, qty] pairs."""
+    requested = []
+    for n, line in enumerate(raw, 1):
+        if isinstance(line, dict):
+            requested.append((n, line.get("ref", line.get("item_id", line.get("id", ""))), line.get("qty")))
+        elif isinstance(line, list) and len(line) == 2:
+            requested.append((n, *line))
+        else:
+            requested.append((n, "", None))
+    return requested
+
+def add_cart_lines(cart_id, requested):
+    """Hold the (line_no, ref, qty) requests in a cart, in one write.
+
+    Returns ({line_no: (item_id, qty, qty now in cart)}, {line_no: error
+    message}); raises CheckoutInProgress if the cart is being checked out.
+    """
+    lines, errors = cart_lines(requested)
+    results = CARTS.add_many(cart_id, [(iid, qty, name, price) for _, iid, qty, name, price in lines], stock_of)
+    added = {}
+    for (n, iid, qty, *_), result in zip(lines, results):
+        if isinstance(result, StockUnavailable):
+            errors[n] = f"Only {result.available} of {iid} available."
+        else:
+            added[n] = (iid, qty, result)
+    return added, errors
+
+def cart_lines_json(requested, added, errors):
+    return [{"line": n, "id": added[n][0], "qty": added[n][1], "in_cart": added[n][2]} if n in added
+            else {"line": n, "error": errors[n]} for n, *_ in requested]
+
+def checkout_cart(cart_id):
+    """Sell everything in a cart: returns (sale, short item ids).
+
+    The cart is claimed first, so a double submit can't sell it twice,
+    and its holds keep other carts off its units. The store then deducts
+    every line or none, touching only the cart's items; on success the
+    sale goes into the ledger under a new invoice number before the holds
+    are released. (None, []) means the cart was empty. Raises
+    CheckoutInProgress if the cart is already being checked out.
+
+    Each step is recorded with the claim before the next one runs. If a
+    step fails after the stock was deducted, the error propagates but the
+    cart keeps its sale, and checking it out again finishes that sale (no
+    second deduction, and a sale already in the ledger isn't appended
+    again) rather than starting a new one. A deduction whose write fails
+    never happened (the store drops it from memory too), so that retry
+    deducts afresh. A crash between the deduction and recording it is
+    covered on SQLite, where the sale id is stored with the deduction; the
+    JSON backends can't commit the two together.
+    """
+    pending = CARTS.begin_checkout(cart_id)
+    if pending is None:
+        return None, []
+    sale = pending["sale"]
+    try:
+        if pending["deducted"]:
+            sale = SALES.find(sale["id"], pending["ledger_from"]) or sale  # a retry: was it recorded?
+        else:
+            short = STORE.deduct({line["id"]: line["qty"] for line in sale["lines"]}, token=sale["id"])
+            if short:
+                CARTS.abort_checkout(cart_id)
+                return None, short
+            pending = dict(pending, deducted=True, ledger_from=SALES.next_invoice())
+            CARTS.update_checkout(cart_id, pending)
+        if "invoice" not in sale:
+            SALES.append(sale)
+        ROLLUPS.record(sale)
+    except BaseException:
+        CARTS.release_checkout(cart_id)
+        raise
+    CARTS.finish_checkout(cart_id)
+    return sale, []
+
+def session_cart_id(create=False):
+    """This session's cart id; with `create`, one is made if it has none."""
+    cart_id = session.get("cart_id")
+    if cart_id is None and create:
+        cart_id = session["cart_id"] = CARTS.new_id()
+    return cart_id
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+def decode_cursor(text):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(text.encode("ascii")))
+    except ValueError:
+        return None
+    return tuple(key) if isinstance(key, list) else None
+
+def page_request(*types):
+    """(after, before, per_page) from the query string. A cursor that isn't
+    a key of `types` (tampered, or from another view) is ignored, which
+    restarts paging at the first page."""
+    def cursor(name):
+        key = decode_cursor(request.args.get(name, ""))
+        if key is None or len(key) != len(types) or not all(isinstance(v, t) for v, t in zip(key, types)):
+            return None
+        return key
+    per_page = max(1, min(request.args.get("per_page", PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    return cursor("after"), cursor("before"), per_page
+
+def pager(prev_key, next_key, per_page, **args):
+    """Links for the template's pager; `args` are the view's other query args."""
+    if per_page != PAGE_SIZE:
+        args["per_page"] = per_page
+    paged = "after" in request.args or "before" in request.args
+    return {
+        "first": url_for(request.endpoint, **args) if paged else None,
+        "prev": url_for(request.endpoint, before=encode_cursor(prev_key), **args) if prev_key is not None else None,
+        "next": url_for(request.endpoint, after=encode_cursor(next_key), **args) if next_key is not None else None,
+        "per_page": per_page,
+    }
+
+def parse_threshold(text):
+    """Reorder threshold from a form field: None when blank, else an int >= 0
+    (ValueError otherwise)."""
+    text = text.strip()
+    if not text:
+        return None
+    value = int(text)
+    if value < 0:
+        raise ValueError(text)
+    return value
+
+def _field(fields, key):
+    # a form or JSON value as stripped text; missing and null are blank
+    v = fields.get(key)
+    return "" if v is None else str(v).strip()
+
+def new_item(iid, fields):
+    """(item_id, record) for a new item from the Add form's fields (or the
+    API's), validated; raises ValueError with a message for the user."""
+    iid = str(iid or "").strip().upper()
+    name = _field(fields, "name").title()
+    qty = _field(fields, "quantity")
+    price = _field(fields, "price")
+    category = _field(fields, "category").title()
+    if not iid or not name or qty == "" or price == "":
+        raise ValueError("Item ID, Name, Quantity and Price are required.")
+    try:
+        qty = int(qty)
+        price = float(price)
+        if not math.isfinite(price):
+            raise ValueError(price)  # "nan"/"inf" parse, but aren't prices (nor valid JSON)
+    except ValueError:
+        raise ValueError("Quantity must be integer and Price must be numeric.") from None
+    if qty < 0 or price < 0:
+        raise ValueError("Quantity and Price must be non-negative.")
+    try:
+        threshold = parse_threshold(_field(fields, "threshold"))
+    except ValueError:
+        raise ValueError("Reorder threshold must be a non-negative integer.") from None
+    rec = {"name": name, "quantity": qty, "price": price}
+    if category:
+        rec["category"] = category
+    if threshold is not None:
+        rec["threshold"] = threshold
+    return iid, rec
+
+def item_update(fields):
+    """The Update form's fields (or the API's) as change(details) for
+    STORE.update, plus {field: problem} for the values that didn't parse;
+    those fields are left out of the change."""
+    new_name = _field(fields, "name")
+    qty_txt = _field(fields, "quantity")
+    qty_mode = fields.get("qty_mode", "Replace")
+    price_txt = _field(fields, "price")
+    price_mode = fields.get("price_mode", "Replace")
+    category = _field(fields, "category").title()
+    use_default = bool(fields.get("threshold_default"))
+    qnum = pnum = tnum = None
+    errors = {}
+    if qty_txt:
+        try:
+            qnum = int(qty_txt)
+        except ValueError:
+            errors["quantity"] = "Invalid quantity"
+    if price_txt:
+        try:
+            pnum = float(price_txt)
+            if not math.isfinite(pnum):
+                raise ValueError(price_txt)
+        except ValueError:
+            errors["price"] = "Invalid price"
+    try:
+        tnum = parse_threshold(_field(fields, "threshold"))
+    except ValueError:
+        errors["threshold"] = "Invalid reorder threshold"
+
+    # applied against the latest stored record, under the store's lock
+    def apply(details):
+        if new_name:
+            details["name"] = new_name.title()
+        if qnum is not None:
+            if qty_mode == "Add":
+                details["quantity"] = details.get("quantity",0) + qnum
+            else:
+                details["quantity"] = qnum
+        if pnum is not None:
+            if price_mode == "Add":
+                details["price"] = details.get("price",0.0) + pnum
+            else:
+                details["price"] = pnum
+        if category:
+            details["category"] = category
+        if use_default:
+            details.pop("threshold", None)  # fall back to the category's level
+        elif tnum is not None:
+            details["threshold"] = tnum
+        return details
+
+    return apply, errors
+
+def import_format(name, mimetype=None):
+    """"csv" or "ndjson" from a file name or content type; None if neither says."""
+    name, mimetype = (name or "").lower(), (mimetype or "").lower()
+    if name.endswith(".csv") or mimetype == "text/csv":
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or mimetype in ("application/x-ndjson", "application/ndjson",
+                                                            "application/jsonl"):
+        return "ndjson"
+    return None
+
+_LONE_CR = re.compile(r"(?<=\r)(?!\n)")
+
+def _upload_lines(stream):
+    # the lines of a binary upload as text, decoded one at a time, so rows
+    # before an undecodable byte still import and the error names its line
+    if isinstance(stream, io.RawIOBase):
+        stream = io.BufferedReader(stream)
+    for n, line in enumerate(stream, 1):
+        try:
+            text = line.decode("utf-8-sig" if n == 1 else "utf-8")
+        except UnicodeDecodeError as e:
+            raise UnreadableUpload(n, e) from None
+        yield from (part for part in _LONE_CR.split(text) if part)  # old Mac files end lines in \r
+
+def import_rows(stream, fmt):
+    """(line_no, fields) for each row of a CSV (header row first) or NDJSON
+    upload, decoded from the binary `stream` a line at a time rather than
+    read whole. Blank rows are skipped; fields is None for an NDJSON line
+    that isn't a JSON object. Raises UnreadableUpload where the upload
+    stops making sense."""
+    lines = _upload_lines(stream)
+    if fmt == "csv":
+        reader = csv.reader(lines)
+        try:
+            header = [h.strip().lower() for h in next(reader, [])]
+            for row in reader:
+                if any(v.strip() for v in row):
+                    yield reader.line_num, dict(zip(header, row))
+        except csv.Error as e:
+            raise UnreadableUpload(reader.line_num, e) from None
+    else:
+        for n, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    fields = json.loads(line)
+                except ValueError:
+                    fields = None
+                yield n, fields if isinstance(fields, dict) else None
+
+def import_items(rows, batch_size=IMPORT_BATCH_SIZE):
+    """Upsert (line_no, fields) rows into the store, one write per
+    `batch_size` rows.
+
+    Each row is validated as the Add form does; bad rows are skipped and
+    reported. Optional columns left blank keep the item's current value,
+    and an item id repeated within a batch keeps its last row. Returns
+    {"rows", "imported", "failed", "errors": [{"line", "error"}]}, listing
+    at most IMPORT_MAX_ERRORS errors.
+    """
+    report = {"rows": 0, "imported": 0, "failed": 0, "errors": []}
+    batch = {}
+
+    def fail(n, message):
+        report["failed"] += 1
+        if len(report["errors"]) < IMPORT_MAX_ERRORS:
+            report["errors"].append({"line": n, "error": message})
+
+    def flush():
+        for iid, old in STORE.get_many(list(batch)).items():
+            for k in OPTIONAL_FIELDS:
+                if k not in batch[iid] and old.get(k) is not None:
+                    batch[iid][k] = old[k]
+        STORE.put_many(batch)
+        report["imported"] += len(batch)
+        batch.clear()
+
+    try:
+        for n, fields in rows:
+            report["rows"] += 1
+            try:
+                if fields is None:
+                    raise ValueError("Not a JSON object.")
+                iid, rec = new_item(fields.get("id", fields.get("item_id")), fields)
+            except ValueError as e:
+                fail(n, str(e))
+                continue
+            batch[iid] = rec
+            if len(batch) >= batch_size:
+                flush()
+    except UnreadableUpload as e:
+        fail(e.line, f"Unreadable upload, import stopped here: {e}")
+    if batch:
+        flush()
+    return report
+
+def export_items(sort="id", prefix="", low_only=False):
+    """(item_id, record) for every item in `sort` order ("id" or "name"),
+    optionally only names starting with `prefix` and/or low-stock items.
+
+    Reads EXPORT_CHUNK keys at a time from the ordered index and fetches
+    just those records, so memory stays flat however large the inventory
+    is; items changed mid-export show up as they are when their chunk is
+    read. A name prefix sorted by name starts at the prefix and stops
+    past it instead of scanning.
+    """
+    prefix = prefix.lower()
+    index = BY_NAME if sort == "name" else BY_ID
+    after = (prefix,) if sort == "name" and prefix else None
+    while True:
+        categories = sync_thresholds().categories  # also picks up other workers' writes
+        keys, _, next_key = index.page(after, None, EXPORT_CHUNK)
+        for iid, d in STORE.get_many(k[-1] for k in keys).items():
+            name = d["name"].lower()
+            if prefix and not name.startswith(prefix):
+                if sort == "name" and name > prefix:
+                    return
+                continue
+            if low_only and d.get("quantity", 0) >= reorder_threshold(d, categories):
+                continue
+            yield iid, d
+        if next_key is None:
+            return
+        after = next_key
+
+EXPORT_FIELDS = ("id", "name", "quantity", "price", "category", "threshold", "ref")  # import reads these back
+
+def export_csv(rows):
+    """CSV text for export_items() rows, a chunk at a time; the header row
+    goes out first, before anything is read."""
+    buf = io.StringIO()
+    out = csv.writer(buf)
+    out.writerow(EXPORT_FIELDS)
+    yield buf.getvalue()
+    for chunk in iter(lambda: list(itertools.islice(rows, EXPORT_CHUNK)), []):
+        buf.seek(0)
+        buf.truncate()
+        out.writerows([iid] + [d.get(k) for k in EXPORT_FIELDS[1:]] for iid, d in chunk)
+        yield buf.getvalue()
+
+def export_ndjson(rows):
+    """NDJSON text (one item object per line) for export_items() rows."""
+    yield ""  # sends the headers before the first chunk is read
+    for chunk in iter(lambda: list(itertools.islice(rows, EXPORT_CHUNK)), []):
+        yield "".join(json.dumps(dict(d, id=iid), separators=(",", ":")) + "\n" for iid, d in chunk)
+
+def form_version():
+    # version the update/delete form was rendered with; blank skips the
+    # check, anything else that isn't a version raises ValueError rather
+    # than quietly turning the write unconditional
+    v = request.form.get("version","").strip()
+    if not v:
+        return None
+    if not (v.isascii() and v.isdigit()):
+        raise ValueError(v)
+    return int(v)
+
+def flash_bad_version():
+    flash("This form's item version is invalid; nothing was saved. Please reload the page.", "danger")
+
+def flash_conflict(e):
+    cur = e.current
+    flash(f"Item '{e.iid}' was changed by someone else after this form was loaded "
+          f"(now: {cur['name']}, qty {cur['quantity']}, price {cur['price']:.2f}). "
+          "Nothing was saved; please review and submit again.", "warning")
 
 # ----------------- routes -----------------
 @app.route("/")
 def index():
-    inv = load_inventory()
     q = request.args.get("q", "").strip()
-    filtered = inv
+    after, before, per_page = page_request(str)
     if q:
-        k = q.lower()
-        filtered = {iid: d for iid, d in inv.items() 
-                    if k in iid.lower() or k in d["name"].lower()}
-    return render_template("index.html", inventory=filtered, q=q, low_threshold=LOW_STOCK_THRESHOLD)
+        keys = [(iid,) for iid in search_ids(q)]
+        keys, prev_key, next_key = keyset_page(list_irange(keys), after, before, per_page)
+    else:
+        STORE.sync_indexes()
+        keys, prev_key, next_key = BY_ID.page(after, before, per_page)
+    # only the rows on this page are fetched and rendered
+    filtered = STORE.get_many(k[-1] for k in keys)
+    low_ids = sync_thresholds().low & filtered.keys()
+    return render_template("index.html", inventory=filtered, q=q, low_ids=low_ids,
+                           pager=pager(prev_key, next_key, per_page, q=q or None))
 
 # Add
 @app.route("/add", methods=["GET", "POST"])
 def add_item():
-    inv = load_inventory()
     if request.method == "POST":
-        iid = request.form.get("item_id","").strip().upper()
-        name = request.form.get("name","").strip().title()
-        qty = request.form.get("quantity","").strip()
-        price = request.form.get("price","").strip()
-        # validation
-        if not iid or not name or qty == "" or price == "":
-            flash("Item ID, Name, Quantity and Price are required.", "danger")
-            return redirect(url_for("add_item"))
+        # validation (shared with the JSON API)
         try:
-            qty = int(qty)
-            price = float(price)
-        except ValueError:
-            flash("Quantity must be integer and Price must be numeric.", "danger")
+            iid, rec = new_item(request.form.get("item_id"), request.form)
+        except ValueError as e:
+            flash(str(e), "danger")
             return redirect(url_for("add_item"))
-        if qty < 0 or price < 0:
-            flash("Quantity and Price must be non-negative.", "danger")
-            return redirect(url_for("add_item"))
-        if iid in inv:
+        if not STORE.insert(iid, rec):
             flash("Item ID already exists.", "warning")
             return redirect(url_for("add_item"))
-        inv[iid] = {"name": name, "quantity": qty, "price": price}
-        save_inventory(inv)
-        flash(f"Item '{name}' added.", "success")
+        flash(f"Item '{rec['name']}' added.", "success")
         return redirect(url_for("index"))
-    return render_template("add.html")
+    return render_template("add.html", categories=sorted(CATEGORIES.load()))
 
 # Update (select item by id in form or go to /update/<item_id> for prefilled)
 @app.route("/update", methods=["GET","POST"])
 def update_item():
-    inv = load_inventory()
     if request.method == "POST":
         iid = request.form.get("item_id_select","").strip().upper()
-        if iid not in inv:
+        try:
+            version = form_version()
+        except ValueError:
+            flash_bad_version()
+            return redirect(url_for("update_item", item=iid))
+        apply, errors = item_update(request.form)
+        for field, problem in errors.items():
+            flash(f"{problem}; skipping {field} update.", "warning")
+
+        try:
+            before, details = STORE.update(iid, apply, expect_version=version)
+        except VersionConflict as e:
+            flash_conflict(e)
+            return redirect(url_for("update_item", item=iid))
+        if before is None:
             flash("Item ID not found.", "danger")
             return redirect(url_for("update_item"))
-        details = inv[iid]
-        # values
-        new_name = request.form.get("name","").strip()
-        qty_txt = request.form.get("quantity","").strip()
-        qty_mode = request.form.get("qty_mode","Replace")
-        price_txt = request.form.get("price","").strip()
-        price_mode = request.form.get("price_mode","Replace")
-        if new_name:
-            details["name"] = new_name.title()
-        if qty_txt:
-            try:
-                qnum = int(qty_txt)
-                if qty_mode == "Add":
-                    details["quantity"] = details.get("quantity",0) + qnum
-                else:
-                    details["quantity"] = qnum
-            except ValueError:
-                flash("Invalid quantity; skipping quantity update.", "warning")
-        if price_txt:
-            try:
-                pnum = float(price_txt)
-                if price_mode == "Add":
-                    details["price"] = details.get("price",0.0) + pnum
-                else:
-                    details["price"] = pnum
-            except ValueError:
-                flash("Invalid price; skipping price update.", "warning")
-        inv[iid] = details
-        save_inventory(inv)
         flash(f"Item '{iid} - {details['name']}' updated.", "success")
         return redirect(url_for("index"))
-    # GET
-    return render_template("update.html", inventory=inv)
+    # GET (?item=<id> preselects the item)
+    selected = request.args.get("item","").strip().upper()
+    item = STORE.get(selected) if selected else None
+    return render_template("update.html", selected=selected, item=item, categories=sorted(CATEGORIES.load()))
 
 # Delete (full or partial)
 @app.route("/delete", methods=["GET","POST"])
 def delete_item():
-    inv = load_inventory()
     if request.method == "POST":
         iid = request.form.get("item_id_select","").strip().upper()
-        if iid not in inv:
-            flash("Item ID not found.", "danger")
-            return redirect(url_for("delete_item"))
-        details = inv[iid]
+        try:
+            version = form_version()
+        except ValueError:
+            flash_bad_version()
+            return redirect(url_for("delete_item", item=iid))
         mode = request.form.get("delete_mode","full")
         if mode == "full":
-            del inv[iid]
-            save_inventory(inv)
+            try:
+                details = STORE.delete(iid, expect_version=version)
+            except VersionConflict as e:
+                flash_conflict(e)
+                return redirect(url_for("delete_item", item=iid))
+            if details is None:
+                flash("Item ID not found.", "danger")
+                return redirect(url_for("delete_item"))
             flash(f"Item '{details['name']}' deleted.", "success")
             return redirect(url_for("index"))
         else:
@@ -152,95 +3000,153 @@ def delete_item():
             except ValueError:
                 flash("Invalid quantity.", "danger")
                 return redirect(url_for("delete_item"))
-            if q >= details.get("quantity",0):
-                # confirm full delete fallback
-                del inv[iid]
-                save_inventory(inv)
-                flash(f"Quantity removed >= stock. Entire item '{details['name']}' deleted.", "info")
+
+            def remove_units(details):
+                if q >= details.get("quantity",0):
+                    return None  # confirm full delete fallback
+                details["quantity"] = details.get("quantity",0) - q
+                return details
+
+            try:
+                before, details = STORE.update(iid, remove_units, expect_version=version)
+            except VersionConflict as e:
+                flash_conflict(e)
+                return redirect(url_for("delete_item", item=iid))
+            if before is None:
+                flash("Item ID not found.", "danger")
+                return redirect(url_for("delete_item"))
+            if details is None:
+                flash(f"Quantity removed >= stock. Entire item '{before['name']}' deleted.", "info")
                 return redirect(url_for("index"))
-            details["quantity"] = details.get("quantity",0) - q
-            inv[iid] = details
-            save_inventory(inv)
             flash(f"Removed {q} units from '{details['name']}'. New qty: {details['quantity']}.", "success")
             return redirect(url_for("index"))
-    return render_template("delete.html", inventory=inv)
+    # GET (?item=<id> preselects the item)
+    selected = request.args.get("item","").strip().upper()
+    item = STORE.get(selected) if selected else None
+    return render_template("delete.html", selected=selected, item=item)
 
 # Catalogue
 @app.route("/catalogue")
 def catalogue():
-    inv = load_inventory()
-    # sorted by name
-    items = sorted(inv.items(), key=lambda x: x[1]["name"].lower())
-    return render_template("catalogue.html", items=items)
+    # read in order from the name index, keyed by (lower-cased name, item
+    # id) so equal names page in a stable order; nothing is re-sorted
+    after, before, per_page = page_request(str, str)
+    STORE.sync_indexes()
+    keys, prev_key, next_key = BY_NAME.page(after, before, per_page)
+    items = list(STORE.get_many(iid for _, iid in keys).items())
+    return render_template("catalogue.html", items=items, pager=pager(prev_key, next_key, per_page))
+
+# Full inventory dump for accounting, streamed (chunked) as it's read:
+# ?format=csv|ndjson, ?sort=id|name, ?prefix= (of the name), ?low_stock=1
+@app.route("/export")
+def export():
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        abort(400)
+    sort = "name" if request.args.get("sort") == "name" else "id"
+    rows = export_items(sort, request.args.get("prefix", "").strip(),
+                        request.args.get("low_stock", "") not in ("", "0", "false"))
+    filename = f"inventory-{datetime.now():%Y%m%d-%H%M%S}.{fmt}"
+    return Response(export_csv(rows) if fmt == "csv" else export_ndjson(rows),
+                    mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"',
+                             "Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # Low stock
 @app.route("/low_stock")
 def low_stock():
-    inv = load_inventory()
-    low = {iid: d for iid, d in inv.items() if d.get("quantity",0) < LOW_STOCK_THRESHOLD}
-    return render_template("low_stock.html", inventory=low, threshold=LOW_STOCK_THRESHOLD)
+    # lowest stock first; only the items under their own threshold are read
+    after, before, per_page = page_request((int, float), str)
+    thresholds = sync_thresholds()
+    keys, prev_key, next_key = thresholds.page(after, before, per_page)
+    page = STORE.get_many(iid for _, iid in keys)
+    for iid, d in page.items():
+        page[iid] = dict(d, reorder_at=thresholds.threshold(iid))
+    return render_template("low_stock.html", inventory=page, threshold=LOW_STOCK_THRESHOLD,
+                           pager=pager(prev_key, next_key, per_page))
+
+# Default reorder thresholds per category
+@app.route("/categories", methods=["GET","POST"])
+def categories():
+    if request.method == "POST":
+        category = request.form.get("category","").strip().title()
+        try:
+            threshold = parse_threshold(request.form.get("threshold",""))
+        except ValueError:
+            flash("Threshold must be a non-negative integer.", "danger")
+            return redirect(url_for("categories"))
+        if not category:
+            flash("Category is required.", "danger")
+            return redirect(url_for("categories"))
+        CATEGORIES.set(category, threshold)
+        if threshold is None:
+            flash(f"Category '{category}' now uses the default threshold ({LOW_STOCK_THRESHOLD}).", "info")
+        else:
+            flash(f"Items in '{category}' are low below {threshold} unless they set their own threshold.", "success")
+        return redirect(url_for("categories"))
+    return render_template("categories.html", categories=sorted(CATEGORIES.load().items()),
+                           default=LOW_STOCK_THRESHOLD)
 
 # Search handled via index GET param; provide explicit page too
 @app.route("/search", methods=["GET","POST"])
 def search():
-    inv = load_inventory()
     results = {}
+    term = ""
+    fuzzy = False
     if request.method == "POST":
         term = request.form.get("term","").strip().lower()
-        if term:
-            results = {iid: d for iid, d in inv.items() if term == iid.lower() or term in d["name"].lower()}
+        fuzzy = bool(request.form.get("fuzzy"))
+        if term and fuzzy:
+            results = fuzzy_search_inventory(term)
+        elif term:
+            # exact item id, or part of the name
+            results = search_inventory(term, exact_id=True)
+            if not results:
+                # most misses are typos; offer the closest names instead
+                results = fuzzy_search_inventory(term)
+                if results:
+                    flash(f"No exact matches for '{term}'; showing close matches.", "info")
         if not results:
             flash("No matching items found.", "warning")
-    return render_template("search.html", results=results)
+    return render_template("search.html", results=results, term=term, fuzzy=fuzzy)
 
-# Purchase flow: ref map + cart in session
+# Purchase flow: persistent ref numbers + cart in session
 @app.route("/purchase", methods=["GET"])
 def purchase():
-    inv = load_inventory()
-    # Apply temporary 'reservation' to inventory displayed in the purchase view
-    temp_inv = inv.copy()
-    cart = session.get("cart", {})
+    # one page of the ref map, in ref order, read through the ref index
+    after, before, per_page = page_request(int, str)
+    keys, prev_key, next_key = ensure_refs().page(after, before, per_page)
+    cart = CARTS.get(session_cart_id())
     
-    # Apply cart quantities to 'temp_inv' for display 
-    # The 'actual' inventory (inv) is NOT modified here.
-    for iid, d in cart.items():
-        if iid in temp_inv:
-            # Subtract the cart quantity from the temporary inventory copy
-            temp_inv[iid]["quantity"] = temp_inv[iid].get("quantity", 0) - d.get("quantity", 0)
-
-    ref_map = build_ref_map(temp_inv) # Build map using temporary inventory
+    # Show stock minus every cart's holds through a read-only overlay: the
+    # shared inventory records are neither copied nor modified.
+    stock = ReservedView(STORE.get_many(iid for _, iid in keys), CARTS.held(iid for _, iid in keys))
+    rows = [(ref, iid, stock[iid]) for ref, iid in keys if iid in stock]
     
-    return render_template("purchase.html", inv=temp_inv, ref_map=ref_map, cart=cart)
+    return render_template("purchase.html", rows=rows, cart=cart, pager=pager(prev_key, next_key, per_page))
     # The purchase view now shows quantities *as if* the cart items are reserved.
-    # The main 'inv' object is untouched until checkout.
+    # The stored inventory is untouched until checkout.
 
 @app.route("/add_to_cart", methods=["POST"])
 def add_to_cart():
-    inv = load_inventory()
     ref = request.form.get("ref","").strip()
     qty_txt = request.form.get("qty","").strip()
-    ref_map = build_ref_map(inv) # Use main inventory for initial lookup
     
-    if ref not in ref_map:
+    # a ref number, or an item id picked from the autocomplete list
+    iid = resolve_ref(ref)
+    item_details = STORE.get(iid)
+    if item_details is None:
         flash("Invalid ref number.", "danger")
         return redirect(url_for("purchase"))
     
-    iid = ref_map[ref]
-    
     try:
         qty = int(qty_txt)
     except ValueError:
         flash("Invalid quantity.", "danger")
         return redirect(url_for("purchase"))
     
-    # Check current inventory + existing cart quantity to prevent over-selling
-    current_stock = inv[iid].get("quantity", 0)
-    cart = session.get("cart", {})
-    in_cart = cart.get(iid, {}).get("quantity", 0)
-    available_stock = current_stock - in_cart
-
-    if qty <= 0 or qty > available_stock:
-        flash(f"Qty must be 1 - {available_stock}. Current stock is {current_stock}, {in_cart} in cart.", "danger")
+    if qty <= 0:
+        flash("Qty must be at least 1.", "danger")
         return redirect(url_for("purchase"))
     
     # DO NOT touch inventory here (No save_inventory(inv)) 
@@ -248,22 +3154,69 @@ def add_to_cart():
     # Removed: inv[iid] = item
     # Removed: save_inventory(inv)
     
-    # Add to session cart (dict keyed by iid)
-    item_details = inv[iid]
-    if iid in cart:
-        cart[iid]["quantity"] += qty
+    # Hold the units in the server-side cart; the hold is checked against
+    # current stock minus every cart's holds, so nothing can be over-sold
+    cart_id = session_cart_id(create=True)
+    try:
+        CARTS.add(cart_id, iid, qty, item_details["name"], item_details["price"], stock_of)
+    except CheckoutInProgress:
+        flash("This cart is being checked out; try again in a moment.", "warning")
+        return redirect(url_for("purchase"))
+    except StockUnavailable as e:
+        in_cart = (CARTS.line(cart_id, iid) or {}).get("quantity", 0)
+        current_stock = stock_of([iid]).get(iid, 0)
+        flash(f"Qty must be 1 - {e.available}. Current stock is {current_stock}, "
+              f"{current_stock - e.available} on hold ({in_cart} in your cart).", "danger")
+        return redirect(url_for("purchase"))
+    flash(f"Added {qty} x {item_details['name']} to cart. Stock is held for "
+          f"{HOLD_TTL_SECONDS // 60} minutes.", "success")
+    return redirect(url_for("purchase"))
+
+# Many lines in one request: form text ("ref qty" per line) or JSON
+# {"lines": [{"ref": ..., "qty": ...}, ...]} (or [ref, qty] pairs)
+@app.route("/add_to_cart/bulk", methods=["POST"])
+def add_to_cart_bulk():
+    if request.is_json:
+        body = request.get_json(silent=True)
+        raw = body.get("lines") if isinstance(body, dict) else None
+        if not isinstance(raw, list):
+            return jsonify({"error": 'expected {"lines": [...]}'}), 400
+        requested = json_cart_lines(raw)
     else:
-        cart[iid] = {"name": item_details["name"], "price": item_details["price"], "quantity": qty}
-        
-    session["cart"] = cart
-    flash(f"Added {qty} x {item_details['name']} to cart. Stock reserved in purchase view.", "success")
+        requested = []  # numbered by textarea line, blank lines skipped
+        for n, text in enumerate(request.form.get("lines", "").splitlines(), 1):
+            parts = re.split(r"[\s,;]+", text.strip())
+            if parts != [""]:
+                requested.append((n, parts[0], parts[1]) if len(parts) == 2 else (n, text.strip(), None))
+
+    try:
+        added, errors = add_cart_lines(session_cart_id(create=True), requested)
+    except CheckoutInProgress:
+        if request.is_json:
+            return jsonify({"error": "cart is being checked out"}), 409
+        flash("This cart is being checked out; try again in a moment.", "warning")
+        return redirect(url_for("purchase"))
+
+    if request.is_json:
+        return jsonify({"added": len(added), "failed": len(errors),
+                        "lines": cart_lines_json(requested, added, errors)})
+    if added:
+        flash(f"Added {len(added)} line(s) to cart. Stock is held for {HOLD_TTL_SECONDS // 60} minutes.", "success")
+    for n in sorted(errors):
+        flash(f"Line {n}: {errors[n]}", "danger")
+    if not requested:
+        flash("Enter one 'ref qty' per line.", "warning")
     return redirect(url_for("purchase"))
 
 @app.route("/clear_cart", methods=["POST"])
 def clear_cart():
     # Inventory restoration is no longer needed
     # The actual inventory was never modified!
-    session.pop("cart", {})
+    try:
+        CARTS.clear(session_cart_id())
+    except CheckoutInProgress:
+        flash("This cart is being checked out and can't be cleared; check it out again to finish.", "warning")
+        return redirect(url_for("purchase"))
     # Removed: inventory restoration logic
     # Removed: save_inventory(inv)
     
@@ -273,67 +3226,476 @@ def clear_cart():
 @app.route("/cancel_purchase")
 def cancel_purchase():
     """Clears the session cart and redirects to the main inventory view."""
-    if session.get("cart"):
-        session.pop("cart", None)
+    if CARTS.get(session_cart_id()):
+        try:
+            CARTS.clear(session_cart_id())
+        except CheckoutInProgress:
+            flash("This cart is being checked out and can't be cancelled; check it out again to finish.", "warning")
+            return redirect(url_for("purchase"))
         flash("Purchase cancelled and cart cleared.", "info")
     return redirect(url_for("index"))
 
 @app.route("/checkout", methods=["POST"])
 def checkout():
-    inv = load_inventory() # Load inventory just before final deduction
-    cart = session.get("cart", {})
+    cart_id = session_cart_id()
     
-    if not cart:
+    # DEDUCT inventory ONLY at checkout, as one all-or-nothing step
+    try:
+        sale, short = checkout_cart(cart_id)
+    except CheckoutInProgress:
+        flash("This cart is already being checked out.", "warning")
+        return redirect(url_for("purchase"))
+    if short:
+        # Only possible if stock was cut below the held quantity meanwhile
+        item = STORE.get(short[0])
+        name = item["name"] if item else short[0]
+        flash(f"Error: Not enough stock for {name} at checkout. Purchase cancelled.", "danger")
+        # Clear cart anyway; no inventory changes were saved
+        try:
+            CARTS.clear(cart_id)
+        except CheckoutInProgress:
+            pass  # a new checkout attempt got in first; leave the cart to it
+        return redirect(url_for("purchase"))
+    if sale is None:
         flash("Cart is empty.", "warning")
         return redirect(url_for("purchase"))
 
-    # DEDUCT inventory ONLY at checkout
-    for iid, d in cart.items():
-        qty_to_deduct = d.get("quantity", 0)
-        
-        # Double-check stock just in case
-        if iid in inv and inv[iid].get("quantity", 0) >= qty_to_deduct:
-            inv[iid]["quantity"] -= qty_to_deduct
-        else:
-            # This should ideally not happen if add_to_cart check works
-            flash(f"Error: Not enough stock for {d['name']} at checkout. Purchase cancelled.", "danger")
-            # Clear cart anyway, but don't save inventory changes
-            session.pop("cart", None)
-            return redirect(url_for("purchase"))
-            
-    # Save the DEDUCTED inventory
-    save_inventory(inv)
-    
+    return render_bill(sale)
 
-    total = 0.0
-    lines = []
-    for iid, d in cart.items():
-        subtotal = d["quantity"] * d["price"]
-        total += subtotal
-        lines.append({
-            "id": iid,
-            "name": d["name"],
-            "qty": d["quantity"],
-            "price": d["price"],
-            "subtotal": subtotal
-        })
-
-    # Generate current timestamp
-    current_time = datetime.now().strftime("%d-%b-%Y %I:%M %p")
-
-    # Clear cart after data is passed
-    session.pop("cart", None)
+def render_bill(sale):
+    # Generate the bill's timestamp
+    current_time = datetime.fromtimestamp(sale["created"]).strftime("%d-%b-%Y %I:%M %p")
 
     return render_template(
         "bill.html",
-        cart=lines,
-        total=total,
-        date=current_time
+        cart=sale["lines"],
+        total=sale["total"],
+        date=current_time,
+        invoice=sale["invoice"]
     )
 
+# Re-print a past bill from the sales ledger
+@app.route("/bill/<int:invoice>")
+def bill(invoice):
+    sale = SALES.get(invoice)
+    if sale is None:
+        abort(404)
+    return render_bill(sale)
+
+# Item picker suggestions for the update/delete/purchase forms
+@app.route("/autocomplete")
+def autocomplete():
+    q = request.args.get("q","")
+    limit = max(1, min(request.args.get("limit", AUTOCOMPLETE_LIMIT, type=int), 50))
+    items = autocomplete_items(q, limit)
+    return jsonify([{"id": iid, "name": d["name"], "quantity": d["quantity"],
+                     "price": d["price"], "version": d.get("version", 0)}
+                    for iid, d in items.items()])
+
+# Live updates for the dashboards (Server-Sent Events)
+@app.route("/events")
+def events():
+    """Streams "item" events (added/updated/deleted) and "low_stock" events
+    (an item crossed its reorder threshold) as they happen."""
+    last = request.headers.get("Last-Event-ID", request.args.get("last_id", "")).strip()
+    after = int(last) if last.isascii() and last.isdigit() else EVENTS.last_id()
+
+    def stream(after):
+        yield "retry: 3000\n\n"
+        idle = 0.0
+        while True:
+            # cheap when nothing changed; picks up other workers' writes
+            sync_thresholds()
+            batch, after, missed = EVENTS.wait(after, SSE_POLL_SECONDS)
+            if missed:
+                yield "event: resync\ndata: {}\n\n"
+            for seq, kind, data in batch:
+                yield f"id: {seq}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+            idle = 0.0 if batch else idle + SSE_POLL_SECONDS
+            if idle >= SSE_KEEPALIVE_SECONDS:
+                idle = 0.0
+                yield ": keepalive\n\n"
+
+    return Response(stream(after), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Sales totals from the rollups: ?days= (default 30, max 366), ?period=day|hour
+@app.route("/reports/sales")
+def sales_report():
+    days = max(1, min(request.args.get("days", 30, type=int), 366))
+    period = "hour" if request.args.get("period") == "hour" else "day"
+    report = ROLLUPS.report(days, period)
+    names = STORE.get_many(r["item_id"] for r in report["items"])
+    for r in report["items"]:
+        r["name"] = names[r["item_id"]]["name"] if r["item_id"] in names else None
+    return jsonify(dict(report, days=days, period=period))
+
+# Cache hit/miss counters, to confirm read routes are served from memory
+@app.route("/cache_stats")
+def cache_stats_view():
+    return jsonify(cache_stats())
+
+# ----------------- JSON API (/api/v1) -----------------
+# The item, search, low-stock, cart and checkout operations for POS
+# terminals and scripts: JSON in and out, no templates or redirects.
+# Items are {"id", "name", "quantity", "price", "version", plus "ref",
+# "category" and "threshold" when set}; errors are {"error": message} with
+# a 4xx status. Field names and validation are the Add/Update forms'.
+# Batch endpoints take up to API_BATCH_LIMIT entries, write once, and
+# report per entry ("line" is the entry's 1-based position).
+
+def api_error(message, status=400, **extra):
+    return jsonify(dict(extra, error=message)), status
+
+def api_item(iid, rec):
+    return dict(rec, id=iid)
+
+def api_page(items, prev_key, next_key):
+    return {"items": [api_item(iid, d) for iid, d in items.items()],
+            "prev": encode_cursor(prev_key) if prev_key is not None else None,
+            "next": encode_cursor(next_key) if next_key is not None else None}
+
+def api_batch(key):
+    """The request's JSON `key` list, or None if it's missing or too long."""
+    body = request.get_json(silent=True)
+    entries = body.get(key) if isinstance(body, dict) else None
+    return entries if isinstance(entries, list) and len(entries) <= API_BATCH_LIMIT else None
+
+def api_batch_error(key):
+    return api_error(f'Expected {{"{key}": [...]}} with at most {API_BATCH_LIMIT} entries.')
+
+def api_version(value):
+    # a client-supplied expected version: None, or an int (ValueError otherwise)
+    if value is None or (isinstance(value, int) and not isinstance(value, bool)):
+        return value
+    raise ValueError(value)
+
+def api_conflict(e):
+    return api_error("Item was changed by someone else.", 409, item=api_item(e.iid, e.current))
+
+# Items: one page in id order (?after=/?before= cursors, ?per_page=), or
+# the items in ?ids=A101,B101 (missing ids are listed)
+@app.route("/api/v1/items")
+def api_items():
+    if "ids" in request.args:
+        iids = [i.strip().upper() for i in request.args["ids"].split(",") if i.strip()][:API_BATCH_LIMIT]
+        items = STORE.get_many(iids)
+        return jsonify({"items": [api_item(iid, d) for iid, d in items.items()],
+                        "missing": [iid for iid in iids if iid not in items]})
+    after, before, per_page = page_request(str)
+    STORE.sync_indexes()
+    keys, prev_key, next_key = BY_ID.page(after, before, per_page)
+    return jsonify(api_page(STORE.get_many(k[-1] for k in keys), prev_key, next_key))
+
+@app.route("/api/v1/items/<iid>")
+def api_get_item(iid):
+    iid = iid.upper()
+    rec = STORE.get(iid)
+    if rec is None:
+        return api_error("Item ID not found.", 404)
+    return jsonify(api_item(iid, rec))
+
+@app.route("/api/v1/items", methods=["POST"])
+def api_add_item():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return api_error("Expected a JSON object.")
+    try:
+        iid, rec = new_item(body.get("id"), body)
+    except ValueError as e:
+        return api_error(str(e))
+    if not STORE.insert(iid, rec):
+        return api_error("Item ID already exists.", 409)
+    return jsonify(api_item(iid, STORE.get(iid))), 201
+
+@app.route("/api/v1/items/batch", methods=["POST"])
+def api_add_items():
+    entries = api_batch("items")
+    if entries is None:
+        return api_batch_error("items")
+    items, seen, errors = {}, set(), {}
+    for n, body in enumerate(entries, 1):
+        try:
+            if not isinstance(body, dict):
+                raise ValueError("Expected a JSON object.")
+            iid, rec = new_item(body.get("id"), body)
+            if iid in seen:
+                raise ValueError("Item ID repeated in this batch.")
+        except ValueError as e:
+            errors[n] = str(e)
+            continue
+        items[n] = (iid, rec)
+        seen.add(iid)
+    taken = set(STORE.insert_many(dict(items.values())))
+    for n, (iid, _) in items.items():
+        if iid in taken:
+            errors[n] = "Item ID already exists."
+    created = STORE.get_many(iid for iid, _ in items.values() if iid not in taken)
+    out = [{"line": n, "error": errors[n]} if n in errors else {"line": n, **api_item(items[n][0], created[items[n][0]])}
+           for n in range(1, len(entries) + 1)]
+    return jsonify({"created": len(created), "failed": len(errors), "items": out})
+
+# Update one item: any of the Update form's fields ("name", "quantity" +
+# "qty_mode", "price" + "price_mode", "category", "threshold",
+# "threshold_default"); "version" makes it a compare-and-swap
+@app.route("/api/v1/items/<iid>", methods=["PATCH"])
+def api_update_item(iid):
+    iid = iid.upper()
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return api_error("Expected a JSON object.")
+    apply, errors = item_update(body)
+    try:
+        version = api_version(body.get("version"))
+    except ValueError:
+        errors["version"] = "Invalid version"
+    if errors:
+        return api_error("Invalid fields.", fields=errors)
+    try:
+        before, after = STORE.update(iid, apply, expect_version=version)
+    except VersionConflict as e:
+        return api_conflict(e)
+    if before is None:
+        return api_error("Item ID not found.", 404)
+    return jsonify(api_item(iid, after))
+
+@app.route("/api/v1/items/batch", methods=["PATCH"])
+def api_update_items():
+    entries = api_batch("items")
+    if entries is None:
+        return api_batch_error("items")
+    changes, versions, lines, errors = {}, {}, {}, {}
+    for n, body in enumerate(entries, 1):
+        if not isinstance(body, dict):
+            errors[n] = "Expected a JSON object."
+            continue
+        iid = str(body.get("id") or "").strip().upper()
+        apply, problems = item_update(body)
+        try:
+            version = api_version(body.get("version"))
+        except ValueError:
+            problems["version"] = "Invalid version"
+        if not iid or iid in changes or problems:
+            errors[n] = ("Item ID is required." if not iid else "Item ID repeated in this batch." if iid in changes
+                         else "Invalid fields: " + ", ".join(problems) + ".")
+            continue
+        # only an accepted entry's version counts; a rejected repeat mustn't replace the first's
+        changes[iid], versions[iid], lines[n] = apply, version, iid
+    return jsonify(api_batch_results(STORE.update_many(changes, versions), lines, errors, len(entries), "updated"))
+
+def api_batch_results(results, lines, errors, count, done):
+    """Per-entry JSON for a batch update/delete from STORE.update_many's
+    `results`; `lines` maps entries to item ids, `errors` the rejected ones."""
+    out = []
+    for n in range(1, count + 1):
+        result = results.get(lines.get(n))
+        if n in errors:
+            out.append({"line": n, "error": errors[n]})
+        elif isinstance(result, VersionConflict):
+            out.append({"line": n, "error": "Item was changed by someone else.",
+                        "item": api_item(result.iid, result.current)})
+        elif result[0] is None:
+            out.append({"line": n, "id": lines[n], "error": "Item ID not found."})
+        else:
+            out.append({"line": n, **api_item(lines[n], result[1] or result[0])})
+    failed = sum(1 for line in out if "error" in line)
+    return {done: len(out) - failed, "failed": failed, "items": out}
+
+# Delete one item; ?version= makes it a compare-and-swap
+@app.route("/api/v1/items/<iid>", methods=["DELETE"])
+def api_delete_item(iid):
+    iid = iid.upper()
+    raw = request.args.get("version")
+    try:
+        # a malformed version must not turn into an unconditional delete
+        version = api_version(None if raw is None else int(raw))
+    except ValueError:
+        return api_error("Invalid version.")
+    try:
+        rec = STORE.delete(iid, expect_version=version)
+    except VersionConflict as e:
+        return api_conflict(e)
+    if rec is None:
+        return api_error("Item ID not found.", 404)
+    return jsonify(api_item(iid, rec))
+
+# Delete many: {"items": ["A101", {"id": "B101", "version": 3}, ...]}
+@app.route("/api/v1/items/batch/delete", methods=["POST"])
+def api_delete_items():
+    entries = api_batch("items")
+    if entries is None:
+        return api_batch_error("items")
+    changes, versions, lines, errors = {}, {}, {}, {}
+    for n, entry in enumerate(entries, 1):
+        body = entry if isinstance(entry, dict) else {"id": entry}
+        iid = str(body.get("id") or "").strip().upper()
+        try:
+            version = api_version(body.get("version"))
+        except ValueError:
+            errors[n] = "Invalid version."
+            continue
+        if not iid or iid in changes:
+            errors[n] = "Item ID is required." if not iid else "Item ID repeated in this batch."
+            continue
+        changes[iid], versions[iid], lines[n] = (lambda details: None), version, iid
+    return jsonify(api_batch_results(STORE.update_many(changes, versions), lines, errors, len(entries), "deleted"))
+
+# Bulk import (upsert): CSV with a header row (id, name, quantity, price,
+# optionally category and threshold) or NDJSON objects with those keys,
+# as the request body or a multipart "file". ?format=csv|ndjson, else
+# it's told from the content type or file name.
+@app.route("/api/v1/items/import", methods=["POST"])
+def api_import_items():
+    upload = request.files.get("file")
+    if upload is not None:
+        stream, fmt = upload.stream, import_format(upload.filename, upload.mimetype)
+    else:
+        stream, fmt = request.stream, import_format(None, request.mimetype)
+    fmt = request.args.get("format", fmt)
+    if fmt not in ("csv", "ndjson"):
+        return api_error("Unknown format; pass ?format=csv or ?format=ndjson.")
+    return jsonify(import_items(import_rows(stream, fmt)))
+
+# Search: id or part of a name, falling back to close matches as /search
+# does ("fuzzy" says which); ?fuzzy=1 asks for close matches directly
+@app.route("/api/v1/search")
+def api_search():
+    term = request.args.get("q", "").strip().lower()
+    if not term:
+        return api_error("q is required.")
+    fuzzy = request.args.get("fuzzy", "") not in ("", "0", "false")
+    results = fuzzy_search_inventory(term) if fuzzy else search_inventory(term, exact_id=True)
+    if not results and not fuzzy:
+        results, fuzzy = fuzzy_search_inventory(term), True
+    return jsonify({"items": [api_item(iid, d) for iid, d in results.items()], "fuzzy": fuzzy})
+
+# Low stock, lowest first, each with the "reorder_at" level it's under
+@app.route("/api/v1/low_stock")
+def api_low_stock():
+    after, before, per_page = page_request((int, float), str)
+    thresholds = sync_thresholds()
+    keys, prev_key, next_key = thresholds.page(after, before, per_page)
+    page = STORE.get_many(iid for _, iid in keys)
+    for iid, d in page.items():
+        page[iid] = dict(d, reorder_at=thresholds.threshold(iid))
+    return jsonify(api_page(page, prev_key, next_key))
+
+# Carts are addressed by id rather than the session cookie. Creating one
+# can add its first lines too ({"lines": [...]} as for adding lines).
+@app.route("/api/v1/carts", methods=["POST"])
+def api_new_cart():
+    cart_id = CARTS.new_id()
+    body = request.get_json(silent=True)
+    if isinstance(body, dict) and "lines" in body:
+        return api_add_cart_lines(cart_id, status=201)
+    return jsonify({"cart": cart_id, "lines": [], "total": 0}), 201
+
+@app.route("/api/v1/carts/<cart_id>")
+def api_cart(cart_id):
+    lines = CARTS.get(cart_id)
+    return jsonify({"cart": cart_id, "total": sum(d["quantity"] * d["price"] for d in lines.values()),
+                    "lines": [{"id": iid, "name": d["name"], "price": d["price"], "qty": d["quantity"],
+                               "expires": d["expires"]} for iid, d in lines.items()]})
+
+# Add lines: {"lines": [{"ref": ..., "qty": ...}, ...]}, refs being ref
+# numbers or item ids (or [ref, qty] pairs), as /add_to_cart/bulk takes
+@app.route("/api/v1/carts/<cart_id>/lines", methods=["POST"])
+def api_add_cart_lines(cart_id, status=200):
+    raw = api_batch("lines")
+    if raw is None:
+        return api_batch_error("lines")
+    requested = json_cart_lines(raw)
+    try:
+        added, errors = add_cart_lines(cart_id, requested)
+    except CheckoutInProgress:
+        return api_error("Cart is being checked out.", 409)
+    return jsonify({"cart": cart_id, "added": len(added), "failed": len(errors),
+                    "lines": cart_lines_json(requested, added, errors)}), status
+
+@app.route("/api/v1/carts/<cart_id>", methods=["DELETE"])
+def api_clear_cart(cart_id):
+    try:
+        CARTS.clear(cart_id)
+    except CheckoutInProgress:
+        return api_error("Cart is being checked out; check it out again to finish.", 409)
+    return "", 204
+
+# Checkout: 201 with the sale (its "invoice" number, "lines", "total").
+# If stock ran short the cart is kept as it was, with the short item ids.
+@app.route("/api/v1/carts/<cart_id>/checkout", methods=["POST"])
+def api_checkout(cart_id):
+    try:
+        sale, short = checkout_cart(cart_id)
+    except CheckoutInProgress:
+        return api_error("Cart is already being checked out.", 409)
+    if short:
+        return api_error("Not enough stock.", 409, short=short)
+    if sale is None:
+        return api_error("Cart is empty.")
+    return jsonify(sale), 201
+
+@app.route("/api/v1/sales/<int:invoice>")
+def api_sale(invoice):
+    sale = SALES.get(invoice)
+    if sale is None:
+        return api_error("Invoice not found.", 404)
+    return jsonify(sale)
+
+# ----------------- cli -----------------
+@app.cli.command("import-json")
+@click.argument("path", default=DATA_FILE)
+def import_json_command(path):
+    """Import an existing inventory.json into the SQLite database."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    items = {}
+    for iid, d in data.items():
+        d = _normalize_record(d)
+        items[iid] = {"name": d.get("name", ""), "quantity": int(d.get("quantity", 0)),
+                      "price": float(d.get("price", 0.0))}
+        items[iid].update((k, d[k]) for k in OPTIONAL_FIELDS if d.get(k) is not None)
+    store = STORE if isinstance(STORE, SqliteStore) else SqliteStore(DB_FILE)
+    store.put_many(items)
+    click.echo(f"Imported {len(items)} items from {path} into {store.path}.")
+
+@app.cli.command("import-items")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), help="Default: from the file extension.")
+@click.option("--batch-size", default=IMPORT_BATCH_SIZE, show_default=True, help="Rows upserted per write.")
+def import_items_command(path, fmt, batch_size):
+    """Upsert items from a CSV or NDJSON file, as /api/v1/items/import does."""
+    fmt = fmt or import_format(path)
+    if fmt is None:
+        raise click.UsageError("Can't tell the format from the file name; pass --format.")
+    with open(path, "rb") as f:
+        report = import_items(import_rows(f, fmt), max(1, batch_size))
+    for e in report["errors"]:
+        click.echo(f"line {e['line']}: {e['error']}", err=True)
+    if report["failed"] > len(report["errors"]):
+        click.echo(f"... and {report['failed'] - len(report['errors'])} more errors", err=True)
+    click.echo(f"Imported {report['imported']} items from {report['rows']} rows, {report['failed']} rejected.")
+
+@app.cli.command("finish-checkouts")
+def finish_checkouts_command():
+    """Finish checkouts that failed partway and were never retried."""
+    for cart_id in CARTS.stalled():
+        try:
+            sale, short = checkout_cart(cart_id)
+        except CheckoutInProgress:
+            continue  # being retried right now
+        if short:
+            click.echo(f"Cart {cart_id}: not enough stock for {', '.join(short)}; nothing was sold.")
+        elif sale is not None:
+            click.echo(f"Cart {cart_id}: sold as invoice {sale['invoice']}.")
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recompute the hourly/daily sales rollups from the sales ledger."""
+    click.echo(f"Folded {ROLLUPS.rebuild()} sales into {ROLLUPS.path}.")
+
 # ----------------- run -----------------
 if __name__ == "__main__":
     # create inventory file if not present
-    if not os.path.exists(DATA_FILE):
+    if STORAGE_BACKEND != "sqlite" and not os.path.exists(DATA_FILE):
         save_inventory({})
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,39 @@
+// Item pickers: an <input data-autocomplete="/autocomplete" list="..."> asks
+// the server for matching items as the operator types and fills its
+// <datalist>, so forms no longer render the whole inventory. If the input
+// names a `data-version-field`, that hidden field follows the picked item's
+// version for the compare-and-swap check on submit.
+document.querySelectorAll("input[data-autocomplete]").forEach(function (input) {
+  var list = document.getElementById(input.getAttribute("list"));
+  var versionField = input.dataset.versionField ? input.form.elements[input.dataset.versionField] : null;
+  var known = {};  // item id -> last suggestion seen for it
+  var timer = null;
+
+  function syncVersion() {
+    if (!versionField) return;
+    var hit = known[input.value.trim().toUpperCase()];
+    versionField.value = hit ? hit.version : "";
+  }
+
+  input.addEventListener("input", function () {
+    syncVersion();
+    clearTimeout(timer);
+    var q = input.value.trim();
+    if (!q) return;
+    timer = setTimeout(function () {
+      fetch(input.dataset.autocomplete + "?q=" + encodeURIComponent(q))
+        .then(function (r) { return r.json(); })
+        .then(function (items) {
+          list.innerHTML = "";
+          items.forEach(function (it) {
+            known[it.id] = it;
+            var opt = document.createElement("option");
+            opt.value = it.id;
+            opt.label = it.name + " (" + it.quantity + " @ " + it.price.toFixed(2) + ")";
+            list.appendChild(opt);
+          });
+          syncVersion();
+        });
+    }, 80);
+  });
+});
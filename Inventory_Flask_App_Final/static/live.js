@@ -0,0 +1,74 @@
+// Live dashboards: a table with data-live="/events" follows the server's
+// Server-Sent Events and patches its rows in place instead of reloading.
+// Rows carry data-item-id; cells to keep current carry data-field.
+// A table with data-low-only (the low-stock page) also gains and loses
+// rows as items cross their reorder threshold.
+(function () {
+  var table = document.querySelector("table[data-live]");
+  if (!table || !window.EventSource) return;
+  var body = table.tBodies[0];
+  var notice = document.getElementById("live-notice");
+  var source = new EventSource(table.dataset.live);
+
+  function row(id) {
+    return body.querySelector('tr[data-item-id="' + CSS.escape(id) + '"]');
+  }
+
+  function showNotice() {
+    if (notice) notice.classList.remove("d-none");
+  }
+
+  function highlight(tr) {
+    tr.classList.add("live-changed");
+    setTimeout(function () { tr.classList.remove("live-changed"); }, 1500);
+  }
+
+  function fill(tr, item) {
+    tr.querySelectorAll("[data-field]").forEach(function (td) {
+      var v = item[td.dataset.field];
+      if (v === undefined) return;
+      td.textContent = v === null ? "" : td.dataset.field === "price" ? Number(v).toFixed(2) : v;
+    });
+  }
+
+  source.addEventListener("item", function (e) {
+    var ev = JSON.parse(e.data), tr = row(ev.id);
+    if (!tr) {
+      if (ev.op === "added" && !table.dataset.lowOnly) showNotice();
+      return;
+    }
+    if (ev.op === "deleted") { tr.remove(); return; }
+    fill(tr, ev.item);
+    highlight(tr);
+  });
+
+  source.addEventListener("low_stock", function (e) {
+    var ev = JSON.parse(e.data), tr = row(ev.id);
+    if (table.dataset.lowOnly) {
+      if (!ev.low) {
+        if (tr) tr.remove();
+      } else if (!tr) {
+        tr = document.createElement("tr");
+        tr.dataset.itemId = ev.id;
+        ["id", "name", "category", "quantity", "threshold"].forEach(function (f) {
+          var td = document.createElement("td");
+          td.dataset.field = f;
+          if (f === "quantity") td.className = "text-warning";
+          tr.appendChild(td);
+        });
+        fill(tr, ev);
+        body.insertBefore(tr, body.firstChild);
+        highlight(tr);
+      }
+      return;
+    }
+    if (tr) {
+      var qty = tr.querySelector('[data-field="quantity"]');
+      qty.classList.toggle("text-warning", ev.low);
+      qty.classList.toggle("fw-bold", ev.low);
+    }
+  });
+
+  // events were missed (the server's backlog rolled over): the page is stale
+  source.addEventListener("resync", showNotice);
+})();
@@ -0,0 +1,42 @@
+import importlib.util
+import itertools
+import os
+
+import pytest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "flask_app.py")
+BACKENDS = ("json", "journal", "sqlite")
+_loaded = itertools.count()
+
+
+def load_app(data_dir, backend):
+    """A fresh copy of flask_app with its data files in `data_dir`; each
+    call is a separate module, as if it were another worker."""
+    os.environ["INVENTORY_DATA_DIR"] = str(data_dir)
+    os.environ["INVENTORY_BACKEND"] = backend
+    spec = importlib.util.spec_from_file_location(f"inventory_app_{os.getpid()}_{next(_loaded)}", APP)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def stock(n=10, quantity=20):
+    """{item_id: record} for `n` items with `quantity` units each."""
+    return {f"I{i:03d}": {"name": f"Item {i}", "quantity": quantity, "price": float(i + 1)} for i in range(n)}
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def app(tmp_path, backend, monkeypatch):
+    """flask_app on `backend`, in an empty temporary data directory, stocked
+    with stock()."""
+    monkeypatch.setenv("INVENTORY_DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("INVENTORY_BACKEND", backend)
+    module = load_app(tmp_path, backend)
+    module.STORE.put_many(stock())
+    module.app.testing = True
+    return module
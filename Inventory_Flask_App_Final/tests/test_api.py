@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+def test_repeated_id_keeps_first_entrys_version(app, client):
+    app.STORE.update("I001", lambda d: dict(d, price=5.0))  # now version 2
+    r = client.patch("/api/v1/items/batch", json={"items": [
+        {"id": "I001", "version": 2, "price": 7}, {"id": "I001", "version": 1, "price": 8}]}).get_json()
+    assert r["updated"] == 1 and r["items"][1]["error"] == "Item ID repeated in this batch."
+    assert app.STORE.get("I001")["price"] == 7.0
+
+
+def test_repeated_delete_keeps_first_entrys_version(app, client):
+    r = client.post("/api/v1/items/batch/delete", json={"items": [
+        {"id": "I001", "version": 1}, {"id": "I001", "version": 9}]}).get_json()
+    assert r["deleted"] == 1 and app.STORE.get("I001") is None
+    # and a stale first entry stays a conflict, whatever a repeat says
+    r = client.post("/api/v1/items/batch/delete", json={"items": [
+        {"id": "I002", "version": 9}, {"id": "I002", "version": 1}]}).get_json()
+    assert r["deleted"] == 0 and app.STORE.get("I002") is not None
+
+
+@pytest.mark.parametrize("version", ["abc", "1.5", ""])
+def test_delete_with_malformed_version_is_refused(app, client, version):
+    r = client.delete(f"/api/v1/items/I001?version={version}")
+    assert r.status_code == 400 and r.get_json()["error"] == "Invalid version."
+    assert app.STORE.get("I001") is not None
+
+
+def test_delete_with_version(app, client):
+    assert client.delete("/api/v1/items/I001?version=2").status_code == 409
+    assert client.delete("/api/v1/items/I001?version=1").get_json()["id"] == "I001"
+    assert client.delete("/api/v1/items/I002").status_code == 200
+
+
+@pytest.mark.parametrize("price", ["nan", "inf", "-inf", "NaN", "1e999"])
+def test_non_finite_prices_are_refused(app, client, price):
+    r = client.post("/api/v1/items", json={"id": "N1", "name": "n", "quantity": 1, "price": price})
+    assert r.status_code == 400 and app.STORE.get("N1") is None
+    r = client.patch("/api/v1/items/I001", json={"price": price})
+    assert r.status_code == 400 and "price" in r.get_json()["fields"]
+    r = client.post("/api/v1/items/import?format=ndjson",
+                    data=json.dumps({"id": "N2", "name": "n", "quantity": 1, "price": price}) + "\n")
+    assert r.get_json()["imported"] == 0 and app.STORE.get("N2") is None
+    assert app.STORE.get("I001")["price"] == 2.0
@@ -0,0 +1,54 @@
+import pytest
+
+
+def test_hold_limited_to_stock_and_other_holds(app):
+    a, b = app.CARTS.new_id(), app.CARTS.new_id()
+    assert app.CARTS.add(a, "I000", 15, "Item 0", 1.0, app.stock_of) == 15
+    with pytest.raises(app.StockUnavailable) as e:
+        app.CARTS.add(b, "I000", 6, "Item 0", 1.0, app.stock_of)
+    assert e.value.available == 5
+
+
+def test_hold_checked_against_stock_read_in_its_transaction(app):
+    # a checkout deducts its stock, then releases its holds; reading the
+    # stock inside the cart transaction means a new hold never sees the
+    # released holds alongside the stock from before the deduction
+    seen = []
+
+    def stock_of(iids):
+        seen.append(app.CARTS._conn().in_transaction)
+        return app.stock_of(iids)
+
+    app.CARTS.add(app.CARTS.new_id(), "I000", 1, "Item 0", 1.0, stock_of)
+    assert seen == [True]
+
+
+def test_hold_after_checkout_sees_deducted_stock(app):
+    a, b = app.CARTS.new_id(), app.CARTS.new_id()
+    app.CARTS.add(a, "I000", 20, "Item 0", 1.0, app.stock_of)
+    sale, short = app.checkout_cart(a)
+    assert sale is not None and short == []
+    with pytest.raises(app.StockUnavailable) as e:
+        app.CARTS.add(b, "I000", 1, "Item 0", 1.0, app.stock_of)
+    assert e.value.available == 0
+
+
+@pytest.mark.parametrize("ref", ["²", "١", "1²"])  # digits to str.isdigit(), not to int()
+def test_bulk_add_with_non_ascii_digits_is_a_line_error(app, ref):
+    client = app.app.test_client()
+    r = client.post("/add_to_cart/bulk", data={"lines": f"{ref} 1\n1 2"}, follow_redirects=True)
+    assert r.status_code == 200
+    r = client.post("/add_to_cart/bulk", json={"lines": [[ref, 1], [1, 2]]}).get_json()
+    assert r["added"] == 1 and r["failed"] == 1
+    assert app.resolve_ref(ref) == ref.upper()
+
+
+def test_adding_to_a_cart_leaves_lines_already_read_alone(app):
+    cart_id = app.CARTS.new_id()
+    app.CARTS.add(cart_id, "I000", 1, "Item 0", 1.0, app.stock_of)
+    lines = app.CARTS.get(cart_id)
+    snapshot = {iid: dict(line) for iid, line in lines.items()}
+    app.CARTS.add(cart_id, "I001", 2, "Item 1", 2.0, app.stock_of)
+    app.CARTS.add(cart_id, "I000", 1, "Item 0", 1.0, app.stock_of)
+    assert lines == snapshot
+    assert {iid: line["quantity"] for iid, line in app.CARTS.get(cart_id).items()} == {"I000": 2, "I001": 2}
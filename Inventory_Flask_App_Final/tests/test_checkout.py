@@ -0,0 +1,159 @@
+import os
+import threading
+
+import pytest
+
+from conftest import load_app
+
+
+def fill_cart(app, lines):
+    cart_id = app.CARTS.new_id()
+    for iid, qty in lines.items():
+        app.CARTS.add(cart_id, iid, qty, iid, 1.0, app.stock_of)
+    return cart_id
+
+
+def quantity(app, iid):
+    return app.STORE.get(iid)["quantity"]
+
+
+def fail_once(monkeypatch, obj, name, error):
+    real = getattr(obj, name)
+    calls = []
+
+    def flaky(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise error
+        return real(*args, **kwargs)
+    monkeypatch.setattr(obj, name, flaky)
+    return calls
+
+
+def test_checkout_deducts_and_records_sale(app):
+    cart_id = fill_cart(app, {"I000": 4, "I001": 2})
+    sale, short = app.checkout_cart(cart_id)
+    assert short == [] and sale["invoice"] == 1 and sale["total"] == 6.0
+    assert quantity(app, "I000") == 16 and quantity(app, "I001") == 18
+    assert app.SALES.get(1) == sale
+    assert app.CARTS.get(cart_id) == {} and app.CARTS.held(["I000", "I001"]) == {}
+
+
+def test_short_checkout_changes_nothing(app):
+    cart_id = fill_cart(app, {"I000": 4})
+    app.STORE.update("I000", lambda d: dict(d, quantity=2))
+    assert app.checkout_cart(cart_id) == (None, ["I000"])
+    assert quantity(app, "I000") == 2 and app.SALES.next_invoice() == 1
+    app.CARTS.clear(cart_id)  # an aborted checkout leaves the cart usable
+
+
+def test_ledger_failure_is_retried_without_deducting_twice(app, monkeypatch):
+    cart_id = fill_cart(app, {"I000": 4})
+    fail_once(monkeypatch, app.SALES, "append", OSError("disk full"))
+    with pytest.raises(OSError):
+        app.checkout_cart(cart_id)
+    assert quantity(app, "I000") == 16
+    # the failed attempt holds on to its sale: the cart can't be changed or dropped
+    with pytest.raises(app.CheckoutInProgress):
+        app.CARTS.add(cart_id, "I001", 1, "I001", 1.0, app.stock_of)
+    with pytest.raises(app.CheckoutInProgress):
+        app.CARTS.clear(cart_id)
+    sale, short = app.checkout_cart(cart_id)
+    assert short == [] and sale["invoice"] == 1
+    assert quantity(app, "I000") == 16
+    assert [s["invoice"] for s in app.SALES.replay()] == [1]
+
+
+@pytest.mark.parametrize("backend", ["json", "journal"])
+def test_inventory_write_failure_is_retried_deducting_once(app, backend, tmp_path, monkeypatch):
+    cart_id = fill_cart(app, {"I000": 2})
+    real, calls = os.fsync, []
+
+    def fsync(fd):
+        calls.append(fd)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return real(fd)
+    monkeypatch.setattr(app.os, "fsync", fsync)
+    with pytest.raises(OSError):
+        app.checkout_cart(cart_id)
+    assert quantity(app, "I000") == 20
+    sale, short = app.checkout_cart(cart_id)
+    assert short == [] and sale["invoice"] == 1
+    assert quantity(app, "I000") == 18
+    assert load_app(tmp_path, backend).STORE.get("I000")["quantity"] == 18
+
+
+def test_rollup_failure_is_retried_without_a_second_sale(app, monkeypatch):
+    cart_id = fill_cart(app, {"I000": 4})
+    fail_once(monkeypatch, app.ROLLUPS, "record", OSError("disk full"))
+    with pytest.raises(OSError):
+        app.checkout_cart(cart_id)
+    sale, _ = app.checkout_cart(cart_id)
+    assert sale["invoice"] == 1 and [s["invoice"] for s in app.SALES.replay()] == [1]
+    assert quantity(app, "I000") == 16
+    assert app.ROLLUPS.report()["total"] == {"quantity": 4, "revenue": 4.0, "sales": 1}
+
+
+def test_stalled_checkout_finished_later(app, monkeypatch):
+    cart_id = fill_cart(app, {"I000": 4})
+    fail_once(monkeypatch, app.SALES, "append", OSError("disk full"))
+    with pytest.raises(OSError):
+        app.checkout_cart(cart_id)
+    assert app.CARTS.stalled() == [cart_id]
+    app.CARTS.sweep(float("inf"))  # far past every expiry: the sale must survive
+    assert app.checkout_cart(cart_id)[0]["invoice"] == 1
+    assert app.CARTS.stalled() == [] and quantity(app, "I000") == 16
+
+
+@pytest.mark.parametrize("backend", ["sqlite"])
+def test_crash_before_deduction_is_recorded_deducts_once(app, monkeypatch):
+    # the deduction committed but the worker died before noting it; on
+    # SQLite the sale id stored with the deduction stops a second one
+    cart_id = fill_cart(app, {"I000": 4})
+    fail_once(monkeypatch, app.CARTS, "update_checkout", OSError("worker died"))
+    with pytest.raises(OSError):
+        app.checkout_cart(cart_id)
+    sale, short = app.checkout_cart(cart_id)
+    assert short == [] and sale["invoice"] == 1
+    assert quantity(app, "I000") == 16
+
+
+def test_double_submit_sells_once(app):
+    cart_id = fill_cart(app, {"I000": 4})
+    start, results = threading.Barrier(4), []
+
+    def submit():
+        start.wait()
+        try:
+            results.append(app.checkout_cart(cart_id))
+        except app.CheckoutInProgress:
+            results.append("busy")
+    threads = [threading.Thread(target=submit) for _ in range(4)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert sum(1 for r in results if r != "busy" and r[0] is not None) == 1
+    assert quantity(app, "I000") == 16 and app.SALES.next_invoice() == 2
+
+
+def test_competing_carts_never_oversell(app):
+    # 8 carts race for 20 units, 5 at a time: exactly 4 holds fit, and
+    # every held cart then checks out while the others are refused
+    start, held, sold = threading.Barrier(8), threading.Barrier(8), []
+
+    def shopper():
+        cart_id = app.CARTS.new_id()
+        start.wait()
+        try:
+            app.CARTS.add(cart_id, "I000", 5, "I000", 1.0, app.stock_of)
+        except app.StockUnavailable:
+            held.wait()
+            return
+        held.wait()
+        sale, short = app.checkout_cart(cart_id)
+        assert short == []
+        sold.append(sale["invoice"])
+    threads = [threading.Thread(target=shopper) for _ in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert sorted(sold) == [1, 2, 3, 4] and quantity(app, "I000") == 0
@@ -0,0 +1,55 @@
+"""Concurrent checkouts from several worker processes must neither lose
+nor oversell stock, on every backend."""
+import multiprocessing
+import random
+from collections import Counter
+
+from conftest import load_app, stock
+
+WORKERS = 4
+ROUNDS = 25
+
+
+def checkout_worker(data_dir, backend, seed):
+    # one worker process: fill carts at random and check them out
+    app = load_app(data_dir, backend)
+    rng = random.Random(seed)
+    iids = sorted(stock())
+    sold, invoices = Counter(), []
+    for _ in range(ROUNDS):
+        cart_id = app.CARTS.new_id()
+        picked = rng.sample(iids, rng.randint(1, 3))
+        app.add_cart_lines(cart_id, [(n, iid, rng.randint(1, 4)) for n, iid in enumerate(picked, 1)])
+        sale, short = app.checkout_cart(cart_id)
+        if sale is not None:
+            invoices.append(sale["invoice"])
+            for line in sale["lines"]:
+                sold[line["id"]] += line["qty"]
+        app.CARTS.clear(cart_id)
+    return sold, invoices
+
+
+def test_concurrent_checkouts_never_oversell(app, backend, tmp_path):
+    initial = {iid: d["quantity"] for iid, d in stock().items()}
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(WORKERS) as pool:
+        results = pool.starmap(checkout_worker, [(str(tmp_path), backend, seed) for seed in range(WORKERS)])
+
+    sold = sum((s for s, _ in results), Counter())
+    invoices = sorted(i for _, inv in results for i in inv)
+    after = load_app(tmp_path, backend)
+    final = {iid: d["quantity"] for iid, d in after.STORE.get_many(initial).items()}
+    assert all(q >= 0 for q in final.values())
+    # every unit that left the stock was sold exactly once, and vice versa
+    assert {iid: initial[iid] - final[iid] for iid in initial} == {iid: sold[iid] for iid in initial}
+    assert sum(sold.values()) > 0
+    # the ledger holds exactly the acknowledged sales, numbered without gaps
+    ledger = list(after.SALES.replay())
+    assert [s["invoice"] for s in ledger] == invoices == list(range(1, len(invoices) + 1))
+    in_ledger = Counter()
+    for sale in ledger:
+        for line in sale["lines"]:
+            in_ledger[line["id"]] += line["qty"]
+    assert in_ledger == sold
+    # nothing is left on hold
+    assert after.CARTS.held(initial) == {}
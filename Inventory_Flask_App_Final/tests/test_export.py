@@ -0,0 +1,28 @@
+import csv
+import io
+import json
+
+
+def unread():
+    raise AssertionError("rows read before the header went out")
+    yield
+
+
+def test_header_goes_out_before_rows_are_read(app):
+    assert next(app.export_csv(unread())) == ",".join(app.EXPORT_FIELDS) + "\r\n"
+    assert next(app.export_ndjson(unread())) == ""
+
+
+def test_export_streams_every_item(app, monkeypatch):
+    monkeypatch.setattr(app, "EXPORT_CHUNK", 3)
+    client = app.app.test_client()
+    rows = list(csv.DictReader(io.StringIO(client.get("/export?format=csv").get_data(as_text=True))))
+    assert [r["id"] for r in rows] == [f"I{i:03d}" for i in range(10)]
+    assert rows[0]["quantity"] == "20"
+    lines = client.get("/export?format=ndjson&sort=name").get_data(as_text=True).splitlines()
+    assert len(lines) == 10 and json.loads(lines[0])["name"] == "Item 0"
+
+
+def test_export_of_nothing_is_just_the_header(app):
+    client = app.app.test_client()
+    assert client.get("/export?prefix=zzz").get_data(as_text=True) == ",".join(app.EXPORT_FIELDS) + "\r\n"
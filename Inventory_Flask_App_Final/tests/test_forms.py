@@ -0,0 +1,31 @@
+import pytest
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("version", ["-1", "abc", "1.0", "²", "0x1"])
+def test_bad_form_version_changes_nothing(app, client, version):
+    before = app.STORE.get("I001")
+    r = client.post("/update", data={"item_id_select": "I001", "price": "9", "version": version},
+                    follow_redirects=True)
+    assert "version is invalid" in r.get_data(as_text=True)
+    r = client.post("/delete", data={"item_id_select": "I001", "delete_mode": "full", "version": version})
+    r = client.post("/delete", data={"item_id_select": "I001", "delete_mode": "partial", "partial_qty": "1",
+                                     "version": version})
+    assert app.STORE.get("I001") == before
+
+
+def test_form_version_is_checked(app, client):
+    client.post("/update", data={"item_id_select": "I001", "price": "9", "version": "2"})
+    assert app.STORE.get("I001")["price"] == 2.0
+    client.post("/update", data={"item_id_select": "I001", "price": "9", "version": "1"})
+    assert app.STORE.get("I001")["price"] == 9.0
+    client.post("/update", data={"item_id_select": "I001", "price": "8", "version": " "})  # blank: no check
+    assert app.STORE.get("I001")["price"] == 8.0
+    client.post("/delete", data={"item_id_select": "I001", "delete_mode": "full", "version": "1"})
+    assert app.STORE.get("I001") is not None
+    client.post("/delete", data={"item_id_select": "I001", "delete_mode": "full", "version": "3"})
+    assert app.STORE.get("I001") is None
@@ -0,0 +1,102 @@
+import io
+import json
+
+import pytest
+
+
+def csv_rows(app, text):
+    return list(app.import_rows(io.BytesIO(text.encode("utf-8")), "csv"))
+
+
+def ndjson_rows(app, lines):
+    return list(app.import_rows(io.BytesIO("\n".join(lines).encode("utf-8")), "ndjson"))
+
+
+def test_csv_rows_keep_file_line_numbers(app):
+    rows = csv_rows(app, '﻿ID,Name,Quantity,Price\r\nA1,Apple,3,2.5\r\n\r\n,,,\r\n'
+                         'B1,"Bean, dried",1,4\r\nC1,"two\nlines",1,1\r\nD1,Date,2,3\r\n')
+    assert rows == [(2, {"id": "A1", "name": "Apple", "quantity": "3", "price": "2.5"}),
+                    (5, {"id": "B1", "name": "Bean, dried", "quantity": "1", "price": "4"}),
+                    (7, {"id": "C1", "name": "two\nlines", "quantity": "1", "price": "1"}),
+                    (8, {"id": "D1", "name": "Date", "quantity": "2", "price": "3"})]
+
+
+def test_ndjson_rows(app):
+    rows = ndjson_rows(app, ['{"id": "A1", "name": "Apple"}', "", "[1, 2]", "{broken", '{"id": "B1"}'])
+    assert rows == [(1, {"id": "A1", "name": "Apple"}), (3, None), (4, None), (5, {"id": "B1"})]
+
+
+def test_import_reports_bad_rows_by_line(app):
+    report = app.import_items(csv_rows(app, "id,name,quantity,price\nA1,apple,3,2.5\nB1,,1,1\n"
+                                            "C1,cherry,x,1\nD1,date,-1,1\nE1,elder,1,nan\n"))
+    assert report == {"rows": 5, "imported": 1, "failed": 4, "errors": [
+        {"line": 3, "error": "Item ID, Name, Quantity and Price are required."},
+        {"line": 4, "error": "Quantity must be integer and Price must be numeric."},
+        {"line": 5, "error": "Quantity and Price must be non-negative."},
+        {"line": 6, "error": "Quantity must be integer and Price must be numeric."}]}
+    assert app.STORE.get("A1") == dict(app.STORE.get("A1"), name="Apple", quantity=3, price=2.5)
+    report = app.import_items(ndjson_rows(app, ['{"id": "F1", "name": "fig", "quantity": 1, "price": 1}', "[]"]))
+    assert report["errors"] == [{"line": 2, "error": "Not a JSON object."}]
+
+
+def test_one_store_write_per_batch(app, monkeypatch):
+    writes = []
+    real = app.STORE.put_many
+    monkeypatch.setattr(app.STORE, "put_many", lambda items: (writes.append(sorted(items)), real(items))[1])
+    text = "id,name,quantity,price\n" + "".join(f"N{i},n{i},1,1\n" for i in range(7)) + "N0,again,2,2\n"
+    report = app.import_items(csv_rows(app, text), batch_size=3)
+    assert report["imported"] == 8 and len(writes) == 3
+    assert [len(w) for w in writes] == [3, 3, 2]
+    assert app.STORE.get("N0")["name"] == "Again"
+
+
+def test_repeated_id_in_a_batch_keeps_the_last_row(app, monkeypatch):
+    report = app.import_items(csv_rows(app, "id,name,quantity,price\nR1,first,1,1\nR1,second,2,2\n"))
+    assert report["imported"] == 1 and app.STORE.get("R1")["name"] == "Second"
+
+
+def test_blank_optional_columns_keep_current_values(app):
+    app.STORE.put_many({"I001": dict(app.STORE.get("I001"), category="Fruit", threshold=7)})
+    app.import_items(csv_rows(app, "id,name,quantity,price,category,threshold\n"
+                                   "I001,Item 1,5,2,,\nI002,Item 2,5,2,Veg,3\n"))
+    one, two = app.STORE.get("I001"), app.STORE.get("I002")
+    assert (one["quantity"], one["category"], one["threshold"]) == (5, "Fruit", 7)
+    assert (two["category"], two["threshold"]) == ("Veg", 3)
+
+
+def test_csv_with_carriage_return_line_ends(app):
+    rows = csv_rows(app, "id,name,quantity,price\rA1,Apple,3,2.5\rB1,Bean,1,4\r")
+    assert [(n, f["id"]) for n, f in rows] == [(2, "A1"), (3, "B1")]
+
+
+def test_unreadable_upload_stops_at_its_line(app):
+    upload = b"id,name,quantity,price\nA1,a,1,1\n\nB1,\xff\xfe,1,1\nC1,c,1,1\n"
+    report = app.import_items(app.import_rows(io.BytesIO(upload), "csv"))
+    assert report["imported"] == 1 and report["failed"] == 1
+    assert report["errors"][0]["line"] == 4
+    assert report["errors"][0]["error"].startswith("Unreadable upload, import stopped here:")
+    assert app.STORE.get("A1") is not None and app.STORE.get("C1") is None
+
+
+@pytest.mark.parametrize("how", ["body", "file", "query"])
+def test_api_import(app, how):
+    client = app.app.test_client()
+    text = "id,name,quantity,price\nA1,apple,3,2.5\nB1,,1,1\n"
+    if how == "body":
+        r = client.post("/api/v1/items/import", data=text, content_type="text/csv")
+    elif how == "file":
+        r = client.post("/api/v1/items/import", data={"file": (io.BytesIO(text.encode()), "items.csv")})
+    else:
+        r = client.post("/api/v1/items/import?format=csv", data=text, content_type="application/octet-stream")
+    assert r.status_code == 200
+    assert r.get_json() == {"rows": 2, "imported": 1, "failed": 1, "errors": [
+        {"line": 3, "error": "Item ID, Name, Quantity and Price are required."}]}
+
+
+def test_api_import_ndjson_and_unknown_format(app):
+    client = app.app.test_client()
+    body = json.dumps({"id": "A1", "name": "apple", "quantity": 3, "price": 2.5}) + "\n"
+    r = client.post("/api/v1/items/import", data=body, content_type="application/x-ndjson")
+    assert r.get_json()["imported"] == 1 and app.STORE.get("A1")["quantity"] == 3
+    r = client.post("/api/v1/items/import", data=body, content_type="text/plain")
+    assert r.status_code == 400
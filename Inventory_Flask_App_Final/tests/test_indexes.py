@@ -0,0 +1,50 @@
+import json
+import os
+
+import pytest
+
+from conftest import load_app
+
+
+def count_adds(monkeypatch, index):
+    added = []
+    real = index.add
+    monkeypatch.setattr(index, "add", lambda iid, rec: (added.append(iid), real(iid, rec)))
+    return added
+
+
+def test_reload_reindexes_only_changed_items(app, backend, tmp_path, monkeypatch):
+    app.STORE.sync_indexes()
+    other = load_app(tmp_path, backend)  # another worker
+    other.STORE.update("I003", lambda d: dict(d, name="Renamed"))
+    other.STORE.delete("I004")
+    added = count_adds(monkeypatch, app.NGRAMS)
+    app.STORE.sync_indexes()
+    assert added == ["I003"]
+    assert app.NGRAMS.search("renamed") == {"I003"}
+    assert app.NGRAMS.search("item 4") == set() and app.INDEXES.record("I004") is None
+
+
+@pytest.mark.parametrize("backend", ["json"])
+def test_reload_sees_rewrite_without_version_bump(app, monkeypatch):
+    # a file replaced wholesale (restored backup, hand edit) may keep versions
+    app.STORE.sync_indexes()
+    with open(app.STORE.path, encoding="utf-8") as f:
+        data = json.load(f)
+    data["I001"]["name"] = "Restored"
+    with open(app.STORE.path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(app.STORE.path + ".tmp", app.STORE.path)
+    added = count_adds(monkeypatch, app.NGRAMS)
+    app.STORE.sync_indexes()
+    assert added == ["I001"] and app.NGRAMS.search("restored") == {"I001"}
+
+
+@pytest.mark.parametrize("backend", ["sqlite"])
+def test_change_log_is_pruned_by_multi_item_writes(app, monkeypatch):
+    monkeypatch.setattr(app.STORE, "CHANGE_LOG_KEEP", 100)
+    app.STORE.deduct({"I002": 0})  # an odd generation, then two rows per write: never a multiple of 1000
+    for _ in range(1500):
+        app.STORE.deduct({"I000": 0, "I001": 0})
+    rows = app.STORE._conn().execute("SELECT COUNT(*) FROM item_changes").fetchone()[0]
+    assert rows <= 100 + 1000
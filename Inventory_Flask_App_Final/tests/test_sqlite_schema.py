@@ -0,0 +1,56 @@
+"""Workers opening a database together must not trip over each other's
+schema setup."""
+import multiprocessing
+import sqlite3
+
+from conftest import load_app
+
+WORKERS = 8
+
+
+def open_app(data_dir, start):
+    start.wait()
+    app = load_app(data_dir, "sqlite")
+    return sorted(r["name"] for r in app.STORE._conn().execute("PRAGMA table_info(items)"))
+
+
+def open_together(data_dir):
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Manager() as manager:
+        start = manager.Barrier(WORKERS)
+        with ctx.Pool(WORKERS) as pool:
+            return pool.starmap(open_app, [(str(data_dir), start)] * WORKERS)
+
+
+def test_fresh_database_opened_by_many_workers(tmp_path):
+    columns = open_together(tmp_path)
+    assert all(c == columns[0] for c in columns)
+    assert {"version", "category", "threshold", "ref"} <= set(columns[0])
+
+
+def test_old_database_migrated_by_many_workers(tmp_path):
+    conn = sqlite3.connect(tmp_path / "inventory.db")
+    conn.execute("CREATE TABLE items (item_id TEXT PRIMARY KEY, name TEXT NOT NULL, "
+                 "quantity INTEGER NOT NULL, price REAL NOT NULL)")
+    conn.execute("INSERT INTO items VALUES ('A101', 'Apple', 5, 25.0)")
+    conn.commit()
+    conn.close()
+    columns = open_together(tmp_path)
+    assert all(c == columns[0] for c in columns)
+    app = load_app(tmp_path, "sqlite")
+    assert app.STORE.get("A101") == {"name": "Apple", "quantity": 5, "price": 25.0, "version": 0}
+
+
+def test_old_carts_database_migrated_by_many_workers(tmp_path):
+    conn = sqlite3.connect(tmp_path / "carts.db")
+    conn.executescript("""
+        CREATE TABLE carts (cart_id TEXT PRIMARY KEY, version INTEGER NOT NULL, touched REAL NOT NULL);
+        CREATE TABLE cart_lines (cart_id TEXT NOT NULL, item_id TEXT NOT NULL, name TEXT NOT NULL,
+                                 price REAL NOT NULL, quantity INTEGER NOT NULL, PRIMARY KEY (cart_id, item_id));
+    """)
+    conn.close()
+    open_together(tmp_path)
+    app = load_app(tmp_path, "sqlite")
+    conn = app.CARTS._conn()
+    assert "checkout" in {r["name"] for r in conn.execute("PRAGMA table_info(carts)")}
+    assert "expires" in {r["name"] for r in conn.execute("PRAGMA table_info(cart_lines)")}
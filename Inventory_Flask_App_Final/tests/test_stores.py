@@ -0,0 +1,61 @@
+import os
+import threading
+
+import pytest
+
+from conftest import load_app
+
+
+def fail_fsync(monkeypatch, app, times=1):
+    real, calls = os.fsync, []
+
+    def fsync(fd):
+        calls.append(fd)
+        if len(calls) <= times:
+            raise OSError("disk full")
+        return real(fd)
+    monkeypatch.setattr(app.os, "fsync", fsync)
+
+
+def quantities(module):
+    return {iid: d["quantity"] for iid, d in module.STORE.load_all().items()}
+
+
+@pytest.mark.parametrize("backend", ["json", "journal"])
+def test_failed_write_is_dropped_from_memory(app, backend, tmp_path, monkeypatch):
+    log_size = os.path.getsize(app.JOURNAL_FILE) if backend == "journal" else None
+    fail_fsync(monkeypatch, app)
+    with pytest.raises(OSError):
+        app.STORE.deduct({"I000": 2})
+    assert app.STORE.get("I000")["quantity"] == 20
+    assert app.INDEXES.record("I000")["quantity"] == 20
+    if backend == "journal":  # other workers must not replay it either
+        assert os.path.getsize(app.JOURNAL_FILE) == log_size
+    # the next, unrelated write must not carry the failed one to disk
+    app.STORE.deduct({"I001": 1})
+    on_disk = quantities(load_app(tmp_path, backend))
+    assert on_disk["I000"] == 20 and on_disk["I001"] == 19
+
+
+@pytest.mark.parametrize("backend", ["json", "journal"])
+def test_writers_sharing_a_failed_flush_all_fail(app, backend, tmp_path, monkeypatch):
+    app.STORE._committer._window = 0.05  # let the writers join one flush
+    fail_fsync(monkeypatch, app)
+    start, outcome = threading.Barrier(4), {}
+
+    def writer(iid):
+        start.wait()
+        try:
+            app.STORE.deduct({iid: 1})
+            outcome[iid] = "ok"
+        except OSError:
+            outcome[iid] = "failed"
+    iids = ["I000", "I001", "I002", "I003"]
+    threads = [threading.Thread(target=writer, args=(iid,)) for iid in iids]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert "failed" in outcome.values()
+    # every acknowledged write is on disk, and no failed one is
+    on_disk = quantities(load_app(tmp_path, backend))
+    assert on_disk == {**quantities(app), **{iid: 20 - (outcome[iid] == "ok") for iid in iids}}
+    assert quantities(app) == on_disk
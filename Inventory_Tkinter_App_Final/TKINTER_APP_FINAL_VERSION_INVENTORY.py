@@ -1,5 +1,9 @@
 import os
+import bisect
 import json
+import tempfile
+import time
+from collections import defaultdict
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 
@@ -7,6 +11,8 @@ from tkinter import ttk, messagebox, simpledialog
 # Config
 # -------------------------
 FILE_NAME = "inventory.json"
+REFS_FILE = FILE_NAME + ".refs"  # last purchase ref number handed out
+SALES_FILE = "sales.ndjson"  # append-only ledger, one sale per line
 LOW_STOCK_THRESHOLD = 5
 APP_BG = "#2b2b2b"
 HEADER_BG = "#1f1f1f"
@@ -17,13 +23,21 @@ SECONDARY_TEXT = "#CCCCCC"
 # -------------------------
 # Persistence helpers
 # -------------------------
+class InventoryCorruptError(RuntimeError):
+    """inventory.json exists but can't be parsed; refuse to treat it as empty."""
+
+class LedgerCorruptError(RuntimeError):
+    """The last sale in SALES_FILE can't be read; refuse to number (or
+    truncate) past it."""
+
 def load_inventory():
     if os.path.exists(FILE_NAME):
         with open(FILE_NAME, "r") as f:
             try:
                 data = json.load(f)
-            except json.JSONDecodeError:
-                return {}
+            except json.JSONDecodeError as e:
+                # loading it as {} would let the next save wipe the file
+                raise InventoryCorruptError(f"{FILE_NAME} is not valid JSON: {e}") from e
         # normalize older key names: 'quantity' -> 'qty'
         for k, v in data.items():
             if "quantity" in v and "qty" not in v:
@@ -31,9 +45,245 @@ def load_inventory():
         return data
     return {}
 
+def _write_atomic(path, data):
+    """Replace `path` with `data` (a dict, dumped as JSON) all at once: it is
+    written to a fsynced temp file next to it and renamed over it, so a
+    crash leaves the old file or the new one, never a truncated one."""
+    path = os.path.abspath(path)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if os.name == "posix":  # make the rename durable
+        fd = os.open(os.path.dirname(path), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
 def save_inventory(inv):
-    with open(FILE_NAME, "w") as f:
-        json.dump(inv, f, indent=4)
+    _write_atomic(FILE_NAME, inv)
+
+def assign_refs(inv, iids):
+    """Give each listed item without a 'ref' the next purchase ref number.
+
+    Refs are stored with the items and the last one handed out is kept in
+    REFS_FILE, so an item keeps its ref and a deleted item's ref is never
+    reused. Returns the ids that were numbered.
+    """
+    iids = [iid for iid in iids if inv[iid].get('ref') is None]
+    if not iids:
+        return []
+    try:
+        with open(REFS_FILE, "r") as f:
+            last = json.load(f)["last_ref"]
+    except (OSError, ValueError, KeyError):
+        last = 0
+    last = max([last] + [d.get('ref') or 0 for d in inv.values()])
+    for iid in iids:
+        last += 1
+        inv[iid]['ref'] = last
+    _write_atomic(REFS_FILE, {"last_ref": last})
+    return iids
+
+def _ledger_tail():
+    """(invoice number of the last sale, end offset of its line) in
+    SALES_FILE, read from the end of the file; (0, 0) if there are none.
+
+    Bytes after the last newline are a torn, unfinished append and don't
+    count. A complete last line that doesn't parse raises
+    LedgerCorruptError: taking it for an empty ledger would reuse invoice
+    numbers and let record_sale cut the file.
+    """
+    try:
+        f = open(SALES_FILE, "rb")
+    except FileNotFoundError:
+        return 0, 0
+    with f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        # read back until the tail holds the whole last complete line
+        while pos and b"\n" not in tail[:max(tail.rfind(b"\n"), 0)]:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            tail = f.read(step) + tail
+    end = tail.rfind(b"\n") + 1
+    if not end:
+        return 0, 0  # nothing but a torn first append
+    line = tail[tail.rfind(b"\n", 0, end - 1) + 1:end - 1]
+    try:
+        return json.loads(line)["invoice"], pos + end
+    except (ValueError, KeyError, TypeError) as e:
+        raise LedgerCorruptError(f"{SALES_FILE}: the last sale at byte {pos + end - len(line) - 1} "
+                                 f"can't be read ({e!r}); no sale was recorded") from e
+
+def record_sale(lines, total):
+    """Append a sale ({"id", "name", "qty", "price", "subtotal"} lines) to
+    SALES_FILE under the next invoice number, which is returned. Only a
+    torn unfinished line at the end is overwritten; raises
+    LedgerCorruptError, writing nothing, if the last sale is unreadable."""
+    invoice, end = _ledger_tail()
+    sale = {"invoice": invoice + 1, "created": time.time(), "lines": lines, "total": total}
+    with open(SALES_FILE, "ab") as f:
+        f.truncate(end)
+        f.write(json.dumps(sale, separators=(",", ":")).encode("utf-8") + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return invoice + 1
+
+# -------------------------
+# Fuzzy search index
+# -------------------------
+def edit_distance(a, b, limit):
+    """Edit distance counting a swap of neighbours as one edit; returns
+    limit + 1 as soon as it is known to exceed `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+class FuzzyNameIndex:
+    """Typo-tolerant lookup of name words (SymSpell-style deletion dictionary).
+
+    Each name word is filed under its variants with up to MAX_EDITS letters
+    deleted; a query word is expanded the same way and only words sharing a
+    variant are compared, so a search never walks every name.
+    """
+    MAX_EDITS = 2
+
+    def __init__(self, inventory=None):
+        self.deletes = defaultdict(set)  # deletion variant -> words
+        self.words = defaultdict(set)    # word -> item ids
+        self.names = {}                  # item id -> indexed name
+        for iid, d in (inventory or {}).items():
+            self.set(iid, d.get('name', ''))
+
+    @staticmethod
+    def _variants(word, edits):
+        found = frontier = {word}
+        for _ in range(edits):
+            frontier = {w[:i] + w[i+1:] for w in frontier for i in range(len(w))}
+            found = found | frontier
+        return found
+
+    def set(self, iid, name):
+        """Index (or re-index) an item's name."""
+        if self.names.get(iid) == name:
+            return
+        self.discard(iid)
+        self.names[iid] = name
+        for word in name.lower().split():
+            if not self.words[word]:
+                for v in self._variants(word, self.MAX_EDITS):
+                    self.deletes[v].add(word)
+            self.words[word].add(iid)
+
+    def discard(self, iid):
+        name = self.names.pop(iid, None)
+        if name is None:
+            return
+        for word in name.lower().split():
+            ids = self.words.get(word)
+            if ids is None:
+                continue
+            ids.discard(iid)
+            if not ids:
+                del self.words[word]
+                for v in self._variants(word, self.MAX_EDITS):
+                    self.deletes[v].discard(word)
+                    if not self.deletes[v]:
+                        del self.deletes[v]
+
+    def search(self, term):
+        """Item ids whose name has a word close to every word of `term`,
+        closest first. Words of 1-3 letters must match exactly, up to 6
+        letters one typo is allowed, longer ones two."""
+        scores = None
+        for word in term.lower().split():
+            k = min(self.MAX_EDITS, (len(word) - 1) // 3)
+            candidates = set()
+            for v in self._variants(word, k):
+                candidates |= self.deletes.get(v, set())
+            hits = {}
+            for w in candidates:
+                d = edit_distance(word, w, k)
+                if d <= k:
+                    for iid in self.words[w]:
+                        hits[iid] = min(d, hits.get(iid, d))
+            scores = hits if scores is None else {i: scores[i] + d for i, d in hits.items() if i in scores}
+            if not scores:
+                return []
+        return sorted(scores or {}, key=lambda i: (scores[i], i))
+
+class SortedIndex:
+    """Item ids kept sorted by key(item_id, details); keys end with the id.
+
+    Adding, changing or removing an item is a bisect each, so ordered views
+    (catalog by name, low stock by quantity) read items in order without
+    sorting or scanning the inventory again.
+    """
+
+    def __init__(self, key, inventory=None):
+        self.key = key
+        self.item_keys = {iid: key(iid, d) for iid, d in (inventory or {}).items()}
+        self.keys = sorted(self.item_keys.values())
+
+    def set(self, iid, details):
+        k = self.key(iid, details)
+        if self.item_keys.get(iid) == k:
+            return
+        self.discard(iid)
+        self.item_keys[iid] = k
+        bisect.insort(self.keys, k)
+
+    def discard(self, iid):
+        k = self.item_keys.pop(iid, None)
+        if k is not None:
+            del self.keys[bisect.bisect_left(self.keys, k)]
+
+    def __iter__(self):
+        return (k[-1] for k in self.keys)
+
+    def below(self, bound):
+        """Item ids whose key sorts before `bound`, in order."""
+        return (k[-1] for k in self.keys[:bisect.bisect_left(self.keys, bound)])
+
+# -------------------------
+# Reserved stock overlay
+# -------------------------
+class ReservedView:
+    """Read-only view of the inventory with reserved quantities taken off.
+
+    Available stock is worked out per item when asked for; the inventory
+    itself is never copied or changed while items are only reserved.
+    """
+
+    def __init__(self, inventory, reserved=None):
+        self.inventory = inventory
+        self.reserved = reserved if reserved is not None else {}
+
+    def available(self, iid):
+        d = self.inventory[iid]
+        return max(0, d.get('qty', d.get('quantity', 0)) - self.reserved.get(iid, 0))
 
 # -------------------------
 # App
@@ -49,7 +299,24 @@ class InventoryApp(tk.Tk):
         self.minsize(400, 300) # Set a sensible minimum size for the scrollable window
 
         # Load inventory (dict keyed by item_id)
-        self.inventory = load_inventory()
+        try:
+            self.inventory = load_inventory()
+        except InventoryCorruptError as e:
+            messagebox.showerror("Inventory file damaged",
+                                 f"{e}\n\nNothing was loaded or changed. Restore the file from a backup "
+                                 "and start the app again.")
+            self.destroy()
+            raise SystemExit(1)
+        # items saved before refs existed are numbered in file order, as the
+        # purchase window used to number them
+        if assign_refs(self.inventory, list(self.inventory)):
+            save_inventory(self.inventory)
+        # search/ordering indexes; every change to self.inventory calls _reindex
+        self.fuzzy = FuzzyNameIndex(self.inventory)
+        self.by_name = SortedIndex(lambda iid, d: (d.get('name','').lower(), iid), self.inventory)
+        self.by_qty = SortedIndex(lambda iid, d: (d.get('qty',0), iid), self.inventory)
+        self.by_ref = SortedIndex(lambda iid, d: (d['ref'], iid), self.inventory)
+        self.refs = {d['ref']: iid for iid, d in self.inventory.items()}  # ref -> item id
 
         # ----------------------------------------------------
         # 🔥 START OF VISUALIZATION CHANGES 🔥
@@ -170,6 +437,9 @@ class InventoryApp(tk.Tk):
         self.search_var = tk.StringVar()
         search_entry = tk.Entry(search_frm, textvariable=self.search_var, width=25, font=("Helvetica", 10))
         search_entry.pack(side="left")
+        self.fuzzy_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(search_frm, text="Typos", variable=self.fuzzy_var, bg=APP_BG, fg=SECONDARY_TEXT,
+                       selectcolor="#444444", activebackground=APP_BG).pack(side="left", padx=(6,0))
         tk.Button(search_frm, text="Go", bg="#607D8B", fg="white", command=self._search_and_show, **{"padx":8,"pady":6,"bd":0}).pack(side="left", padx=6)
         tk.Button(search_frm, text="Clear", bg="#455A64", fg="white", command=self._clear_search, **{"padx":8,"pady":6,"bd":0}).pack(side="left")
 
@@ -196,25 +466,28 @@ class InventoryApp(tk.Tk):
         style.configure("Treeview.Heading", font=("Helvetica", 11, "bold"), background="#3a3a3a", foreground=TEXT_COLOR)
         style.map('Treeview', background=[('selected', '#5a95ff')], foreground=[('selected', 'white')])
 
-    def populate_tree(self, filter_keyword=None, reserved=None):
+    def populate_tree(self, filter_keyword=None, reserved=None, item_ids=None):
         """
         Populate the main tree. If `reserved` is provided (dict iid->reserved_qty),
         displayed qty will be inventory_qty - reserved_qty (but underlying self.inventory unchanged).
+        `item_ids` (e.g. fuzzy search hits) shows just those items, in that order.
+        Returns the number of rows shown.
         """
-        if reserved is None:
-            reserved = {}
+        stock = ReservedView(self.inventory, reserved)
         for r in self.tree.get_children():
             self.tree.delete(r)
-        items = list(self.inventory.items())
+        if item_ids is not None:
+            items = [(iid, self.inventory[iid]) for iid in item_ids if iid in self.inventory]
+        else:
+            items = list(self.inventory.items())
         if filter_keyword:
             k = filter_keyword.lower()
             items = [it for it in items if k == it[0].lower() or k in it[1].get('name','').lower()]
         for idx, (iid, info) in enumerate(items):
             bg = "#333333" if idx % 2 == 0 else "#3b3b3b"
-            base_qty = info.get("qty", info.get("quantity",0))
-            display_qty = max(0, base_qty - reserved.get(iid, 0))
-            self.tree.insert("", "end", iid=iid, values=(iid, info.get("name",""), display_qty, f"{info.get('price',0):.2f}"), tags=(bg,))
+            self.tree.insert("", "end", iid=iid, values=(iid, info.get("name",""), stock.available(iid), f"{info.get('price',0):.2f}"), tags=(bg,))
             self.tree.tag_configure(bg, background=bg, foreground=TEXT_COLOR)
+        return len(items)
 
     # -------------------------
     # Utilities (no change needed here)
@@ -225,6 +498,23 @@ class InventoryApp(tk.Tk):
         x = (ws // 2) - (w // 2); y = (hs // 2) - (h // 2)
         win.geometry(f"{w}x{h}+{x}+{y}")
 
+    def _reindex(self, *iids):
+        """Bring the search/ordering indexes in line with self.inventory
+        for the given (added, changed or deleted) items."""
+        for iid in iids:
+            d = self.inventory.get(iid)
+            if d is None:
+                old = self.by_ref.item_keys.get(iid)
+                if old is not None:
+                    self.refs.pop(old[0], None)
+                self.fuzzy.discard(iid); self.by_name.discard(iid); self.by_qty.discard(iid); self.by_ref.discard(iid)
+            else:
+                self.fuzzy.set(iid, d.get('name',''))
+                self.by_name.set(iid, d)
+                self.by_qty.set(iid, d)
+                self.by_ref.set(iid, d)
+                self.refs[d['ref']] = iid
+
     def _selected_item_id(self):
         sel = self.tree.selection()
         if not sel:
@@ -240,7 +530,12 @@ class InventoryApp(tk.Tk):
         if not kw:
             self.populate_tree()
             return
-        self.populate_tree(filter_keyword=kw)
+        if self.fuzzy_var.get():
+            self.populate_tree(item_ids=self.fuzzy.search(kw))
+            return
+        if not self.populate_tree(filter_keyword=kw):
+            # nothing matched as typed: most misses are typos, show close names
+            self.populate_tree(item_ids=self.fuzzy.search(kw))
 
     def _clear_search(self):
         self.search_var.set("")
@@ -294,6 +589,8 @@ class InventoryApp(tk.Tk):
                 messagebox.showerror("Error", "Item ID already exists", parent=win)
                 return
             self.inventory[iid] = {"name": name, "qty": q, "price": p}
+            assign_refs(self.inventory, [iid])
+            self._reindex(iid)
             save_inventory(self.inventory)
             self.populate_tree()
             messagebox.showinfo("Success", f"Item '{name}' added.", parent=win)
@@ -365,6 +662,7 @@ class InventoryApp(tk.Tk):
                     messagebox.showwarning("Warning", "Invalid price; skipping price update.", parent=win)
 
             self.inventory[iid] = details
+            self._reindex(iid)
             save_inventory(self.inventory)
             self.populate_tree()
             messagebox.showinfo("Success", f"Item '{details['name']}' updated.", parent=win)
@@ -381,6 +679,7 @@ class InventoryApp(tk.Tk):
         details = self.inventory[iid]
         if messagebox.askyesno("Confirm Delete", f"Do you want to DELETE the entire item '{details['name']}'?", parent=self):
             del self.inventory[iid]
+            self._reindex(iid)
             save_inventory(self.inventory)
             self.populate_tree()
             messagebox.showinfo("Deleted", f"Item '{details['name']}' deleted.", parent=self)
@@ -392,6 +691,7 @@ class InventoryApp(tk.Tk):
         if qty >= details.get('qty',0):
             if messagebox.askyesno("Confirm", "Requested qty >= stock. Delete entire item instead?", parent=self):
                 del self.inventory[iid]
+                self._reindex(iid)
                 save_inventory(self.inventory)
                 self.populate_tree()
                 messagebox.showinfo("Deleted", f"Item '{details['name']}' deleted.", parent=self)
@@ -401,6 +701,7 @@ class InventoryApp(tk.Tk):
                 return
         details['qty'] = details.get('qty',0) - qty
         self.inventory[iid] = details
+        self._reindex(iid)
         save_inventory(self.inventory)
         self.populate_tree()
         messagebox.showinfo("Updated", f"{qty} units removed from '{details['name']}'. New qty: {details['qty']}", parent=self)
@@ -426,8 +727,21 @@ class InventoryApp(tk.Tk):
         tv.configure(yscroll=vs.set)
         vs.pack(side="right", fill="y")
 
-        for iid, d in sorted(self.inventory.items(), key=lambda x: x[1].get('name','').lower()):
-            tv.insert("", "end", values=(iid, d.get('name',''), f"{d.get('price',0):.2f}"))
+        # stream rows from the name index in batches so a big catalog
+        # opens at once instead of blocking on one long insert loop
+        rows = iter(self.by_name)
+
+        def fill(batch=500):
+            if not tv.winfo_exists():
+                return  # window closed mid-stream
+            for iid in rows:
+                d = self.inventory[iid]
+                tv.insert("", "end", values=(iid, d.get('name',''), f"{d.get('price',0):.2f}"))
+                batch -= 1
+                if batch == 0:
+                    win.after(1, fill)
+                    return
+        fill()
 
     # -------------------------
     # Low stock items (button) (no change needed here)
@@ -447,9 +761,10 @@ class InventoryApp(tk.Tk):
             tv.column(c, width=180 if c=="Name" else 120, anchor="center")
         tv.pack(fill="both", expand=True, padx=12, pady=12)
 
-        for iid, d in self.inventory.items():
-            if d.get('qty',0) < LOW_STOCK_THRESHOLD:
-                tv.insert("", "end", values=(iid, d.get('name',''), d.get('qty',0)))
+        # lowest stock first, straight from the quantity index
+        for iid in self.by_qty.below((LOW_STOCK_THRESHOLD,)):
+            d = self.inventory[iid]
+            tv.insert("", "end", values=(iid, d.get('name',''), d.get('qty',0)))
 
     # -------------------------
     # Purchase window with ref map and cart visible (no change needed here)
@@ -467,6 +782,7 @@ class InventoryApp(tk.Tk):
 
         # This dict holds temporary reserved quantities while purchase window is open
         reserved = {}  # iid -> reserved_qty
+        stock = ReservedView(self.inventory, reserved)  # inventory minus reserved, read-only
 
         top_frm = tk.Frame(win, bg=APP_BG)
         top_frm.pack(fill="x", padx=12, pady=(8,4))
@@ -478,11 +794,10 @@ class InventoryApp(tk.Tk):
             ref_tv.heading(c, text=c); ref_tv.column(c, width=w, anchor="center")
         ref_tv.pack(fill="x", padx=12, pady=(4,6))
 
-        # build ref_map
-        ref_map = {}
-        for idx, (iid, d) in enumerate(self.inventory.items(), 1):
-            ref_map[str(idx)] = iid
-            ref_tv.insert("", "end", values=(idx, iid, d.get('name',''), f"{d.get('price',0):.2f}", d.get('qty',0)))
+        # ref map, in ref order; refs are the items' own and self.refs looks them up
+        for iid in self.by_ref:
+            d = self.inventory[iid]
+            ref_tv.insert("", "end", values=(d['ref'], iid, d.get('name',''), f"{d.get('price',0):.2f}", d.get('qty',0)))
 
         # Cart list area
         cart_frame = tk.LabelFrame(win, text="Cart", bg=APP_BG, fg=TEXT_COLOR)
@@ -508,10 +823,9 @@ class InventoryApp(tk.Tk):
             # clear and re-insert with updated stock (inventory_qty - reserved)
             for r in ref_tv.get_children():
                 ref_tv.delete(r)
-            for idx, (iid, d) in enumerate(self.inventory.items(), 1):
-                base_qty = d.get('qty',0)
-                display_qty = max(0, base_qty - reserved.get(iid, 0))
-                ref_tv.insert("", "end", values=(idx, iid, d.get('name',''), f"{d.get('price',0):.2f}", display_qty))
+            for iid in self.by_ref:
+                d = self.inventory[iid]
+                ref_tv.insert("", "end", values=(d['ref'], iid, d.get('name',''), f"{d.get('price',0):.2f}", stock.available(iid)))
 
         def refresh_main_tree():
             """Refresh main tree to show display_qty = inventory_qty - reserved_qty (visual only)."""
@@ -520,14 +834,15 @@ class InventoryApp(tk.Tk):
         def add_to_cart():
             win.lift(); win.focus_force()
             r = ref_ent.get().strip()
-            if r not in ref_map:
+            iid = self.refs.get(int(r)) if r.isascii() and r.isdigit() else None
+            if iid is None:
                 messagebox.showerror("Error", "Invalid Ref No.", parent=win); return
             try:
                 q = int(qty_ent.get().strip())
             except:
                 messagebox.showerror("Error", "Invalid quantity.", parent=win); return
-            iid = ref_map[r]; item = self.inventory[iid]
-            available = item.get('qty',0) - reserved.get(iid, 0)
+            item = self.inventory[iid]
+            available = stock.available(iid)
             if q <= 0 or q > available:
                 messagebox.showerror("Error", f"Qty must be 1 - {available}", parent=win); return
             # update cart and reserved (temporary)
@@ -577,7 +892,18 @@ class InventoryApp(tk.Tk):
             for iid, rqty in reserved.items():
                 if iid in self.inventory:
                     self.inventory[iid]['qty'] = max(0, self.inventory[iid].get('qty',0) - rqty)
+            self._reindex(*reserved)
             save_inventory(self.inventory)
+            # keep the sale in the ledger and put its invoice number on the bill
+            try:
+                invoice = record_sale([{"id": c['id'], "name": c['name'], "qty": c['qty'], "price": c['price'],
+                                        "subtotal": c['qty'] * c['price']} for c in cart], total)
+            except LedgerCorruptError as e:
+                # the stock is already taken; show the bill, just without a number
+                messagebox.showerror("Sales ledger damaged", f"{e}\n\nRepair {SALES_FILE} before the next sale.",
+                                     parent=win)
+            else:
+                lines.insert(2, "{:^44}".format(f"Invoice: INV-{invoice:06d}"))
             # refresh main view (now permanent)
             self.populate_tree()
 
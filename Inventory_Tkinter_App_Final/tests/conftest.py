@@ -0,0 +1,18 @@
+import importlib.util
+import os
+
+import pytest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                   "TKINTER_APP_FINAL_VERSION_INVENTORY.py")
+
+
+@pytest.fixture
+def tk_app(tmp_path, monkeypatch):
+    """The app module, working in an empty temporary directory (its data
+    files are relative to the working directory). No window is opened."""
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location("tk_inventory_app", APP)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
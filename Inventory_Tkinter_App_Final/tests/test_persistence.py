@@ -0,0 +1,71 @@
+import json
+import os
+
+import pytest
+
+
+def test_save_replaces_file_whole(tk_app):
+    tk_app.save_inventory({"A101": {"name": "Apple", "qty": 5, "price": 25.0}})
+    tk_app.save_inventory({"B101": {"name": "Banana", "qty": 2, "price": 10.0}})
+    assert tk_app.load_inventory() == {"B101": {"name": "Banana", "qty": 2, "price": 10.0}}
+    assert os.listdir(".") == ["inventory.json"]  # no temp files left behind
+
+
+def test_failed_save_keeps_old_file(tk_app):
+    tk_app.save_inventory({"A101": {"name": "Apple", "qty": 5, "price": 25.0}})
+    with pytest.raises(TypeError):
+        tk_app.save_inventory({"A101": {"name": object()}})
+    assert tk_app.load_inventory()["A101"]["name"] == "Apple"
+    assert os.listdir(".") == ["inventory.json"]
+
+
+def test_corrupt_file_is_not_loaded_as_empty(tk_app):
+    with open("inventory.json", "w") as f:
+        f.write('{"A101": {"name": "Ap')
+    with pytest.raises(tk_app.InventoryCorruptError):
+        tk_app.load_inventory()
+    with open("inventory.json") as f:
+        assert f.read() == '{"A101": {"name": "Ap'
+
+
+def test_refs_file_written_atomically(tk_app):
+    inv = {"A101": {"name": "Apple", "qty": 5, "price": 25.0}}
+    assert tk_app.assign_refs(inv, ["A101"]) == ["A101"]
+    with open(tk_app.REFS_FILE) as f:
+        assert json.load(f) == {"last_ref": 1}
+
+
+LINE = [{"id": "A101", "name": "Apple", "qty": 1, "price": 25.0, "subtotal": 25.0}]
+
+
+def test_sales_are_numbered_in_order(tk_app):
+    assert [tk_app.record_sale(LINE, 25.0) for _ in range(3)] == [1, 2, 3]
+    with open("sales.ndjson", "rb") as f:
+        assert [json.loads(line)["invoice"] for line in f] == [1, 2, 3]
+
+
+def test_torn_append_is_replaced(tk_app):
+    tk_app.record_sale(LINE, 25.0)
+    with open("sales.ndjson", "ab") as f:
+        f.write(b'{"invoice":2,"created":')
+    assert tk_app.record_sale(LINE, 25.0) == 2
+    with open("sales.ndjson", "rb") as f:
+        assert [json.loads(line)["invoice"] for line in f] == [1, 2]
+
+
+def test_long_sale_lines_are_read_back_whole(tk_app):
+    tk_app.record_sale(LINE * 500, 12500.0)  # one line longer than a read step
+    assert tk_app.record_sale(LINE * 500, 12500.0) == 2
+    assert tk_app.record_sale(LINE, 25.0) == 3
+
+
+def test_corrupt_last_sale_keeps_ledger(tk_app):
+    tk_app.record_sale(LINE, 25.0)
+    with open("sales.ndjson", "ab") as f:
+        f.write(b"garbage\n")
+    with open("sales.ndjson", "rb") as f:
+        before = f.read()
+    with pytest.raises(tk_app.LedgerCorruptError):
+        tk_app.record_sale(LINE, 25.0)
+    with open("sales.ndjson", "rb") as f:
+        assert f.read() == before